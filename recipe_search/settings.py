@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'accounts.apps.AccountConfig',
     'recipes.apps.RecipesConfig',
     'search.apps.SearchConfig',
@@ -109,6 +110,105 @@ else:
 
 AUTH_USER_MODEL = 'accounts.MyUser'
 
+# Cache of the rendered ingredients and steps of the recipe pages, point it to
+# a memcached or redis server to share it between the processes
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Lifetime in seconds of a cached recipe body, the body is also dropped when
+# the recipe, its ingredients or its steps are written
+
+RECIPE_CACHE_TTL = 3600
+
+# Lifetime in seconds of the recipe pages in the HTTP caches, they are then
+# revalidated with their ETag
+
+RECIPE_HTTP_MAX_AGE = 0
+
+# Number of similar recipes displayed on a recipe page, the similarity index
+# is built with the build_similar_recipes command
+
+SIMILAR_RECIPES_SIZE = 4
+
+# Recipe search
+# 'icontains' for substring matching, 'fulltext' for PostgreSQL full text search
+# 'fuzzy' for typo tolerant matching with the pg_trgm extension
+# 'index' for the in memory inverted index built by each process at startup
+
+SEARCH_MODE = 'icontains'
+
+# Minimum word similarity of a fuzzy match, between 0 and 1, passed to the
+# server in the options of the connections
+
+SEARCH_TRIGRAM_THRESHOLD = 0.6
+
+DATABASES['default']['OPTIONS'] = {
+    'options': '-c pg_trgm.word_similarity_threshold='
+               f'{SEARCH_TRIGRAM_THRESHOLD}',
+}
+
+# Minimum length of the query words, the shorter words and the stop words are
+# ignored unless prefixed by an operator
+
+SEARCH_MIN_TERM_LENGTH = 2
+
+# Number of parsed queries and of compiled query plans kept by each process
+
+SEARCH_PLAN_CACHE_SIZE = 512
+
+# Search backend ranking the results pages
+# 'search.search.PostgresBackend' to rank in the database
+# 'search.sqlite.SqliteBackend' to rank in the local SQLite file below,
+# built with the rebuild_search_backend command, icontains mode only
+
+SEARCH_BACKEND = 'search.search.PostgresBackend'
+
+SEARCH_SQLITE_PATH = os.path.join(BASE_DIR, 'search.sqlite3')
+
+# Number of ranked results lists kept by each process, 0 to disable the cache
+# and lifetime of an entry in seconds
+
+SEARCH_CACHE_SIZE = 1024
+
+SEARCH_CACHE_TTL = 300
+
+# Spelling corrections of the query terms: maximum number of edits of a
+# correction, file of the precomputed dictionary built with the
+# build_spelling_dictionary command, None to build it in memory at startup,
+# and whether a query without results is retried with the corrected terms
+
+SEARCH_SPELLING_DISTANCE = 2
+
+SEARCH_SPELLING_PATH = os.path.join(BASE_DIR, 'search_spelling.json')
+
+SEARCH_SPELLING_RETRY = True
+
+# Number of recipes displayed in a page of search results
+
+SEARCH_PAGE_SIZE = 20
+
+# Maximum number of queries of a batch search request
+
+SEARCH_BATCH_SIZE = 50
+
+# Number of recipes fetched at a time by the streamed search exports
+
+SEARCH_EXPORT_CHUNK_SIZE = 500
+
+# Lifetime in seconds of the search results pages in the HTTP caches
+
+SEARCH_HTTP_MAX_AGE = 300
+
+# Default and maximum number of ingredient names suggested in the search box
+
+AUTOCOMPLETE_SIZE = 10
+
+AUTOCOMPLETE_MAX_SIZE = 50
+
 LOGIN_URL = 'login'
 
 LOGOUT_REDIRECT_URL = 'landing'
@@ -37,5 +37,11 @@ urlpatterns = [
          recipes_views.update_recipe, name='recipeUpdate'),
     path('recipe/list', recipes_views.show_list, name='userList'),
     path('recipe/vote/<int:rid>', recipes_views.add_vote_result, name='vote'),
+    path('search', search_views.search, name='search'),
+    path('search/batch', search_views.batch, name='searchBatch'),
+    path('search/export', search_views.export, name='searchExport'),
+    path('search/pantry', search_views.pantry, name='pantry'),
+    path('search/suggest', search_views.suggest, name='searchSuggest'),
+    path('search/stats', search_views.stats, name='searchStats'),
     path('', search_views.landing, name='landing'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
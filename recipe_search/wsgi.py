@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recipe_search.settings')
 
 application = get_wsgi_application()
+
+# build the in memory search index before serving the first request
+if settings.SEARCH_MODE == 'index':
+    from search.index import search_index
+    search_index.build()
@@ -1,9 +1,12 @@
 """Register models for admin app"""
 from django.contrib import admin
 
-from .models import Categories, Content, Ingredients, Recipes
+from .models import CanonicalIngredients, Categories, Content, Ingredients, \
+    Recipes, SynonymGroups
 
+admin.site.register(CanonicalIngredients)
 admin.site.register(Categories)
 admin.site.register(Content)
 admin.site.register(Ingredients)
 admin.site.register(Recipes)
+admin.site.register(SynonymGroups)
@@ -3,9 +3,30 @@ Django app declaration
 Recipes is a Django application managing the user created recipes
 """
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_delete, \
+    pre_save
 
 
 class RecipesConfig(AppConfig):
     """Recipes configuration"""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from .models import Content, Ingredients, Recipes, SynonymGroups
+        from .signals import fold_name, link_canonical_ingredient, \
+            link_synonym_group, unlink_synonym_group, refresh_signature, \
+            remove_signature, touch_recipe, recipe_content_changed, \
+            content_changed, mark_deleting_recipe, unmark_deleting_recipe
+        pre_save.connect(fold_name, sender=Recipes)
+        pre_save.connect(link_canonical_ingredient, sender=Ingredients)
+        post_save.connect(link_synonym_group, sender=SynonymGroups)
+        pre_delete.connect(unlink_synonym_group, sender=SynonymGroups)
+        post_save.connect(refresh_signature, sender=Ingredients)
+        post_delete.connect(refresh_signature, sender=Ingredients)
+        post_delete.connect(remove_signature, sender=Recipes)
+        pre_delete.connect(mark_deleting_recipe, sender=Recipes)
+        post_delete.connect(unmark_deleting_recipe, sender=Recipes)
+        post_delete.connect(touch_recipe, sender=Ingredients)
+        post_delete.connect(touch_recipe, sender=Content)
+        recipe_content_changed.connect(content_changed)
@@ -0,0 +1,49 @@
+"""
+Management command filling the folded names of the existing recipes
+"""
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipes
+from recipes.normalize import fold_text
+
+
+class Command(BaseCommand):
+    """
+    Store the folded name of the recipes, by batches
+    The folded names are filled by migration 0006, the command updates them
+    after a change of recipes.normalize.fold_text
+    """
+    help = "Fill the folded names of the existing recipes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="number of rows updated per query")
+
+    def handle(self, *args, **options):
+        updated = self.backfill(Recipes, options["batch_size"])
+        self.stdout.write(f"{updated} recipes updated")
+
+    @staticmethod
+    def backfill(model, batch_size):
+        """
+        Update the rows whose folded name is out of date
+        :param model: the model of the rows, Recipes
+        :param batch_size: the number of rows read and updated per query
+        :return: the number of updated rows
+        """
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(model.objects.filter(id__gt=last_id).order_by("id").
+                         only("id", "name", "folded_name")[:batch_size])
+            if not batch:
+                return updated
+            stale = []
+            for row in batch:
+                folded_name = fold_text(row.name)
+                if row.folded_name != folded_name:
+                    row.folded_name = folded_name
+                    stale.append(row)
+            model.objects.bulk_update(stale, ["folded_name"])
+            updated += len(stale)
+            last_id = batch[-1].id
@@ -0,0 +1,134 @@
+"""
+Management command computing the ingredient signatures of all the recipes
+"""
+import os
+import time
+
+from collections import deque
+from itertools import groupby
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import minhash
+from recipes.models import Ingredients, Recipes, SignatureChanges
+from recipes.similar import similar_index
+
+
+def recipe_batches(batch_size):
+    """
+    :param batch_size: the number of recipes per batch
+    :return: an iterator over the lists of the (recipe id, canonical ids)
+             tuples of the recipes having ingredients
+    """
+    rows = Ingredients.objects.filter(canonical__isnull=False).order_by(
+        "recipe_id").values_list("recipe_id", "canonical_id").iterator()
+    batch = []
+    for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+        batch.append((recipe_id, [canonical_id for _, canonical_id in group]))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    """
+    Compute the MinHash signature of the ingredients of every recipe
+    The batches of recipes read from the database are hashed by a pool of
+    worker processes, the signatures are written by the main process, each
+    batch in its own transaction so that the rows are only locked briefly.
+    The recipes left without ingredients lose their signature at the end.
+    Only the changed signatures are written and logged, the processes apply
+    them to their index once the version is moved at the end
+    """
+    help = "Compute the ingredient signatures used by the similar recipes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="number of processes computing the "
+                                 "signatures, defaults to the number of CPUs")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="number of recipes hashed per task")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        workers = max(1, options["workers"] or 1)
+        batches = recipe_batches(options["batch_size"])
+        if workers == 1:
+            count = sum(self.store(minhash.signatures(batch))
+                        for batch in batches)
+        else:
+            with Pool(workers) as pool:
+                count = self.run_pool(pool, workers, batches)
+        self.store_emptied()
+        similar_index.next_version()
+        similar_index.clear()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{count} signatures computed by {workers} "
+                          f"processes in {elapsed:.2f}s")
+
+    def run_pool(self, pool, workers, batches):
+        """
+        Hash the batches in the pool, keeping two tasks per worker queued so
+        that the database is read and written by the main thread only
+        :param pool: the pool of worker processes
+        :param workers: the number of processes of the pool
+        :param batches: the iterator over the batches of recipes
+        :return: the number of stored signatures
+        """
+        count = 0
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(minhash.signatures, (batch,)))
+            if len(pending) >= 2 * workers:
+                count += self.store(pending.popleft().get())
+        while pending:
+            count += self.store(pending.popleft().get())
+        return count
+
+    @staticmethod
+    def store(signatures):
+        """
+        Write and log the changed signatures of a batch in one transaction
+        :param signatures: the list of the (recipe id, encoded signature)
+                           tuples of a batch
+        :return: the number of computed signatures
+        """
+        with transaction.atomic():
+            stored = dict(Recipes.objects.select_for_update().filter(
+                id__in=[recipe_id for recipe_id, _ in signatures]).
+                values_list("id", "ingredients_signature"))
+            changed = [(recipe_id, data) for recipe_id, data in signatures
+                       if recipe_id in stored and
+                       (stored[recipe_id] and bytes(stored[recipe_id])) !=
+                       data]
+            Recipes.objects.bulk_update(
+                [Recipes(id=recipe_id, ingredients_signature=data)
+                 for recipe_id, data in changed],
+                ["ingredients_signature"])
+            SignatureChanges.objects.bulk_create(
+                [SignatureChanges(recipe_id=recipe_id,
+                                  ingredients_signature=data)
+                 for recipe_id, data in changed])
+        return len(signatures)
+
+    @staticmethod
+    def store_emptied():
+        """
+        Remove and log the signatures of the recipes left without canonical
+        ingredients
+        """
+        with transaction.atomic():
+            emptied = list(Recipes.objects.select_for_update().filter(
+                ingredients_signature__isnull=False).exclude(
+                id__in=Ingredients.objects.filter(
+                    canonical__isnull=False).values("recipe_id")).
+                values_list("id", flat=True))
+            Recipes.objects.filter(id__in=emptied).update(
+                ingredients_signature=None)
+            SignatureChanges.objects.bulk_create(
+                [SignatureChanges(recipe_id=recipe_id)
+                 for recipe_id in emptied])
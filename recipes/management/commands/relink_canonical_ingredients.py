@@ -0,0 +1,66 @@
+"""
+Management command linking the existing ingredients to their canonical name
+"""
+from itertools import groupby
+from operator import attrgetter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Ingredients, Recipes
+from recipes.normalize import canonical_name
+from recipes.services import link_canonical_ingredients
+from recipes.signals import recipe_content_changed
+
+
+class Command(BaseCommand):
+    """
+    Link the ingredients to the canonical form of their name, by batches
+    The canonical ingredients are linked by migration 0005, the command
+    updates the links after a change of recipes.normalize.canonical_name
+    """
+    help = "Link the existing ingredients to their canonical name"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="number of rows updated per query")
+
+    def handle(self, *args, **options):
+        updated = self.relink(options["batch_size"])
+        self.stdout.write(f"{updated} ingredients relinked")
+
+    @staticmethod
+    def relink(batch_size):
+        """
+        Update the ingredients linked to an out of date canonical name,
+        the recipe_content_changed signal is sent for their recipes
+        :param batch_size: the number of rows read and updated per query
+        :return: the number of updated rows
+        """
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(Ingredients.objects.filter(id__gt=last_id).
+                         order_by("id").select_related("canonical").
+                         only("id", "recipe", "name", "canonical__name")
+                         [:batch_size])
+            if not batch:
+                return updated
+            stale = [ingredient for ingredient in batch
+                     if ingredient.canonical_id is None or
+                     ingredient.canonical.name !=
+                     canonical_name(ingredient.name)]
+            with transaction.atomic():
+                link_canonical_ingredients(stale)
+                Ingredients.objects.bulk_update(stale, ["canonical"])
+                stale.sort(key=attrgetter("recipe_id"))
+                for recipe_id, ingredients in groupby(
+                        stale, attrgetter("recipe_id")):
+                    ingredients = list(ingredients)
+                    for ingredient in ingredients:
+                        ingredient.stored_name = ingredient.name
+                    recipe_content_changed.send(
+                        sender=Recipes, recipe_id=recipe_id,
+                        saved=ingredients, deleted=[])
+            updated += len(stale)
+            last_id = batch[-1].id
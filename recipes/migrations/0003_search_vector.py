@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:27
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+TRIGGER_SQL = """
+CREATE TRIGGER {table}_search_vector_update
+BEFORE INSERT OR UPDATE OF name ON {table}
+FOR EACH ROW EXECUTE FUNCTION
+tsvector_update_trigger(search_vector, 'pg_catalog.french', name);
+UPDATE {table} SET search_vector = to_tsvector('pg_catalog.french', name);
+"""
+
+DROP_TRIGGER_SQL = "DROP TRIGGER {table}_search_vector_update ON {table};"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_auto_20220822_2221'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredients',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipes',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='ingredients_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipes_search_idx'),
+        ),
+        migrations.RunSQL(
+            TRIGGER_SQL.format(table='recipes_ingredients'),
+            DROP_TRIGGER_SQL.format(table='recipes_ingredients'),
+        ),
+        migrations.RunSQL(
+            TRIGGER_SQL.format(table='recipes_recipes'),
+            DROP_TRIGGER_SQL.format(table='recipes_recipes'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:29
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='ingredients_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='recipes_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
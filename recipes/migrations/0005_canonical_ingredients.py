@@ -0,0 +1,89 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:37
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+# frozen copy of recipes.normalize.canonical_name, later changes of the
+# normalization are applied by the relink_canonical_ingredients command
+INVARIABLE_WORDS = {
+    'ananas', 'anchois', 'brebis', 'cassis', 'couscous', 'gras', 'houmous',
+    'jus', 'mais', 'noix', 'pois', 'radis', 'riz', 'frais',
+}
+LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss'})
+PLURAL_ENDINGS = (('eaux', 'eau'), ('eux', 'eu'), ('oux', 'ou'), ('s', ''))
+
+
+def fold_text(text):
+    """:return: the text lower cased, without accents and single spaced"""
+    decomposed = unicodedata.normalize('NFKD', text.lower().translate(
+        LIGATURES))
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(folded.split())
+
+
+def singularize(word):
+    """:return: the folded word without its plural mark"""
+    if len(word) <= 3 or word in INVARIABLE_WORDS or word.endswith('ss'):
+        return word
+    for ending, singular in PLURAL_ENDINGS:
+        if word.endswith(ending):
+            return word[:-len(ending)] + singular
+    return word
+
+
+def canonical_name(name):
+    """:return: the canonical name of an ingredient name"""
+    return ' '.join(singularize(word)
+                    for word in re.findall(r'\w+', fold_text(name)))
+
+
+def link_canonical_ingredients(apps, schema_editor):
+    """Link the existing ingredients to their canonical name, by batches"""
+    Ingredients = apps.get_model('recipes', 'Ingredients')
+    CanonicalIngredients = apps.get_model('recipes', 'CanonicalIngredients')
+    last_id = 0
+    while True:
+        batch = list(Ingredients.objects.filter(id__gt=last_id).
+                     order_by('id').only('id', 'name')[:BATCH_SIZE])
+        if not batch:
+            break
+        names = {ingredient.id: canonical_name(ingredient.name)
+                 for ingredient in batch}
+        CanonicalIngredients.objects.bulk_create(
+            [CanonicalIngredients(name=name) for name in set(names.values())],
+            ignore_conflicts=True)
+        canonical_ids = dict(CanonicalIngredients.objects.filter(
+            name__in=set(names.values())).values_list('name', 'id'))
+        for ingredient in batch:
+            ingredient.canonical_id = canonical_ids[names[ingredient.id]]
+        Ingredients.objects.bulk_update(batch, ['canonical'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanonicalIngredients',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredients',
+            name='canonical',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='recipes.canonicalingredients'),
+        ),
+        migrations.RunPython(link_canonical_ingredients,
+                             migrations.RunPython.noop),
+    ]
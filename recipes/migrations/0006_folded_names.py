@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:40
+
+import unicodedata
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+# frozen copy of recipes.normalize.fold_text, later changes of the folding are
+# applied by the backfill_folded_names command
+LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss'})
+
+
+def fold_text(text):
+    """:return: the text lower cased, without accents and single spaced"""
+    decomposed = unicodedata.normalize('NFKD', text.lower().translate(
+        LIGATURES))
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(folded.split())
+
+
+def fill_folded_names(apps, schema_editor):
+    """Store the folded name of the existing recipes, by batches"""
+    Recipes = apps.get_model('recipes', 'Recipes')
+    last_id = 0
+    while True:
+        batch = list(Recipes.objects.filter(id__gt=last_id).order_by('id').
+                     only('id', 'name')[:BATCH_SIZE])
+        if not batch:
+            break
+        for recipe in batch:
+            recipe.folded_name = fold_text(recipe.name)
+        Recipes.objects.bulk_update(batch, ['folded_name'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_canonical_ingredients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='folded_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['folded_name'], name='recipes_folded_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunPython(fill_folded_names, migrations.RunPython.noop),
+    ]
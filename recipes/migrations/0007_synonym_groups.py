@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_folded_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SynonymGroups',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('synonyms', models.TextField(help_text='One ingredient name per line')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='canonicalingredients',
+            name='synonym_group',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingredients', to='recipes.synonymgroups'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_synonym_groups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='ingredients_signature',
+            field=models.BinaryField(null=True),
+        ),
+    ]
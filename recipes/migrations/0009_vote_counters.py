@@ -0,0 +1,65 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def copy_rating_to_counters(apps, schema_editor):
+    """Copy the vote tallies of the rating documents, by batches"""
+    Recipes = apps.get_model('recipes', 'Recipes')
+    last_id = 0
+    while True:
+        batch = list(Recipes.objects.filter(
+            id__gt=last_id, rating__isnull=False).order_by('id').
+            only('id', 'rating')[:BATCH_SIZE])
+        if not batch:
+            break
+        for recipe in batch:
+            recipe.liked = recipe.rating.get('liked', 0)
+            recipe.total_votes = recipe.rating.get('total votes', 0)
+        Recipes.objects.bulk_update(batch, ['liked', 'total_votes'])
+        last_id = batch[-1].id
+
+
+def copy_counters_to_rating(apps, schema_editor):
+    """Rebuild the rating documents of the recipes with votes, by batches"""
+    Recipes = apps.get_model('recipes', 'Recipes')
+    last_id = 0
+    while True:
+        batch = list(Recipes.objects.filter(
+            id__gt=last_id, total_votes__gt=0).order_by('id').
+            only('id', 'liked', 'total_votes')[:BATCH_SIZE])
+        if not batch:
+            break
+        for recipe in batch:
+            recipe.rating = {'liked': recipe.liked,
+                             'total votes': recipe.total_votes}
+        Recipes.objects.bulk_update(batch, ['rating'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_ingredients_signature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='liked',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipes',
+            name='total_votes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(copy_rating_to_counters,
+                             copy_counters_to_rating),
+        migrations.RemoveField(
+            model_name='recipes',
+            name='rating',
+        ),
+    ]
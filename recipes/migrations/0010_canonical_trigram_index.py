@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:28
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='canonicalingredients',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='canonical_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:05
+
+from django.db import migrations
+
+# the version of the stored signatures, see recipes.similar, it is called
+# once so that its last value moves on the first write
+CREATE_SEQUENCE_SQL = """
+CREATE SEQUENCE recipes_similar_version;
+SELECT nextval('recipes_similar_version');
+"""
+
+DROP_SEQUENCE_SQL = "DROP SEQUENCE recipes_similar_version;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_canonical_trigram_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEQUENCE_SQL, DROP_SEQUENCE_SQL),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_similar_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SignatureChanges',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.BigIntegerField()),
+                ('ingredients_signature', models.BinaryField(null=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
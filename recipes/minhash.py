@@ -0,0 +1,90 @@
+"""
+MinHash signatures of the canonical ingredient sets of the recipes
+For each of NUM_HASHES universal hash functions, the signature keeps the
+minimum hash of the ingredient ids of the recipe. Two signatures agree on a
+position with a probability equal to the Jaccard similarity of the two
+ingredient sets.
+
+The signatures are cut in BANDS bands of ROWS positions: two recipes sharing
+a whole band are candidate neighbours. Pairs with a similarity of 0.5 share
+a band with a probability of 0.64, pairs with a similarity of 0.8 with a
+probability of 0.9998, pairs with a similarity of 0.2 with a probability of
+0.03.
+
+This module does not use Django, so that the signatures can be computed in
+the worker processes of the build_similar_recipes command.
+"""
+import random
+
+from array import array
+
+BANDS = 16
+ROWS = 4
+NUM_HASHES = BANDS * ROWS
+
+# a Mersenne prime larger than the ingredient ids
+HASH_PRIME = (1 << 61) - 1
+
+# fixed parameters, the signatures stored by all the processes must agree
+_random = random.Random(20221018)
+HASH_PARAMETERS = tuple((_random.randrange(1, HASH_PRIME),
+                         _random.randrange(0, HASH_PRIME))
+                        for _ in range(NUM_HASHES))
+
+
+def signature(canonical_ids):
+    """
+    :param canonical_ids: the canonical ingredient ids of a recipe
+    :return: the MinHash signature of the ingredients, None if there are
+             none
+    """
+    canonical_ids = set(canonical_ids)
+    if not canonical_ids:
+        return None
+    return tuple(min((a * value + b) % HASH_PRIME for value in canonical_ids)
+                 for a, b in HASH_PARAMETERS)
+
+
+def signatures(recipes):
+    """
+    :param recipes: a list of (recipe id, canonical ids) tuples
+    :return: the list of the (recipe id, encoded signature) tuples
+    """
+    return [(recipe_id, encode(signature(canonical_ids)))
+            for recipe_id, canonical_ids in recipes]
+
+
+def encode(values):
+    """
+    :param values: a signature or None
+    :return: the bytes stored in the database
+    """
+    return array("Q", values).tobytes() if values is not None else None
+
+
+def decode(data):
+    """
+    :param data: the stored bytes of a signature
+    :return: the signature
+    """
+    values = array("Q")
+    values.frombytes(bytes(data))
+    return tuple(values)
+
+
+def band_keys(values):
+    """
+    :param values: a signature
+    :return: the hash of each band of the signature
+    """
+    return [hash(values[band * ROWS:(band + 1) * ROWS])
+            for band in range(BANDS)]
+
+
+def similarity(first, second):
+    """
+    :param first: a signature
+    :param second: another signature
+    :return: the estimated Jaccard similarity of the two ingredient sets
+    """
+    return sum(x == y for x, y in zip(first, second)) / NUM_HASHES
@@ -1,10 +1,14 @@
 """
 Models for the recipes created by users
 """
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.urls import reverse
 
 from accounts.models import MyUser
+from .normalize import canonical_name
 
 
 class Categories(models.Model):
@@ -19,6 +23,57 @@ class Categories(models.Model):
         return self.name
 
 
+class SynonymGroups(models.Model):
+    """
+    Ingredients used interchangeably in the recipes
+    The canonical ingredients named by a group are linked to it, so that the
+    search matches all of them from any of their names
+    """
+    name = models.CharField(max_length=255, unique=True)
+    synonyms = models.TextField(help_text="One ingredient name per line")
+
+    def __str__(self):
+        return self.name
+
+    def canonical_names(self):
+        """
+        :return: the set of the canonical names of the synonyms
+        """
+        names = (canonical_name(name) for name in self.synonyms.splitlines())
+        return {name for name in names if name}
+
+    def clean(self):
+        """
+        :raise ValidationError: if a synonym belongs to another group
+        """
+        taken = CanonicalIngredients.objects.filter(
+            name__in=self.canonical_names(), synonym_group__isnull=False).\
+            exclude(synonym_group_id=self.pk).values_list("name", flat=True)
+        if taken:
+            raise ValidationError({"synonyms": "Already in another group: "
+                                   f"{', '.join(sorted(taken))}"})
+
+
+class CanonicalIngredients(models.Model):
+    """
+    Dictionary of the distinct ingredients
+    All the spellings of an ingredient share the same canonical name
+    """
+    name = models.CharField(max_length=255, unique=True)
+    # set when the group is saved, see recipes.signals
+    synonym_group = models.ForeignKey(
+        "SynonymGroups", null=True, editable=False,
+        related_name="ingredients", on_delete=models.SET_NULL)
+
+    class Meta:
+        # the ingredients are matched by substrings of their canonical name
+        indexes = [GinIndex(fields=["name"], name="canonical_name_trgm_idx",
+                            opclasses=["gin_trgm_ops"])]
+
+    def __str__(self):
+        return self.name
+
+
 class Content(models.Model):
     """
     Recipe content
@@ -40,23 +95,73 @@ class Ingredients(models.Model):
     """
     recipe = models.ForeignKey("Recipes", on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
+    canonical = models.ForeignKey("CanonicalIngredients", null=True,
+                                  editable=False, on_delete=models.PROTECT)
     quantity = models.CharField(max_length=255)
     creation_date = models.DateTimeField(auto_now_add=True)
     modification_date = models.DateTimeField(auto_now=True)
+    # maintained by a database trigger, see migration 0003
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=["search_vector"],
+                            name="ingredients_search_idx"),
+                   GinIndex(fields=["name"], name="ingredients_name_trgm_idx",
+                            opclasses=["gin_trgm_ops"])]
 
 
 class Recipes(models.Model):
     """
     Recipes contains the following fields:
-        a name, a creator, a category, a list of ingredients, and a rating
+        a name, a creator, a category, a list of ingredients, and the
+        counters of its votes
     """
     name = models.CharField(max_length=255)
-    rating = models.JSONField(null=True)
+    # set from the name when the recipe is saved, see recipes.signals
+    folded_name = models.CharField(max_length=255, default="", editable=False)
+    # incremented in the database by the votes, see recipes.views
+    liked = models.PositiveIntegerField(default=0, editable=False)
+    total_votes = models.PositiveIntegerField(default=0, editable=False)
     creator = models.ForeignKey(MyUser, on_delete=models.CASCADE)
     category = models.ForeignKey("Categories", on_delete=models.CASCADE)
     creation_date = models.DateTimeField(auto_now_add=True)
     modification_date = models.DateTimeField(auto_now=True)
+    # maintained by a database trigger, see migration 0003
+    search_vector = SearchVectorField(null=True, editable=False)
+    # MinHash of the canonical ingredients, see recipes.similar
+    ingredients_signature = models.BinaryField(null=True, editable=False)
+
+    class Meta:
+        indexes = [GinIndex(fields=["search_vector"],
+                            name="recipes_search_idx"),
+                   GinIndex(fields=["name"], name="recipes_name_trgm_idx",
+                            opclasses=["gin_trgm_ops"]),
+                   GinIndex(fields=["folded_name"],
+                            name="recipes_folded_trgm_idx",
+                            opclasses=["gin_trgm_ops"])]
 
     def get_absolute_url(self):
         """method to create the url for a specific recipe"""
         return reverse("details", args=[int(self.id)])
+
+    @property
+    def rating(self):
+        """
+        :return: the tally of the votes, None if the recipe has no votes
+        """
+        if not self.total_votes:
+            return None
+        return {"liked": self.liked, "total votes": self.total_votes}
+
+
+class SignatureChanges(models.Model):
+    """
+    Log of the written ingredient signatures, the processes apply the rows
+    logged since their last lookup to their similar recipes index, see
+    recipes.similar
+    """
+    # not a foreign key: the deleted recipes are logged as well
+    recipe_id = models.BigIntegerField()
+    # None for a recipe without ingredients or deleted
+    ingredients_signature = models.BinaryField(null=True)
+    date = models.DateTimeField(auto_now_add=True)
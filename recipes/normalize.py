@@ -0,0 +1,55 @@
+"""
+Normalization of the recipe and ingredient names
+The folded form of a name is lower cased, without accents and with single
+spaces, it is stored alongside the names to be matched by the search.
+All the spellings of an ingredient ("Tomates", "tomate", " tomates ") share
+the same canonical name: the folded name with the plural marks of the words
+removed.
+"""
+import re
+import unicodedata
+
+# words ending with a s or a x in the singular
+INVARIABLE_WORDS = {
+    "ananas", "anchois", "brebis", "cassis", "couscous", "gras", "houmous",
+    "jus", "mais", "noix", "pois", "radis", "riz", "frais",
+}
+
+# ligatures not decomposed by the unicode normalization
+LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss"})
+
+# plural endings and their singular form, the longest endings first
+PLURAL_ENDINGS = (("eaux", "eau"), ("eux", "eu"), ("oux", "ou"), ("s", ""))
+
+
+def fold_text(text):
+    """
+    :param text: a recipe or ingredient name, or a query term
+    :return: the text lower cased, without accents and with single spaces
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower().translate(
+        LIGATURES))
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.split())
+
+
+def singularize(word):
+    """
+    :param word: a lower cased word without accents
+    :return: the word without its plural mark
+    """
+    if len(word) <= 3 or word in INVARIABLE_WORDS or word.endswith("ss"):
+        return word
+    for ending, singular in PLURAL_ENDINGS:
+        if word.endswith(ending):
+            return word[:-len(ending)] + singular
+    return word
+
+
+def canonical_name(name):
+    """
+    :param name: an ingredient name as typed by the user
+    :return: the canonical name of the ingredient
+    """
+    return " ".join(singularize(word)
+                    for word in re.findall(r"\w+", fold_text(name)))
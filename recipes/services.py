@@ -0,0 +1,197 @@
+"""
+Write services of the recipes, shared by the views, the commands and the API
+A recipe is written with its ingredients and steps in a single transaction,
+the ingredients and the steps by bulk queries. An update only writes the rows
+which changed, so that their modification dates stay accurate. The bulk
+queries send no model signal, and the handlers of the deleted rows skip the
+recipe being written: the canonical ingredients set by the pre_save handler
+are set here, and the recipe_content_changed signal is sent once for the
+recipe so that the search structures and caches follow the writes.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CanonicalIngredients, Content, Ingredients, Recipes
+from .normalize import canonical_name
+from .signals import recipe_content_changed, updating_recipe
+
+# changes of the ingredients or of the steps of a recipe
+# created: the new rows, not saved yet
+# updated: the existing rows whose fields changed
+# deleted: the existing rows to delete, with their stored fields
+Changes = namedtuple("Changes", ["created", "updated", "deleted"])
+
+# fields written by the updates of the ingredients and of the steps
+INGREDIENT_FIELDS = ["name", "quantity", "canonical", "modification_date"]
+STEP_FIELDS = ["instructions", "index", "modification_date"]
+
+
+def link_canonical_ingredients(ingredients):
+    """
+    Set the canonical ingredient of unsaved ingredients,
+    the missing canonical ingredients are created by a single query
+    :param ingredients: the list of the ingredients
+    """
+    names = [canonical_name(ingredient.name) for ingredient in ingredients]
+    CanonicalIngredients.objects.bulk_create(
+        [CanonicalIngredients(name=name) for name in set(names)],
+        ignore_conflicts=True)
+    canonicals = CanonicalIngredients.objects.in_bulk(
+        set(names), field_name="name")
+    for ingredient, name in zip(ingredients, names):
+        ingredient.canonical = canonicals[name]
+
+
+def save_new_recipe(recipe, ingredients=(), steps=()):
+    """
+    Write a new recipe with its ingredients and steps
+    :param recipe: the unsaved recipe, with its creator and category
+    :param ingredients: its unsaved ingredients
+    :param steps: its unsaved steps, in order
+    :return: the saved recipe
+    """
+    ingredients = list(ingredients)
+    steps = list(steps)
+    with transaction.atomic():
+        recipe.save()
+        for ingredient in ingredients:
+            ingredient.recipe = recipe
+        link_canonical_ingredients(ingredients)
+        ingredients = Ingredients.objects.bulk_create(ingredients)
+        for index, step in enumerate(steps):
+            step.recipe = recipe
+            step.index = index
+        Content.objects.bulk_create(steps)
+        recipe_content_changed.send(sender=Recipes, recipe_id=recipe.id,
+                                    saved=ingredients, deleted=[])
+    return recipe
+
+
+def filled_forms(formset):
+    """
+    :param formset: a validated formset
+    :return: the forms of the formset which are neither empty nor deleted
+    """
+    return [form for form in formset.forms
+            if form.cleaned_data and not form.cleaned_data.get("DELETE")]
+
+
+def create_recipe(creator, recipe_form, ingredients_formset, steps_formset):
+    """
+    Validate the forms of a new recipe and write it
+    :param creator: the user creating the recipe
+    :param recipe_form: the bound RecipeNameForm
+    :param ingredients_formset: the bound IngredientsFormSet
+    :param steps_formset: the bound ContentFormSet
+    :return: the saved recipe, None if one of the forms is invalid
+    """
+    if not all([recipe_form.is_valid(), ingredients_formset.is_valid(),
+                steps_formset.is_valid()]):
+        return None
+    recipe = recipe_form.save(commit=False)
+    recipe.creator = creator
+    return save_new_recipe(
+        recipe,
+        [form.save(commit=False) for form in filled_forms(
+            ingredients_formset)],
+        [form.save(commit=False) for form in filled_forms(steps_formset)])
+
+
+def formset_changes(formset, index_field=None):
+    """
+    :param formset: a validated formset of the recipe
+    :param index_field: the field numbering the kept rows in the order of
+                        the forms, an existing row whose number changes is
+                        updated
+    :return: the Changes of the rows of the formset, the instances hold the
+             cleaned data of their forms
+    """
+    changes = Changes([], [], [])
+    position = 0
+    for form in formset.forms:
+        instance = form.instance
+        if form.cleaned_data.get("DELETE"):
+            if instance.pk is not None:
+                for field in form.changed_data:
+                    if field in form.initial:
+                        setattr(instance, field, form.initial[field])
+                changes.deleted.append(instance)
+            continue
+        if not form.cleaned_data:
+            continue
+        changed = form.has_changed()
+        if index_field is not None:
+            changed |= getattr(instance, index_field) != position
+            setattr(instance, index_field, position)
+            position += 1
+        if instance.pk is None:
+            changes.created.append(instance)
+        elif changed:
+            changes.updated.append(instance)
+    return changes
+
+
+def save_recipe_changes(recipe, ingredients, steps):
+    """
+    Write the changes of the ingredients and steps of an existing recipe
+    Deleting rows updates the modification date of the recipe, as the
+    post_delete handlers do
+    :param recipe: the saved recipe
+    :param ingredients: the Changes of its ingredients, the updated
+                        ingredients may carry their stored_name
+    :param steps: the Changes of its steps, numbered by their index
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for ingredient in ingredients.created:
+            ingredient.recipe = recipe
+        for step in steps.created:
+            step.recipe = recipe
+        for row in ingredients.updated + steps.updated:
+            row.modification_date = now
+        link_canonical_ingredients(ingredients.created + ingredients.updated)
+        created = Ingredients.objects.bulk_create(ingredients.created)
+        Ingredients.objects.bulk_update(ingredients.updated,
+                                        INGREDIENT_FIELDS)
+        Content.objects.bulk_create(steps.created)
+        Content.objects.bulk_update(steps.updated, STEP_FIELDS)
+        # the deletion is notified below, the post_delete handlers of the
+        # marked recipe skip the rows
+        with updating_recipe(recipe.id):
+            for model, deleted in ((Ingredients, ingredients.deleted),
+                                   (Content, steps.deleted)):
+                if deleted:
+                    model.objects.filter(
+                        id__in=[row.id for row in deleted]).delete()
+        if ingredients.deleted or steps.deleted:
+            Recipes.objects.filter(id=recipe.id).update(
+                modification_date=now)
+        if any(ingredients) or any(steps):
+            recipe_content_changed.send(
+                sender=Recipes, recipe_id=recipe.id,
+                saved=created + ingredients.updated,
+                deleted=ingredients.deleted)
+
+
+def update_recipe(recipe_form, ingredients_formset, steps_formset):
+    """
+    Validate the forms of an existing recipe and write its changes
+    :param recipe_form: the RecipeNameForm bound to the recipe
+    :param ingredients_formset: the IngredientsFormSet bound to the recipe
+    :param steps_formset: the ContentFormSet bound to the recipe
+    :return: the updated recipe, None if one of the forms is invalid
+    """
+    if not all([recipe_form.is_valid(), ingredients_formset.is_valid(),
+                steps_formset.is_valid()]):
+        return None
+    ingredients = formset_changes(ingredients_formset)
+    for form in ingredients_formset.initial_forms:
+        form.instance.stored_name = form.initial.get("name")
+    steps = formset_changes(steps_formset, index_field="index")
+    with transaction.atomic():
+        if recipe_form.has_changed():
+            recipe_form.save()
+        save_recipe_changes(recipe_form.instance, ingredients, steps)
+    return recipe_form.instance
@@ -0,0 +1,161 @@
+"""
+Signal handlers of the recipes app
+"""
+import threading
+
+from contextlib import contextmanager
+
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import CanonicalIngredients, Recipes
+from .normalize import canonical_name, fold_text
+from .similar import similar_index
+
+# sent when canonical ingredients join or leave a synonym group, with the
+# ids and names of the members of the group before and after the change
+synonyms_changed = Signal()
+
+# sent when the ingredients or steps of a recipe are written by bulk queries,
+# which send no model signal, see recipes.services, with the recipe id and
+# the lists of the saved and of the deleted ingredients
+recipe_content_changed = Signal()
+
+
+class MarkedRecipes(threading.local):
+    """
+    Ids of the recipes marked by the current thread, the handlers of their
+    deleted ingredients and steps leave the work to the handlers of the
+    recipe or of recipe_content_changed
+    """
+
+    def __init__(self):
+        self.ids = set()
+
+
+# recipes being deleted, with their ingredients and steps by cascade
+deleting_recipes = MarkedRecipes()
+
+# recipes whose ingredients and steps are written in bulk, see
+# recipes.services
+updating_recipes = MarkedRecipes()
+
+
+def is_cascade_delete(instance):
+    """
+    :param instance: a deleted ingredient or step
+    :return: True if it is deleted with its recipe
+    """
+    return instance.recipe_id in deleting_recipes.ids
+
+
+def is_bulk_delete(instance):
+    """
+    :param instance: a deleted ingredient or step
+    :return: True if it is deleted by a bulk write of its recipe, notified
+             by recipe_content_changed
+    """
+    return instance.recipe_id in updating_recipes.ids
+
+
+@contextmanager
+def updating_recipe(recipe_id):
+    """
+    Mark a recipe while its ingredients and steps are written in bulk
+    :param recipe_id: the id of the recipe
+    """
+    updating_recipes.ids.add(recipe_id)
+    try:
+        yield
+    finally:
+        updating_recipes.ids.discard(recipe_id)
+
+
+def mark_deleting_recipe(sender, instance, **kwargs):
+    """
+    Mark a recipe about to be deleted, the pre_delete signals are sent
+    before the deletion of its ingredients and steps
+    """
+    deleting_recipes.ids.add(instance.id)
+
+
+def unmark_deleting_recipe(sender, instance, **kwargs):
+    """
+    Unmark a deleted recipe, its post_delete signal is sent after the ones
+    of its ingredients and steps
+    """
+    deleting_recipes.ids.discard(instance.id)
+
+
+def fold_name(sender, instance, **kwargs):
+    """Store the folded name of a saved recipe"""
+    instance.folded_name = fold_text(instance.name)
+
+
+def link_canonical_ingredient(sender, instance, **kwargs):
+    """Link a saved ingredient to the canonical form of its name"""
+    name = canonical_name(instance.name)
+    if instance.canonical_id is None or instance.canonical.name != name:
+        instance.canonical = CanonicalIngredients.objects.get_or_create(
+            name=name)[0]
+
+
+def link_synonym_group(sender, instance, **kwargs):
+    """
+    Link the canonical ingredients named by a saved synonym group
+    The missing canonical ingredients are created, so that the ingredients
+    added later are linked to the group as well
+    """
+    names = instance.canonical_names()
+    members = CanonicalIngredients.objects.filter(synonym_group=instance)
+    changed = dict(members.values_list("id", "name"))
+    CanonicalIngredients.objects.bulk_create(
+        [CanonicalIngredients(name=name) for name in names],
+        ignore_conflicts=True)
+    members.exclude(name__in=names).update(synonym_group=None)
+    CanonicalIngredients.objects.filter(name__in=names).update(
+        synonym_group=instance)
+    changed.update(members.values_list("id", "name"))
+    synonyms_changed.send(sender=sender, canonical_ids=set(changed),
+                          names=set(changed.values()))
+
+
+def unlink_synonym_group(sender, instance, **kwargs):
+    """Unlink the canonical ingredients of a deleted synonym group"""
+    members = CanonicalIngredients.objects.filter(synonym_group=instance)
+    changed = dict(members.values_list("id", "name"))
+    members.update(synonym_group=None)
+    synonyms_changed.send(sender=sender, canonical_ids=set(changed),
+                          names=set(changed.values()))
+
+
+def refresh_signature(sender, instance, **kwargs):
+    """
+    Update the signature of the recipe of a saved or deleted ingredient,
+    unless the recipe is deleted as well or written in bulk
+    """
+    if not is_cascade_delete(instance) and not is_bulk_delete(instance):
+        similar_index.refresh_recipe(instance.recipe_id)
+
+
+def remove_signature(sender, instance, **kwargs):
+    """Remove a deleted recipe from the similar recipes"""
+    similar_index.publish(instance.id, None)
+
+
+def touch_recipe(sender, instance, **kwargs):
+    """
+    Update the modification date of the recipe of a deleted ingredient or
+    step, which validates the cached copies of the recipe page and changes
+    the key of its cached body, unless the recipe is deleted as well or
+    written in bulk
+    """
+    if not is_cascade_delete(instance) and not is_bulk_delete(instance):
+        Recipes.objects.filter(id=instance.recipe_id).update(
+            modification_date=timezone.now())
+
+
+def content_changed(sender, recipe_id, saved, deleted, **kwargs):
+    """Update the signature of a recipe whose content was written in bulk"""
+    if saved or deleted:
+        similar_index.refresh_recipe(recipe_id)
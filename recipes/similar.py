@@ -0,0 +1,242 @@
+"""
+Similar recipes: the recipes sharing most of their canonical ingredients
+The MinHash signature of the ingredients of each recipe is stored on its row,
+see recipes.minhash. The signatures are computed for the whole corpus by the
+build_similar_recipes command, and kept up to date by the signals of the
+Ingredients model when the ingredients of a recipe are saved or deleted.
+
+The band index is built from the stored signatures on first use and kept up
+to date by the same signals: the neighbours of a recipe are looked up in the
+buckets of its bands, only these candidates are compared to it. Each process
+holds its own index: every write of a signature is logged in the
+SignatureChanges table and moves a version stored in a database sequence once
+committed. The version is read before each lookup, an index older than the
+version applies the changes logged since its last lookup, only the first
+lookup of a process reads all the signatures.
+"""
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from . import minhash
+from .models import Ingredients, Recipes, SignatureChanges
+
+# estimated Jaccard similarity below which a candidate is not a neighbour
+MIN_SIMILARITY = 0.2
+
+# sequence moved by the writes of the signatures, see migration 0011
+VERSION_SEQUENCE = "recipes_similar_version"
+VERSION_SQL = f"SELECT last_value FROM {VERSION_SEQUENCE}"
+
+# logged changes read again behind the last applied one: the transactions
+# commit their changes out of the order of their ids
+CATCH_UP_MARGIN = 100
+
+
+def get_canonical_ids(recipe_id):
+    """
+    :param recipe_id: the id of a recipe
+    :return: the canonical ids of the ingredients of the recipe
+    """
+    return Ingredients.objects.filter(
+        recipe_id=recipe_id, canonical__isnull=False).values_list(
+        "canonical_id", flat=True)
+
+
+class SimilarIndex:
+    """
+    Locality sensitive hashing index of the recipe signatures
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Empty the index, it will be rebuilt on next use"""
+        with self.lock:
+            self.built = False
+            # version of the stored signatures the index is up to date with
+            self.version = None
+            # id of the last logged change applied to the index
+            self.change_id = 0
+            # recipe id -> signature
+            self.signatures = {}
+            # band -> band key -> ids of the recipes
+            self.buckets = [{} for _ in range(minhash.BANDS)]
+
+    @staticmethod
+    def stored_version():
+        """
+        :return: the version of the stored signatures, the sequence is read
+                 outside of the transactions
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(VERSION_SQL)
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def next_version():
+        """
+        Move the version of the stored signatures, so that every process
+        applies the logged changes to its index
+        :return: the new version
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT nextval('{VERSION_SEQUENCE}')")
+            return cursor.fetchone()[0]
+
+    def build(self, version=None):
+        """
+        Build the index from the signatures stored in the database
+        :param version: the stored version, read before the signatures
+        """
+        if version is None:
+            version = self.stored_version()
+        change_id = SignatureChanges.objects.aggregate(
+            last=Max("id"))["last"] or 0
+        rows = Recipes.objects.filter(ingredients_signature__isnull=False).\
+            values_list("id", "ingredients_signature").iterator()
+        with self.lock:
+            self.signatures = {}
+            self.buckets = [{} for _ in range(minhash.BANDS)]
+            for recipe_id, data in rows:
+                self._add(recipe_id, minhash.decode(data))
+            self.version = version
+            self.change_id = change_id
+            self.built = True
+
+    def catch_up(self, version):
+        """
+        Apply the changes logged since the last lookup, in the order of
+        their ids so that the last change of a recipe is applied last
+        :param version: the stored version, read before the changes
+        """
+        rows = SignatureChanges.objects.filter(
+            id__gt=self.change_id - CATCH_UP_MARGIN).order_by("id").\
+            values_list("id", "recipe_id", "ingredients_signature")
+        with self.lock:
+            for change_id, recipe_id, data in rows:
+                self.update_recipe(recipe_id, minhash.decode(data)
+                                   if data is not None else None)
+                self.change_id = max(self.change_id, change_id)
+            self.version = version
+
+    def ensure_built(self, version=None):
+        """
+        Build the index if it has not been built yet, or apply the changes
+        logged since if the stored signatures changed
+        :param version: the stored version if already read, see VERSION_SQL
+        """
+        if version is None:
+            version = self.stored_version()
+        if not self.built:
+            self.build(version)
+        elif version != self.version:
+            self.catch_up(version)
+
+    def _add(self, recipe_id, signature):
+        """Store a signature and add the recipe to its buckets"""
+        self.signatures[recipe_id] = signature
+        for band, key in enumerate(minhash.band_keys(signature)):
+            self.buckets[band].setdefault(key, set()).add(recipe_id)
+
+    def _remove(self, recipe_id):
+        """Remove the signature of a recipe and its buckets entries"""
+        signature = self.signatures.pop(recipe_id, None)
+        if signature is None:
+            return
+        for band, key in enumerate(minhash.band_keys(signature)):
+            bucket = self.buckets[band][key]
+            bucket.discard(recipe_id)
+            if not bucket:
+                del self.buckets[band][key]
+
+    def update_recipe(self, recipe_id, signature):
+        """
+        Replace the signature of a recipe
+        :param recipe_id: the id of the recipe
+        :param signature: its new signature, None if it has no ingredients
+        """
+        with self.lock:
+            self._remove(recipe_id)
+            if signature is not None:
+                self._add(recipe_id, signature)
+
+    def refresh_recipe(self, recipe_id):
+        """
+        Compute and store the signature of a recipe from its ingredients
+        :param recipe_id: the id of the recipe
+        """
+        data = minhash.encode(minhash.signature(get_canonical_ids(recipe_id)))
+        if Recipes.objects.filter(id=recipe_id).exclude(
+                ingredients_signature=data).update(
+                ingredients_signature=data):
+            self.publish(recipe_id, data)
+
+    def publish(self, recipe_id, data):
+        """
+        Log a written signature, the version is moved once the transaction
+        commits so that the processes apply it on their next lookup
+        :param recipe_id: the id of the recipe
+        :param data: its new encoded signature, None if it has no
+                     ingredients or was deleted
+        """
+        SignatureChanges.objects.create(recipe_id=recipe_id,
+                                        ingredients_signature=data)
+        transaction.on_commit(self.next_version)
+
+    def similar(self, recipe_id, limit, version=None):
+        """
+        :param recipe_id: the id of a recipe
+        :param limit: the maximum number of neighbours to return
+        :param version: the stored version if already read
+        :return: the list of the (similarity, recipe id) tuples of the
+                 nearest neighbours of the recipe, most similar first
+        """
+        self.ensure_built(version)
+        with self.lock:
+            signature = self.signatures.get(recipe_id)
+            if signature is None:
+                return []
+            candidates = set()
+            for band, key in enumerate(minhash.band_keys(signature)):
+                candidates |= self.buckets[band].get(key, set())
+            candidates.discard(recipe_id)
+            scored = [(minhash.similarity(signature,
+                                          self.signatures[candidate]),
+                       candidate) for candidate in candidates]
+        scored = [row for row in scored if row[0] >= MIN_SIMILARITY]
+        scored.sort(key=lambda row: (-row[0], row[1]))
+        return scored[:limit]
+
+
+similar_index = SimilarIndex()
+
+
+def get_similar_recipes(recipe_id, limit):
+    """
+    :param recipe_id: the id of a recipe
+    :param limit: the maximum number of recipes to return
+    :return: the list of the recipes most similar to the given one
+    """
+    return load_similar_recipes(similar_index.similar(recipe_id, limit))
+
+
+def load_similar_recipes(rows):
+    """
+    Each recipe gets a similarity attribute, the estimated share of
+    ingredients it has in common with the recipe they are similar to
+    :param rows: the (similarity, recipe id) tuples of the neighbours
+    :return: the list of the recipes of the rows
+    """
+    recipes = Recipes.objects.select_related("category").in_bulk(
+        [candidate for _, candidate in rows])
+    results = []
+    for similarity, candidate in rows:
+        if candidate in recipes:
+            recipe = recipes[candidate]
+            recipe.similarity = similarity
+            results.append(recipe)
+    return results
@@ -2,11 +2,14 @@
 Test of the recipes app models
 """
 import datetime
+from io import StringIO
 
+from django.core.management import call_command
 from django.test import TestCase
 
 from accounts.models import MyUser
-from .models import Categories, Content, Ingredients, Recipes
+from .models import CanonicalIngredients, Categories, Content, \
+    Ingredients, Recipes
 
 
 class RecipesAppModelsTest(TestCase):
@@ -19,9 +22,10 @@ class RecipesAppModelsTest(TestCase):
         cls.category = Categories.objects.create(name="test")
         cls.recipe = Recipes.objects.create(name="test",
                                             category=cls.category,
-                                            creator=cls.user,
-                                            rating={"positive votes": 5,
-                                                    "total votes": 15})
+                                            creator=cls.user)
+        Recipes.objects.filter(id=cls.recipe.id).update(liked=5,
+                                                        total_votes=15)
+        cls.recipe.refresh_from_db()
         cls.ingredient = Ingredients.objects.create(name="test",
                                                     quantity="12",
                                                     recipe=cls.recipe)
@@ -75,17 +79,48 @@ class RecipesAppModelsTest(TestCase):
         self.assertIsInstance(self.ingredient.modification_date,
                               datetime.datetime)
 
+    def test_ingredient_canonical_name(self):
+        """An ingredient is linked to the canonical form of its name"""
+        self.assertEqual("test", self.ingredient.canonical.name)
+        ingredient = Ingredients.objects.create(name="Tests ",
+                                                quantity="1",
+                                                recipe=self.recipe)
+        self.assertEqual(self.ingredient.canonical, ingredient.canonical)
+        ingredient.name = "Tomates"
+        ingredient.save()
+        self.assertEqual("tomate", ingredient.canonical.name)
+        self.assertEqual(2, CanonicalIngredients.objects.count())
+
+    def test_relink_canonical_ingredients(self):
+        """The command links the ingredients to their current canonical name"""
+        stale = CanonicalIngredients.objects.create(name="tests")
+        Ingredients.objects.filter(id=self.ingredient.id).update(
+            canonical=stale)
+        out = StringIO()
+        call_command("relink_canonical_ingredients", batch_size=1, stdout=out)
+        self.assertIn("1 ingredients relinked", out.getvalue())
+        self.assertEqual("test", Ingredients.objects.get(
+            id=self.ingredient.id).canonical.name)
+
+    def test_folded_names(self):
+        """The folded names are stored when the recipes are saved"""
+        recipe = Recipes.objects.create(name="Crème Brûlée",
+                                        category=self.category,
+                                        creator=self.user)
+        self.assertEqual("creme brulee", recipe.folded_name)
+
     def test_recipe_name_max_length(self):
         """The recipe name should have a max length of 255"""
         self.assertEqual(255, self.recipe._meta.get_field("name").max_length)
 
     def test_recipes_model_fields_implementation(self):
         """Validate the Recipe model fields
-        A recipe has a name, a rating, a creation date, and a modification date
+        A recipe has a name, vote counters, a creation date, and a
+        modification date
         The foreign keys are user and category
         The associated ingredients are reachable"""
         self.assertIsInstance(self.recipe.name, str)
-        self.assertIsInstance(self.recipe.rating, dict)
+        self.assertEqual({"liked": 5, "total votes": 15}, self.recipe.rating)
         user_fk = self.recipe.creator
         self.assertEqual(user_fk, self.user)
         category_fk = self.recipe.category
@@ -0,0 +1,42 @@
+"""
+Test of the recipe and ingredient names normalization
+"""
+from django.test import SimpleTestCase
+
+from .normalize import canonical_name, fold_text
+
+
+class FoldTextTest(SimpleTestCase):
+    """Validate the folded form of the names"""
+
+    def test_case_accents_and_spaces(self):
+        """The folded text is lower cased without accents or extra spaces"""
+        self.assertEqual("creme brulee", fold_text(" Crème   Brûlée "))
+
+    def test_ligatures(self):
+        """The ligatures are expanded"""
+        self.assertEqual("oeufs en gelee", fold_text("Œufs en gelée"))
+
+
+class CanonicalNameTest(SimpleTestCase):
+    """Validate the canonical form of the ingredient names"""
+
+    def test_case_and_spaces(self):
+        """The canonical name is lower cased with single spaces"""
+        self.assertEqual("tomate cerise", canonical_name(" Tomate   Cerise "))
+
+    def test_accents(self):
+        """The canonical name has no accents"""
+        self.assertEqual("creme fraiche", canonical_name("Crème fraîche"))
+
+    def test_plurals(self):
+        """The canonical name has no plural marks"""
+        self.assertEqual("tomate", canonical_name("tomates"))
+        self.assertEqual("gateau", canonical_name("gâteaux"))
+        self.assertEqual("chou", canonical_name("choux"))
+
+    def test_invariable_words(self):
+        """The words ending with a s in the singular are kept"""
+        self.assertEqual("petit pois", canonical_name("petits pois"))
+        self.assertEqual("riz", canonical_name("riz"))
+        self.assertEqual("bas", canonical_name("bas"))
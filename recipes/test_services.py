@@ -0,0 +1,282 @@
+"""
+Tests for the write services of the recipes app
+"""
+from django.db import IntegrityError, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import MyUser
+from recipes.forms import RecipeNameForm, IngredientsFormSet, ContentFormSet
+from recipes.models import Categories, Content, Ingredients, Recipes
+from recipes.services import create_recipe, save_new_recipe, update_recipe
+from recipes.signals import recipe_content_changed
+
+
+class CreateRecipeTestCase(TestCase):
+    """
+    Validate the recipes are written with their ingredients and steps in a
+    single transaction
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the creator and the category of the recipes"""
+        super().setUpTestData()
+        cls.user = MyUser.objects.create_user(username="writer")
+        cls.category = Categories.objects.create(name="test category")
+
+    def new_recipe(self, ingredients, steps):
+        """:return: a recipe written with the ingredients and steps names"""
+        return save_new_recipe(
+            Recipes(name="Crème brûlée", creator=self.user,
+                    category=self.category),
+            [Ingredients(name=name, quantity="1") for name in ingredients],
+            [Content(instructions=text) for text in steps])
+
+    def test_save_new_recipe(self):
+        """The ingredients get their canonical names"""
+        recipe = self.new_recipe(["Œufs", "Crème", "oeuf"],
+                                 ["battre", "cuire"])
+        self.assertEqual("creme brulee", recipe.folded_name)
+        ingredients = Ingredients.objects.filter(recipe=recipe).order_by("id")
+        self.assertEqual(["oeuf", "creme", "oeuf"],
+                         [ingredient.canonical.name
+                          for ingredient in ingredients])
+        self.assertEqual([(0, "battre"), (1, "cuire")], list(
+            Content.objects.filter(recipe=recipe).values_list(
+                "index", "instructions")))
+
+    def test_bulk_queries(self):
+        """The number of queries does not depend on the recipe size"""
+        with CaptureQueriesContext(connection) as small:
+            self.new_recipe(["sel"], ["saler"])
+        with CaptureQueriesContext(connection) as large:
+            self.new_recipe([f"ingredient {i}" for i in range(30)],
+                            [f"etape {i}" for i in range(15)])
+        self.assertEqual(len(small), len(large))
+
+    def test_rollback(self):
+        """A failed write leaves no partial recipe"""
+        with self.assertRaises(IntegrityError):
+            self.new_recipe(["sel", "poivre"], ["saler", None])
+        self.assertFalse(Recipes.objects.exists())
+        self.assertFalse(Ingredients.objects.exists())
+
+    def test_create_recipe_forms(self):
+        """The empty and deleted forms are skipped"""
+        data = {"name": "test", "category": self.category.id,
+                "ingredient-TOTAL_FORMS": "3",
+                "ingredient-INITIAL_FORMS": "0",
+                "ingredient-0-name": "one", "ingredient-0-quantity": "1",
+                "ingredient-1-name": "two", "ingredient-1-quantity": "2",
+                "ingredient-1-DELETE": "on",
+                "step-TOTAL_FORMS": "2", "step-INITIAL_FORMS": "0",
+                "step-1-instructions": "first"}
+        recipe = create_recipe(
+            self.user, RecipeNameForm(data),
+            IngredientsFormSet(data, prefix="ingredient"),
+            ContentFormSet(data, prefix="step"))
+        self.assertEqual(self.user, recipe.creator)
+        self.assertEqual(["one"], list(Ingredients.objects.filter(
+            recipe=recipe).values_list("name", flat=True)))
+        self.assertEqual([(0, "first")], list(Content.objects.filter(
+            recipe=recipe).values_list("index", "instructions")))
+
+    def test_create_recipe_invalid(self):
+        """Nothing is written when a form is invalid"""
+        data = {"name": "test", "category": self.category.id,
+                "ingredient-TOTAL_FORMS": "1",
+                "ingredient-INITIAL_FORMS": "0",
+                "ingredient-0-name": "one",
+                "step-TOTAL_FORMS": "0", "step-INITIAL_FORMS": "0"}
+        ingredients = IngredientsFormSet(data, prefix="ingredient")
+        self.assertIsNone(create_recipe(
+            self.user, RecipeNameForm(data), ingredients,
+            ContentFormSet(data, prefix="step")))
+        self.assertTrue(ingredients.errors[0])
+        self.assertFalse(Recipes.objects.exists())
+
+
+class UpdateRecipeTestCase(TestCase):
+    """
+    Validate the updates only write the changed rows, in a single
+    transaction
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the creator and the category of the recipes"""
+        super().setUpTestData()
+        cls.user = MyUser.objects.create_user(username="writer")
+        cls.category = Categories.objects.create(name="test category")
+
+    def setUp(self):
+        """Create a recipe with three ingredients and three steps"""
+        self.recipe = save_new_recipe(
+            Recipes(name="Crêpes", creator=self.user, category=self.category),
+            [Ingredients(name=name, quantity="1")
+             for name in ("farine", "lait", "oeufs")],
+            [Content(instructions=text)
+             for text in ("melanger", "reposer", "cuire")])
+        self.ingredients = list(Ingredients.objects.filter(
+            recipe=self.recipe).order_by("id"))
+        self.steps = list(Content.objects.filter(recipe=self.recipe))
+        self.notifications = []
+        recipe_content_changed.connect(self.notified)
+
+    def tearDown(self):
+        """Stop recording the notifications"""
+        recipe_content_changed.disconnect(self.notified)
+
+    def notified(self, sender, recipe_id, saved, deleted, **kwargs):
+        """Record a notification of the written ingredients"""
+        self.notifications.append((recipe_id,
+                                   sorted(row.name for row in saved),
+                                   sorted(row.name for row in deleted)))
+
+    def form_data(self, ingredients=None, steps=None, deleted=(), name=None):
+        """
+        :param ingredients: the changed ingredient fields by form number
+        :param steps: the changed step instructions by form number
+        :param deleted: the prefixed numbers of the deleted forms
+        :param name: the new name of the recipe
+        :return: the data of the update forms
+        """
+        data = {"name": name or self.recipe.name,
+                "category": self.category.id}
+        rows = [(ingredient.id, ingredient.name, ingredient.quantity)
+                for ingredient in self.ingredients]
+        rows += [(None, "", "")] * (
+            max((ingredients or {0: None}).keys()) + 1 - len(rows))
+        for number, (row_id, name, quantity) in enumerate(rows):
+            name, quantity = (ingredients or {}).get(number, (name, quantity))
+            data.update({f"ingredient-{number}-id": row_id or "",
+                         f"ingredient-{number}-name": name,
+                         f"ingredient-{number}-quantity": quantity})
+        data.update({"ingredient-TOTAL_FORMS": str(len(rows)),
+                     "ingredient-INITIAL_FORMS": str(len(self.ingredients))})
+        texts = [step.instructions for step in self.steps]
+        texts += [""] * (max((steps or {0: ""}).keys()) + 1 - len(texts))
+        for number, text in enumerate(texts):
+            data.update({f"step-{number}-id": self.steps[number].id
+                         if number < len(self.steps) else "",
+                         f"step-{number}-instructions":
+                             (steps or {}).get(number, text)})
+        data.update({"step-TOTAL_FORMS": str(len(texts)),
+                     "step-INITIAL_FORMS": str(len(self.steps))})
+        for prefix in deleted:
+            data[f"{prefix}-DELETE"] = "on"
+        return data
+
+    def update(self, data):
+        """:return: the recipe updated from the form data"""
+        recipe = Recipes.objects.get(id=self.recipe.id)
+        return update_recipe(
+            RecipeNameForm(data, instance=recipe),
+            IngredientsFormSet(data, prefix="ingredient", instance=recipe),
+            ContentFormSet(data, prefix="step", instance=recipe))
+
+    @staticmethod
+    def dates(model, recipe):
+        """:return: the modification dates of the rows of a recipe by id"""
+        return dict(model.objects.filter(recipe=recipe).values_list(
+            "id", "modification_date"))
+
+    def test_only_changed_rows(self):
+        """The unchanged rows keep their modification date"""
+        ingredient_dates = self.dates(Ingredients, self.recipe)
+        step_dates = self.dates(Content, self.recipe)
+        recipe_date = self.recipe.modification_date
+        self.update(self.form_data(ingredients={1: ("lait", "2")}))
+        ingredients = self.dates(Ingredients, self.recipe)
+        changed = {row_id for row_id, date in ingredients.items()
+                   if date != ingredient_dates[row_id]}
+        self.assertEqual({self.ingredients[1].id}, changed)
+        self.assertEqual(step_dates, self.dates(Content, self.recipe))
+        self.assertEqual(recipe_date, Recipes.objects.get(
+            id=self.recipe.id).modification_date)
+        self.assertEqual([(self.recipe.id, ["lait"], [])],
+                         self.notifications)
+
+    def test_no_changes(self):
+        """Nothing is written when nothing changed"""
+        with CaptureQueriesContext(connection) as queries:
+            self.update(self.form_data())
+        self.assertFalse([query for query in queries.captured_queries
+                          if query["sql"].startswith(("INSERT", "UPDATE",
+                                                      "DELETE"))])
+        self.assertEqual([], self.notifications)
+
+    def test_rename_and_add(self):
+        """Renamed and new ingredients are linked to their canonical name"""
+        self.update(self.form_data(ingredients={0: ("Farines", "1"),
+                                                3: ("Sucre", "2")},
+                                   name="Crêpes sucrées"))
+        ingredients = Ingredients.objects.filter(recipe=self.recipe).\
+            order_by("id")
+        self.assertEqual([("Farines", "farine"), ("lait", "lait"),
+                          ("oeufs", "oeuf"), ("Sucre", "sucre")],
+                         [(row.name, row.canonical.name)
+                          for row in ingredients])
+        self.assertEqual("crepes sucrees", Recipes.objects.get(
+            id=self.recipe.id).folded_name)
+        self.assertEqual([(self.recipe.id, ["Farines", "Sucre"], [])],
+                         self.notifications)
+
+    def test_delete_and_renumber(self):
+        """Deleted rows are removed and the steps numbered again"""
+        recipe_date = self.recipe.modification_date
+        self.update(self.form_data(steps={3: "servir"},
+                                   deleted=["ingredient-2", "step-0"]))
+        self.assertEqual(["farine", "lait"], list(
+            Ingredients.objects.filter(recipe=self.recipe).order_by("id").
+            values_list("name", flat=True)))
+        self.assertEqual([(0, "reposer"), (1, "cuire"), (2, "servir")],
+                         list(Content.objects.filter(
+                             recipe=self.recipe).values_list(
+                             "index", "instructions")))
+        self.assertLess(recipe_date, Recipes.objects.get(
+            id=self.recipe.id).modification_date)
+        self.assertEqual([(self.recipe.id, [], ["oeufs"])],
+                         self.notifications)
+
+    def test_bulk_delete(self):
+        """
+        The deleted rows are removed by one query per table, the post_delete
+        handlers leave them to the notification of the recipe
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.update(self.form_data(
+                deleted=["ingredient-1", "ingredient-2", "step-0",
+                         "step-1"]))
+        self.assertEqual(
+            ['DELETE FROM "recipes_ingredients"',
+             'DELETE FROM "recipes_content"'],
+            [query["sql"].split(" WHERE")[0]
+             for query in queries.captured_queries
+             if query["sql"].startswith("DELETE")])
+        self.assertEqual(
+            ['UPDATE "recipes_recipes" SET "modification_date"',
+             'UPDATE "recipes_recipes" SET "ingredients_signature"'],
+            [query["sql"].split(" =")[0]
+             for query in queries.captured_queries
+             if query["sql"].startswith('UPDATE "recipes_recipes"')])
+        self.assertEqual([(self.recipe.id, [], ["lait", "oeufs"])],
+                         self.notifications)
+        self.assertEqual(1, Ingredients.objects.filter(
+            recipe=self.recipe).count())
+
+    def test_bulk_queries(self):
+        """The number of queries does not depend on the number of changes"""
+        with CaptureQueriesContext(connection) as one:
+            self.update(self.form_data(ingredients={0: ("sucre", "2")},
+                                       steps={0: "battre"}))
+        self.ingredients = list(Ingredients.objects.filter(
+            recipe=self.recipe).order_by("id"))
+        self.steps = list(Content.objects.filter(recipe=self.recipe))
+        with CaptureQueriesContext(connection) as many:
+            self.update(self.form_data(
+                ingredients={number: (f"ingredient {number}", "3")
+                             for number in range(3)},
+                steps={number: f"etape {number}" for number in range(3)}))
+        self.assertEqual(len(one), len(many))
@@ -0,0 +1,200 @@
+"""
+Tests for the similar recipes
+"""
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from recipes import minhash
+from recipes.models import Ingredients, Recipes, SignatureChanges
+from recipes.similar import get_similar_recipes, similar_index
+
+
+class MinHashTest(SimpleTestCase):
+    """
+    Validate the signatures estimate the Jaccard similarity of the sets
+    """
+
+    def test_signature(self):
+        """Equal sets have equal signatures, empty sets have none"""
+        self.assertEqual(minhash.signature([3, 1, 2]),
+                         minhash.signature({1, 2, 3}))
+        self.assertEqual(len(minhash.signature([1])), minhash.NUM_HASHES)
+        self.assertIsNone(minhash.signature([]))
+
+    def test_encode(self):
+        """The stored bytes decode to the signature"""
+        signature = minhash.signature(range(10))
+        self.assertEqual(minhash.decode(minhash.encode(signature)), signature)
+        self.assertIsNone(minhash.encode(None))
+
+    def test_similarity(self):
+        """The estimate is close to the Jaccard similarity"""
+        first = minhash.signature(range(0, 100))
+        second = minhash.signature(range(50, 150))
+        self.assertEqual(minhash.similarity(first, first), 1)
+        self.assertAlmostEqual(minhash.similarity(first, second), 1 / 3,
+                               delta=0.15)
+        self.assertEqual(minhash.similarity(
+            first, minhash.signature(range(1000, 1100))), 0)
+
+    def test_band_keys(self):
+        """Equal bands have equal keys"""
+        first = minhash.signature(range(10))
+        second = first[:minhash.ROWS] + minhash.signature(range(20, 30))[
+            minhash.ROWS:]
+        keys = minhash.band_keys(first)
+        self.assertEqual(len(keys), minhash.BANDS)
+        self.assertEqual(keys[0], minhash.band_keys(second)[0])
+        self.assertNotEqual(keys[1:], minhash.band_keys(second)[1:])
+
+
+class SimilarRecipesTest(TestCase):
+    """
+    Validate the neighbours found in the band index follow the writes to the
+    ingredients
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Compute the signatures of the fixture and build the index"""
+        call_command("build_similar_recipes", workers=1, stdout=StringIO())
+        similar_index.build()
+
+    def tearDown(self):
+        """Drop the index built from the test database"""
+        similar_index.clear()
+
+    def create_recipe(self, *names):
+        """:return: a new recipe of the fixture user with the ingredients"""
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipes.objects.create(name="copie", creator_id=1,
+                                            category_id=1)
+            for name in names:
+                Ingredients.objects.create(recipe=recipe, name=name,
+                                           quantity="1")
+        return recipe
+
+    def similar_ids(self, recipe_id):
+        """:return: the ids of the neighbours of a recipe"""
+        return [recipe.id for recipe in get_similar_recipes(recipe_id, 10)]
+
+    def test_same_ingredients(self):
+        """A recipe with the same ingredients is the nearest neighbour"""
+        recipe = self.create_recipe("Chorizo", "galettes", "champignon")
+        results = get_similar_recipes(1, 10)
+        self.assertEqual(results[0].id, recipe.id)
+        self.assertEqual(results[0].similarity, 1)
+        self.assertNotIn(4, self.similar_ids(1))
+        self.assertEqual(self.similar_ids(recipe.id)[0], 1)
+
+    def test_no_ingredients(self):
+        """A recipe without ingredients has no neighbours"""
+        recipe = Recipes.objects.create(name="vide", creator_id=1,
+                                        category_id=1)
+        self.assertEqual(self.similar_ids(recipe.id), [])
+
+    def test_update_ingredients(self):
+        """The neighbours follow the saved and deleted ingredients"""
+        recipe = self.create_recipe("chorizo", "galette", "champignons")
+        ingredients = list(Ingredients.objects.filter(recipe=recipe))
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredients[0].name = "fraise tagada"
+            ingredients[0].save()
+            ingredients[1].name = "banane"
+            ingredients[1].save()
+            ingredients[2].delete()
+        self.assertNotIn(recipe.id, self.similar_ids(1))
+        self.assertEqual(self.similar_ids(4), [recipe.id])
+        recipe.refresh_from_db()
+        self.assertEqual(minhash.decode(recipe.ingredients_signature),
+                         similar_index.signatures[recipe.id])
+
+    def test_delete_recipe(self):
+        """A deleted recipe is no longer a neighbour, nor updated"""
+        recipe = self.create_recipe("fraise tagada", "banane")
+        self.assertEqual(self.similar_ids(4), [recipe.id])
+        with self.captureOnCommitCallbacks(execute=True), \
+                CaptureQueriesContext(connection) as queries:
+            recipe.delete()
+        self.assertEqual(self.similar_ids(4), [])
+        self.assertFalse([query for query in queries.captured_queries
+                          if query["sql"].startswith("UPDATE")])
+        self.assertNotIn(recipe.id, similar_index.signatures)
+
+    def test_uncommitted_write(self):
+        """A write is only applied to the index once committed"""
+        signature = similar_index.signatures[4]
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredients.objects.create(recipe_id=4, name="kiwi", quantity="1")
+        self.assertEqual(similar_index.signatures[4], signature)
+        for callback in callbacks:
+            callback()
+        self.similar_ids(4)
+        self.assertNotEqual(similar_index.signatures[4], signature)
+
+    def test_write_of_another_process(self):
+        """
+        The changes logged by another process are applied once it moved the
+        version, without building the index again
+        """
+        self.assertEqual(self.similar_ids(4), [])
+        recipe = Recipes.objects.create(name="copie", creator_id=1,
+                                        category_id=1)
+        data = Recipes.objects.get(id=4).ingredients_signature
+        Recipes.objects.filter(id=recipe.id).update(
+            ingredients_signature=data)
+        SignatureChanges.objects.create(recipe_id=recipe.id,
+                                        ingredients_signature=data)
+        self.assertEqual(self.similar_ids(4), [])
+        similar_index.next_version()
+        with mock.patch.object(similar_index, "build",
+                               side_effect=AssertionError):
+            self.assertEqual(self.similar_ids(4), [recipe.id])
+
+    def test_details_view(self):
+        """The recipe page lists the similar recipes"""
+        recipe = self.create_recipe("fraise tagada", "banane")
+        response = self.client.get(recipe.get_absolute_url())
+        self.assertEqual([similar.id for similar in
+                          response.context["similar_recipes"]], [4])
+        self.assertContains(response, "Recettes similaires")
+
+    def test_build_command(self):
+        """The processes store the signatures computed by the signals"""
+        self.create_recipe("riz", "crevette")
+        expected = dict(Recipes.objects.values_list(
+            "id", "ingredients_signature"))
+        emptied = Recipes.objects.create(name="vide", creator_id=1,
+                                         category_id=1)
+        expected[emptied.id] = None
+        for workers in (1, 2):
+            Recipes.objects.update(ingredients_signature=None)
+            Recipes.objects.filter(id=emptied.id).update(
+                ingredients_signature=expected[1])
+            output = StringIO()
+            call_command("build_similar_recipes", workers=workers,
+                         batch_size=3, stdout=output)
+            self.assertIn(f"10 signatures computed by {workers} processes",
+                          output.getvalue())
+            stored = dict(Recipes.objects.values_list(
+                "id", "ingredients_signature"))
+            self.assertEqual({key: value and bytes(value)
+                              for key, value in stored.items()},
+                             {key: value and bytes(value)
+                              for key, value in expected.items()})
+        self.assertFalse(similar_index.built)
+
+    def test_build_command_log(self):
+        """The command only logs the signatures it changed"""
+        recipe = self.create_recipe("riz", "crevette")
+        Recipes.objects.filter(id=recipe.id).update(
+            ingredients_signature=None)
+        SignatureChanges.objects.all().delete()
+        call_command("build_similar_recipes", workers=1, stdout=StringIO())
+        self.assertEqual(list(SignatureChanges.objects.values_list(
+            "recipe_id", flat=True)), [recipe.id])
@@ -1,11 +1,21 @@
 """
 Tests for the views of the recipes app
 """
-from django.test import TestCase, Client
+import threading
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from accounts.models import MyUser
 from recipes.forms import RecipeNameForm, IngredientsFormSet, ContentFormSet
 from recipes.models import Recipes, Content, Ingredients, Categories
+from recipes.similar import similar_index
+
+# number of parallel requests voting for the same recipe
+VOTERS = 20
 
 
 class RecipesCreateTestCase(TestCase):
@@ -306,7 +316,7 @@ class RecipesUpdateTestCase(TestCase):
         self.assertEqual("test updated", updated_recipe[0].name)
         self.assertEqual("test category", updated_recipe[0].category.name)
         updated_ingredients = Ingredients.objects.filter(
-            recipe_id=self.recipe_id)
+            recipe_id=self.recipe_id).order_by("id")
         self.assertEqual(2, len(updated_ingredients))
         self.assertEqual("petit pois", updated_ingredients[0].name)
         self.assertEqual("1b", updated_ingredients[0].quantity)
@@ -321,6 +331,167 @@ class RecipesUpdateTestCase(TestCase):
         # does not allow correct ordering
 
 
+class RecipeDetailsCacheTestCases(TestCase):
+    """
+    Validate the recipe body is cached and renewed when the recipe changes
+    """
+
+    def setUp(self):
+        """Create a recipe with ingredients and steps, empty the caches"""
+        cache.clear()
+        similar_index.build()
+        user = MyUser.objects.create_user(username="reader")
+        category = Categories.objects.create(name="test category")
+        self.recipe = Recipes.objects.create(name="cached", creator=user,
+                                             category=category)
+        for name in ("farine", "oeufs"):
+            Ingredients.objects.create(recipe=self.recipe, name=name,
+                                       quantity="1")
+        Content.objects.create(recipe=self.recipe, index=0,
+                               instructions="melanger")
+        self.url = self.recipe.get_absolute_url()
+
+    def tearDown(self):
+        """Drop the cached bodies and the similar recipes index"""
+        cache.clear()
+        similar_index.clear()
+
+    def test_cached_body(self):
+        """The ingredients and steps are only queried on a cache miss"""
+        with CaptureQueriesContext(connection) as miss:
+            first = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as hit:
+            second = self.client.get(self.url)
+        self.assertEqual(first.content, second.content)
+        self.assertLessEqual(len(miss), 5)
+        self.assertEqual(len(hit), len(miss) - 2)
+        self.assertFalse([query for query in hit.captured_queries
+                          if 'FROM "recipes_ingredients" WHERE' in query["sql"]
+                          or 'FROM "recipes_content" WHERE' in query["sql"]])
+
+    def test_ingredient_invalidation(self):
+        """A saved or deleted ingredient renews the cached body"""
+        self.client.get(self.url)
+        ingredient = Ingredients.objects.get(recipe=self.recipe,
+                                             name="farine")
+        ingredient.name = "sucre"
+        ingredient.save()
+        self.assertContains(self.client.get(self.url), "sucre")
+        ingredient.delete()
+        self.assertNotContains(self.client.get(self.url), "sucre")
+
+    def test_step_invalidation(self):
+        """A saved step renews the cached body"""
+        self.client.get(self.url)
+        Content.objects.create(recipe=self.recipe, index=1,
+                               instructions="cuire")
+        self.assertContains(self.client.get(self.url), "cuire")
+
+    def test_write_without_signal(self):
+        """A write of another process, sending no signal here, is served"""
+        self.client.get(self.url)
+        Ingredients.objects.filter(recipe=self.recipe, name="farine").update(
+            name="sucre", modification_date=timezone.now())
+        self.assertContains(self.client.get(self.url), "sucre")
+
+
+class RecipeDetailsConditionalTestCases(TestCase):
+    """
+    Validate the revalidations of the recipe pages
+    """
+
+    def setUp(self):
+        """Create a recipe with ingredients and steps"""
+        similar_index.build()
+        self.user = MyUser.objects.create_user(username="reader")
+        category = Categories.objects.create(name="test category")
+        self.recipe = Recipes.objects.create(name="conditional",
+                                             creator=self.user,
+                                             category=category)
+        for name in ("farine", "oeufs"):
+            Ingredients.objects.create(recipe=self.recipe, name=name,
+                                       quantity="1")
+        Content.objects.create(recipe=self.recipe, index=0,
+                               instructions="melanger")
+        self.url = self.recipe.get_absolute_url()
+
+    def tearDown(self):
+        """Drop the similar recipes index"""
+        similar_index.clear()
+
+    def test_not_modified(self):
+        """A revalidation with the ETag is answered with one query"""
+        etag = self.client.get(self.url).headers["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.headers["ETag"])
+        self.assertFalse(response.templates)
+
+    def test_versions_query(self):
+        """The dates of the ingredients and steps are read by subqueries"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertNotIn("JOIN \"recipes_ingredients\"",
+                         queries.captured_queries[0]["sql"])
+        self.assertNotIn("Last-Modified", self.client.get(self.url).headers)
+
+    def test_renamed_category(self):
+        """A renamed category changes the ETag"""
+        etag = self.client.get(self.url).headers["ETag"]
+        Categories.objects.filter(id=self.recipe.category_id).update(
+            name="renamed")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_changed_children(self):
+        """A saved or deleted ingredient or step changes the ETag"""
+        etags = [self.client.get(self.url).headers["ETag"]]
+        ingredient = Ingredients.objects.filter(recipe=self.recipe).first()
+        ingredient.quantity = "2"
+        ingredient.save()
+        etags.append(self.client.get(self.url).headers["ETag"])
+        ingredient.delete()
+        etags.append(self.client.get(self.url).headers["ETag"])
+        Content.objects.filter(recipe=self.recipe).delete()
+        response = self.client.get(self.url)
+        etags.append(response.headers["ETag"])
+        self.assertEqual(len(set(etags)), 4)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(200, response.status_code)
+
+    def test_vote(self):
+        """A vote changes the ETag but keeps the cached body"""
+        etag = self.client.get(self.url).headers["ETag"]
+        date = Recipes.objects.get(id=self.recipe.id).modification_date
+        self.client.force_login(self.user)
+        self.client.post(f"/recipe/vote/{self.recipe.id}")
+        self.client.logout()
+        self.assertEqual(date, Recipes.objects.get(
+            id=self.recipe.id).modification_date)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["ETag"])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'FROM "recipes_ingredients" WHERE' in query["sql"]
+                          or 'FROM "recipes_content" WHERE' in query["sql"]])
+
+    def test_user_etag(self):
+        """Authenticated users get their own private ETag"""
+        anonymous = self.client.get(self.url)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=anonymous["ETag"])
+        self.assertEqual(200, response.status_code)
+        self.assertIn("private", response.headers["Cache-Control"])
+
+    def test_missing_recipe(self):
+        """An unknown recipe is not found"""
+        response = self.client.get(f"/recipe/details/{self.recipe.id + 1}")
+        self.assertEqual(404, response.status_code)
+
+
 class UserRecipeListTestCases(TestCase):
     """
     Validate the behaviour of the user list page
@@ -396,3 +567,59 @@ class RecipeRatingTestCases(TestCase):
         self.assertEqual(b'{"status": "success", '
                          b'"rating": {"liked": 2, "total votes": 2}}',
                          response.content)
+
+    def test_vote_updates_counters_only(self):
+        """A vote writes the counters without saving the whole recipe"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(f"/recipe/vote/{self.recipe_id}")
+        updates = [query["sql"] for query in queries.captured_queries
+                   if query["sql"].startswith("UPDATE")]
+        self.assertEqual(1, len(updates))
+        self.assertIn('"liked" = ("recipes_recipes"."liked" + 1)',
+                      updates[0])
+        self.assertNotIn('"name"', updates[0])
+
+    def test_vote_unknown_recipe(self):
+        """A vote on an unknown recipe is not found"""
+        response = self.client.post(f"/recipe/vote/{self.recipe_id + 1}")
+        self.assertEqual(404, response.status_code)
+
+    def test_vote_requires_post(self):
+        """A vote is only accepted by POST"""
+        response = self.client.get(f"/recipe/vote/{self.recipe_id}")
+        self.assertEqual(405, response.status_code)
+
+
+class ConcurrentVotesTestCases(TransactionTestCase):
+    """
+    Validate concurrent votes on the same recipe are all counted
+    """
+
+    def test_concurrent_votes(self):
+        """Votes cast by parallel requests are not lost"""
+        user = MyUser.objects.create_user(username="voter")
+        category = Categories.objects.create(name="test category")
+        recipe = Recipes.objects.create(name="viral", creator=user,
+                                        category=category)
+        barrier = threading.Barrier(VOTERS)
+        statuses = []
+
+        def vote():
+            client = Client()
+            client.force_login(user)
+            barrier.wait()
+            try:
+                statuses.append(client.post(
+                    f"/recipe/vote/{recipe.id}").status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=vote) for _ in range(VOTERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([200] * VOTERS, statuses)
+        recipe.refresh_from_db()
+        self.assertEqual({"liked": VOTERS, "total votes": VOTERS},
+                         recipe.rating)
@@ -1,12 +1,23 @@
 """
 views for the recipes app
 """
-from django.http import JsonResponse
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_POST
 
+from . import services
 from .forms import RecipeNameForm, IngredientsFormSet, ContentFormSet
 from .models import Recipes, Ingredients, Content
+from .similar import VERSION_SQL, load_similar_recipes, similar_index
 
 
 @login_required
@@ -19,21 +30,9 @@ def create_recipe(request):
         recipe = RecipeNameForm(request.POST)
         ingredients = IngredientsFormSet(request.POST, prefix="ingredient")
         steps = ContentFormSet(request.POST, prefix="step")
-        if recipe.is_valid() and ingredients.is_valid() and steps.is_valid():
-            new_recipe = recipe.save(commit=False)
-            new_recipe.creator = request.user
-            new_recipe.save()
-            for form in ingredients.forms:
-                if form.cleaned_data:
-                    ingredient = form.save(commit=False)
-                    ingredient.recipe = new_recipe
-                    ingredient.save()
-            for num, form in enumerate(steps.forms):
-                if form.cleaned_data:
-                    step = form.save(commit=False)
-                    step.recipe = new_recipe
-                    step.index = num
-                    step.save()
+        new_recipe = services.create_recipe(request.user, recipe,
+                                            ingredients, steps)
+        if new_recipe is not None:
             return redirect(new_recipe.get_absolute_url())
         return render(request, "recipes/create.html",
                       {"recipe": recipe, "ingredients": ingredients,
@@ -54,15 +53,8 @@ def update_recipe(request, rid):
     steps_formset = ContentFormSet(request.POST or None, prefix="step",
                                    instance=recipe)
     if request.method == "POST":
-        if recipe_form.is_valid() and ingredients_formset.is_valid() and \
-                steps_formset.is_valid():
-            recipe_form.save()
-            ingredients_formset.save()
-            steps_formset.save(commit=False)
-            for num, obj in enumerate(steps_formset.new_objects):
-                obj.index = num
-                obj.save()
-            steps_formset.save()
+        if services.update_recipe(recipe_form, ingredients_formset,
+                                  steps_formset) is not None:
             return redirect(recipe.get_absolute_url())
         return render(request, "recipes/update.html",
                       {"recipe": recipe_form,
@@ -73,15 +65,83 @@ def update_recipe(request, rid):
                    "steps": steps_formset})
 
 
+def latest_date(model):
+    """
+    :param model: Ingredients or Content
+    :return: the subquery of the latest modification date of the rows of
+             the outer recipe
+    """
+    return Subquery(model.objects.filter(recipe_id=OuterRef("id")).order_by().
+                    values("recipe_id").annotate(
+        latest=Max("modification_date")).values("latest"))
+
+
+def get_page_versions(rid):
+    """
+    :param rid: the id of a recipe
+    :return: the modification date, vote counters and category of the
+             recipe with the latest modification dates of its ingredients
+             and steps, and the version of the similar recipes index, read
+             in a single query where each table is aggregated by its own
+             subquery
+    :raise Http404: if the recipe does not exist
+    """
+    versions = Recipes.objects.filter(id=rid).values(
+        "modification_date", "liked", "total_votes", "category_id",
+        "category__name").annotate(
+        ingredients_date=latest_date(Ingredients),
+        steps_date=latest_date(Content),
+        similar_version=RawSQL(VERSION_SQL, ())).first()
+    if versions is None:
+        raise Http404("No recipe matches the given query.")
+    return versions
+
+
 def recipe_details(request, rid):
-    """A page displaying the content of a recipe"""
-    recipe = get_object_or_404(Recipes.objects.filter(id=rid))
-    ingredients = Ingredients.objects.filter(recipe_id=recipe.id)
-    steps = Content.objects.filter(recipe_id=recipe.id)
-    rating = recipe.rating
-    return render(request, "recipes/details.html",
-                  {"recipe": recipe, "ingredients_list": ingredients,
-                   "steps_list": steps, "rating": rating})
+    """
+    A page displaying the content of a recipe
+    The response is validated by an ETag built from the modification dates
+    of the recipe, its ingredients and its steps, from its vote counters and
+    its category, from the similar recipes and from the user, so that a
+    revalidation is answered before any rendering. There is no Last-Modified
+    date: the similar recipes and the category name have none. Deleting an
+    ingredient or a step updates the modification date of the recipe, see
+    recipes.signals.
+    The ingredients and steps are rendered in a fragment cached under the
+    recipe id and the modification dates, so that every process serves the
+    current body without any invalidation, their lists are only queried when
+    the fragment is not in the cache
+    """
+    versions = get_page_versions(rid)
+    similar_rows = similar_index.similar(rid, settings.SIMILAR_RECIPES_SIZE,
+                                         versions.pop("similar_version"))
+    validator = [request.user.pk, similar_rows] + [
+        value.timestamp() if hasattr(value, "timestamp") else value
+        for value in versions.values()]
+    etag = quote_etag(hashlib.md5(
+        "|".join(str(value) for value in validator).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        recipe = get_object_or_404(Recipes.objects.select_related(
+            "category", "creator").filter(id=rid))
+        ingredients = Ingredients.objects.filter(recipe_id=recipe.id)
+        steps = Content.objects.filter(recipe_id=recipe.id)
+        rating = recipe.rating
+        response = render(request, "recipes/details.html",
+                          {"recipe": recipe, "ingredients_list": ingredients,
+                           "steps_list": steps, "rating": rating,
+                           "versions": versions,
+                           "similar_recipes": load_similar_recipes(
+                               similar_rows),
+                           "body_cache_ttl": settings.RECIPE_CACHE_TTL})
+    response.headers["ETag"] = etag
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True,
+                            max_age=settings.RECIPE_HTTP_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True,
+                            max_age=settings.RECIPE_HTTP_MAX_AGE)
+    return response
 
 
 @login_required
@@ -93,22 +153,19 @@ def show_list(request):
 
 
 @login_required
+@require_POST
 def add_vote_result(request, rid):
-    """Add user vote result to recipe vote tally"""
-    if request.method == "POST":
-        recipe = get_object_or_404(Recipes.objects.filter(id=rid))
-        old_rating = recipe.rating
-        new_rating = {}
-        if old_rating:
-            liked = old_rating["liked"] + 1
-            total = old_rating["total votes"] + 1
-            new_rating["liked"] = liked
-            new_rating["total votes"] = total
-            recipe.rating = new_rating
-            recipe.save()
-        else:
-            new_rating = {"liked": 1, "total votes": 1}
-            recipe.rating = new_rating
-            recipe.save()
-        result = {"status": "success", "rating": new_rating}
-        return JsonResponse(result)
+    """
+    Add user vote result to recipe vote tally
+    The counters are incremented by the database, so that concurrent votes
+    are all counted, and read back in the same transaction. The modification
+    date is left as is: the counters are part of the ETag of the recipe page
+    but not of its cached body, nor of the search results
+    """
+    with transaction.atomic():
+        if not Recipes.objects.filter(id=rid).update(
+                liked=F("liked") + 1, total_votes=F("total_votes") + 1):
+            raise Http404("No recipe matches the given query.")
+        recipe = Recipes.objects.only("liked", "total_votes").get(id=rid)
+    result = {"status": "success", "rating": recipe.rating}
+    return JsonResponse(result)
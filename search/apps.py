@@ -3,9 +3,26 @@ Django app declaration
 Search is a Django application allowing the user to find recipes
 """
 from django.apps import AppConfig
+from django.db.models import CharField
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class SearchConfig(AppConfig):
     """Recipes configuration"""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'search'
+
+    def ready(self):
+        from recipes.models import Recipes, Ingredients
+        from recipes.signals import recipe_content_changed, synonyms_changed
+        from .lookups import TrigramWordSimilar
+        from . import signals
+        CharField.register_lookup(TrigramWordSimilar)
+        pre_save.connect(signals.recipe_saving, sender=Recipes)
+        post_save.connect(signals.recipe_saved, sender=Recipes)
+        post_delete.connect(signals.recipe_deleted, sender=Recipes)
+        pre_save.connect(signals.ingredient_saving, sender=Ingredients)
+        post_save.connect(signals.ingredient_saved, sender=Ingredients)
+        post_delete.connect(signals.ingredient_deleted, sender=Ingredients)
+        synonyms_changed.connect(signals.synonyms_changed)
+        recipe_content_changed.connect(signals.recipe_content_changed)
@@ -0,0 +1,119 @@
+"""
+Ingredient name suggestions for the search box
+The distinct ingredient names are kept, case and accent folded, in a sorted
+list searched by bisection for the names starting with the typed prefix.
+Suggestions are ordered by the number of recipe ingredients using the name.
+
+The list is built from the database on first use and kept up to date by the
+ingredient signals. Each process holds its own list.
+"""
+import heapq
+import threading
+
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.db.models import Count
+
+from recipes.models import Ingredients
+from recipes.normalize import fold_text
+
+
+class Autocomplete:
+    """
+    Sorted list of the folded ingredient names with their usage count
+    """
+
+    def __init__(self, memo_size=1024):
+        self.lock = threading.RLock()
+        self.memo_size = memo_size
+        self.clear()
+
+    def clear(self):
+        """Empty the suggestions, they will be rebuilt on next use"""
+        with self.lock:
+            self.built = False
+            self.keys = []
+            # folded name -> Counter of the spellings of the name
+            self.names = {}
+            # folded name -> number of ingredients using the name
+            self.counts = {}
+            # (prefix, limit) -> suggestions, emptied on every write
+            self.memo = {}
+
+    def build(self):
+        """Build the suggestions from the distinct ingredient names"""
+        names, counts = {}, {}
+        for name, uses in Ingredients.objects.values_list("name").\
+                annotate(uses=Count("id")).order_by().iterator():
+            key = fold_text(name)
+            if not key:
+                continue
+            names.setdefault(key, Counter())[name.strip()] += uses
+            counts[key] = counts.get(key, 0) + uses
+        with self.lock:
+            self.names = names
+            self.counts = counts
+            self.keys = sorted(counts)
+            self.memo = {}
+            self.built = True
+
+    def add(self, name):
+        """Count a new use of an ingredient name"""
+        key = fold_text(name)
+        if not key:
+            return
+        with self.lock:
+            if key not in self.counts:
+                insort(self.keys, key)
+                self.counts[key] = 0
+                self.names[key] = Counter()
+            self.counts[key] += 1
+            self.names[key][name.strip()] += 1
+            self.memo = {}
+
+    def remove(self, name):
+        """Remove a use of an ingredient name"""
+        key = fold_text(name)
+        with self.lock:
+            if key not in self.counts:
+                return
+            self.counts[key] -= 1
+            spellings = self.names[key]
+            spellings[name.strip()] -= 1
+            if spellings[name.strip()] <= 0:
+                del spellings[name.strip()]
+            if self.counts[key] <= 0:
+                del self.counts[key]
+                del self.names[key]
+                del self.keys[bisect_left(self.keys, key)]
+            self.memo = {}
+
+    def suggest(self, prefix, limit):
+        """
+        :param prefix: the typed text
+        :param limit: the maximum number of suggestions
+        :return: the most used ingredient names starting with the prefix
+        """
+        prefix = fold_text(prefix)
+        if not prefix:
+            return []
+        if not self.built:
+            self.build()
+        with self.lock:
+            suggestions = self.memo.get((prefix, limit))
+            if suggestions is not None:
+                return suggestions
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + "\uffff", start)
+            keys = heapq.nlargest(limit, self.keys[start:end],
+                                  key=self.counts.__getitem__)
+            suggestions = [self.names[key].most_common(1)[0][0]
+                           for key in keys if self.names[key]]
+            if len(self.memo) >= self.memo_size:
+                self.memo = {}
+            self.memo[(prefix, limit)] = suggestions
+            return suggestions
+
+
+autocomplete = Autocomplete()
@@ -0,0 +1,109 @@
+"""
+Interface of the search backends
+A search backend ranks the recipes matching a query and returns their
+ranking values, the recipes themselves are then fetched from the database by
+id. The backend is selected by the SEARCH_BACKEND setting, the dotted path of
+its class:
+    - search.search.PostgresBackend ranks the recipes in the database with
+      the lookups of the search mode
+    - search.sqlite.SqliteBackend ranks the recipes in a local SQLite file
+      holding a full text index of the names, see search.sqlite
+
+The search modes a backend does not implement are served by the PostgreSQL
+backend.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_SEARCH_BACKEND = "search.search.PostgresBackend"
+
+
+class SearchBackend:
+    """
+    Base class of the search backends
+    The write methods are called by the model signals, once the transaction
+    commits, so that the backends holding their own copy of the names can
+    keep it up to date
+    """
+    # the search modes implemented by the backend, None for all of them
+    modes = None
+
+    def supports(self, mode):
+        """
+        :param mode: a search mode name
+        :return: True if the backend implements the search mode
+        """
+        return self.modes is None or mode in self.modes
+
+    def ranking_fields(self, mode):
+        """
+        :param mode: the search mode
+        :return: the names of the ranking values of the rows, ordered as in
+                 search.search.get_ranking_fields
+        """
+        raise NotImplementedError
+
+    def ranked_rows(self, query, limit=None, cursor=None, reverse=False,
+                    mode=None, category=None):
+        """
+        :param query: the user query
+        :param limit: the maximum number of rows to return
+        :param cursor: the ranking values of the row to start after
+        :param reverse: True to return the rows ranked before the cursor,
+                        in reverse order
+        :param mode: the search mode
+        :param category: the id of the category to restrict the recipes to
+        :return: the list of the ranking values of the matching recipes
+        """
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Reload the data of the backend from the database"""
+
+    def update_recipe(self, recipe):
+        """Store the name of a saved recipe"""
+
+    def remove_recipe(self, recipe_id):
+        """Remove a deleted recipe and its ingredients"""
+
+    def update_ingredient(self, ingredient):
+        """Store the name of a saved ingredient"""
+
+    def remove_ingredient(self, ingredient):
+        """Remove a deleted ingredient"""
+
+    def update_ingredients(self, ingredients):
+        """Store the names of ingredients written in bulk"""
+        for ingredient in ingredients:
+            self.update_ingredient(ingredient)
+
+    def remove_ingredients(self, ingredients):
+        """Remove ingredients deleted in bulk"""
+        for ingredient in ingredients:
+            self.remove_ingredient(ingredient)
+
+    def update_synonyms(self, canonical_ids):
+        """Store the synonym groups of changed canonical ingredients"""
+
+
+@lru_cache(maxsize=None)
+def load_backend(path):
+    """
+    :param path: the dotted path of a search backend class
+    :return: the instance of the backend shared by the process
+    """
+    return import_string(path)()
+
+
+def get_backend(mode=None):
+    """
+    :param mode: the search mode, defaults to the SEARCH_MODE setting
+    :return: the configured search backend if it implements the mode, the
+             PostgreSQL backend otherwise
+    """
+    backend = load_backend(settings.SEARCH_BACKEND)
+    if not backend.supports(mode or settings.SEARCH_MODE):
+        backend = load_backend(DEFAULT_SEARCH_BACKEND)
+    return backend
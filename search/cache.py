@@ -0,0 +1,147 @@
+"""
+In memory cache of the ranked search results
+Entries are keyed by the search mode, the set of normalized query terms and
+the category filter, and hold the ranked list of matching recipe ids with
+their ranking cursors.
+They expire after a time to live and the least recently used entry is
+evicted when the cache is full.
+
+A write to a recipe or an ingredient invalidates the entries which could
+change: the entries listing that recipe, the entries with a term found in
+the written name or in the names of its synonyms and the entries filtered
+on the category of a written recipe. A change of a synonym group
+invalidates the entries with a term found in one of its synonyms. The
+entries are invalidated again when the write commits, since a search may
+have cached the previous rows in between. Each process holds its own cache:
+writes made by other processes are only seen when the entries expire.
+"""
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+
+from recipes.normalize import canonical_name, fold_text
+
+# modes where a recipe can only match a term found in its names
+SUBSTRING_MODES = ("icontains", "index")
+
+
+class SearchCache:
+    """
+    LRU cache of ranked recipe lists with a time to live
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Empty the cache and reset its counters"""
+        with self.lock:
+            # key -> (expiry time, rows, recipe ids)
+            self.entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+
+    @staticmethod
+    def make_key(mode, terms, limit=None, category=None):
+        """
+        :param mode: the search mode
+        :param terms: the query terms with their operators, see
+                      search.search.query_tokens
+        :param limit: the maximum number of results
+        :param category: the id of the category the results are filtered on
+        :return: the cache key of the query, independent of the terms order
+        """
+        return mode, tuple(sorted(term.lower() for term in terms)), limit, \
+            category
+
+    def get(self, key):
+        """
+        :param key: a cache key
+        :return: the cached rows, None if missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, rows):
+        """
+        Store the ranked results of a query
+        :param key: a cache key
+        :param rows: the list of ranked results, as tuples starting with
+                     the recipe id
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, tuple(rows),
+                                 frozenset(row[0] for row in rows))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, recipe_id, name=None, category=None):
+        """
+        Drop the entries a write to a recipe or ingredient could change
+        :param recipe_id: the id of the written recipe, None for a change of
+                          the synonym groups
+        :param name: the written or deleted recipe or ingredient name, None
+                     on the deletion of a recipe
+        :param category: the category id of a written recipe
+        """
+        names = (fold_text(name), canonical_name(name)) \
+            if name is not None else None
+        with self.lock:
+            stale = [key for key, (_, _, recipe_ids) in self.entries.items()
+                     if recipe_id in recipe_ids or
+                     (category is not None and key[3] == category) or
+                     (names is not None and self._could_match(key, names))]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    @staticmethod
+    def _could_match(key, names):
+        """
+        :param key: a cache key
+        :param names: the folded and the canonical forms of a written name
+        :return: True if a recipe with that name could enter the results
+        """
+        mode, terms = key[:2]
+        # a recipe loses an excluded term when a name is written or deleted
+        if mode not in SUBSTRING_MODES or \
+                any(term.startswith("-") for term in terms):
+            return True
+        terms = [term.lstrip("+").strip('"') for term in terms]
+        folded, canonical = names
+        return any(fold_text(term) in folded or
+                   canonical_name(term) in canonical for term in terms)
+
+    def stats(self):
+        """
+        :return: the size and the counters of the cache
+        """
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations}
+
+
+search_cache = SearchCache(settings.SEARCH_CACHE_SIZE,
+                           settings.SEARCH_CACHE_TTL)
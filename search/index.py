@@ -0,0 +1,295 @@
+"""
+In memory inverted index of the recipe and ingredient names
+The names are split into normalized tokens, each token is associated with
+the sorted list of the ids of the recipes using it. An ingredient in a
+synonym group is also indexed under the tokens of the other synonyms. Query
+terms are matched as token prefixes and combined with set operations, the
+database is then only queried to fetch the matching recipes by id.
+
+The index is built from the database on first use and kept up to date by
+the post_save and post_delete signals of the Recipes and Ingredients models.
+Each process holds its own index: writes made by other processes are only
+seen after a rebuild.
+"""
+import re
+import sys
+import threading
+
+from array import array
+from bisect import bisect_left, insort
+
+from recipes.models import CanonicalIngredients, Recipes, Ingredients
+from recipes.normalize import fold_text
+
+
+def tokenize(text):
+    """
+    :param text: a recipe or ingredient name
+    :return: the set of normalized tokens of the name
+    """
+    return frozenset(sys.intern(token)
+                     for token in re.findall(r"\w+", fold_text(text)))
+
+
+class PostingLists:
+    """
+    The posting lists of one indexed field
+    postings maps each token to a sorted array of recipe ids, vocabulary is
+    the sorted list of tokens used for prefix lookups
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+
+    def load(self, token_ids):
+        """
+        Replace the content of the posting lists
+        :param token_ids: a dict of token to recipe id set
+        """
+        self.postings = {token: array("Q", sorted(ids))
+                         for token, ids in token_ids.items()}
+        self.vocabulary = sorted(self.postings)
+
+    def add(self, token, recipe_id):
+        """Add a recipe to the posting list of a token"""
+        posting = self.postings.get(token)
+        if posting is None:
+            self.postings[token] = array("Q", [recipe_id])
+            insort(self.vocabulary, token)
+            return
+        position = bisect_left(posting, recipe_id)
+        if position == len(posting) or posting[position] != recipe_id:
+            posting.insert(position, recipe_id)
+
+    def remove(self, token, recipe_id):
+        """Remove a recipe from the posting list of a token"""
+        posting = self.postings.get(token)
+        if posting is None:
+            return
+        position = bisect_left(posting, recipe_id)
+        if position < len(posting) and posting[position] == recipe_id:
+            del posting[position]
+        if not posting:
+            del self.postings[token]
+            del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def match(self, term):
+        """
+        :param term: a normalized query term
+        :return: the set of ids of the recipes with a token starting with term
+        """
+        matches = set()
+        position = bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and \
+                self.vocabulary[position].startswith(term):
+            matches.update(self.postings[self.vocabulary[position]])
+            position += 1
+        return matches
+
+    def memory_usage(self):
+        """
+        :return: the number of tokens, postings and the estimated bytes used
+        """
+        postings = sum(len(posting) for posting in self.postings.values())
+        size = sys.getsizeof(self.postings) + sys.getsizeof(self.vocabulary)
+        for token, posting in self.postings.items():
+            size += sys.getsizeof(token) + sys.getsizeof(posting)
+        return {"tokens": len(self.postings), "postings": postings,
+                "bytes": size}
+
+
+class SearchIndex:
+    """
+    Inverted index of the recipe names and ingredient names
+    The tokens of each recipe are kept so that a write only updates the
+    posting lists of the tokens it added or removed
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built = False
+        self.names = PostingLists()
+        self.ingredients = PostingLists()
+        # recipe id -> tokens of the recipe name
+        self.recipe_names = {}
+        # recipe id -> ingredient id -> tokens of the ingredient name
+        self.recipe_ingredients = {}
+        # synonym group id -> tokens of the synonyms
+        self.group_tokens = {}
+
+    def clear(self):
+        """Empty the index, it will be rebuilt on next use"""
+        with self.lock:
+            self.built = False
+            self.names = PostingLists()
+            self.ingredients = PostingLists()
+            self.recipe_names = {}
+            self.recipe_ingredients = {}
+            self.group_tokens = {}
+
+    @staticmethod
+    def load_group_tokens():
+        """:return: the tokens of the synonyms of each synonym group"""
+        group_tokens = {}
+        for group_id, name in CanonicalIngredients.objects.filter(
+                synonym_group__isnull=False).values_list(
+                "synonym_group_id", "name").iterator():
+            group_tokens[group_id] = group_tokens.get(
+                group_id, frozenset()) | tokenize(name)
+        return group_tokens
+
+    def ingredient_tokens(self, name, group_id):
+        """
+        :param name: an ingredient name
+        :param group_id: the id of the synonym group of the ingredient
+        :return: the tokens the ingredient is indexed under
+        """
+        return tokenize(name) | self.group_tokens.get(group_id, frozenset())
+
+    def build(self):
+        """Build the index from the content of the database"""
+        names, ingredients = {}, {}
+        recipe_names, recipe_ingredients = {}, {}
+        group_tokens = self.load_group_tokens()
+        for recipe_id, name in Recipes.objects.values_list("id", "name").\
+                iterator():
+            recipe_names[recipe_id] = tokenize(name)
+            recipe_ingredients[recipe_id] = {}
+            for token in recipe_names[recipe_id]:
+                names.setdefault(token, set()).add(recipe_id)
+        for ingredient_id, recipe_id, name, group_id in Ingredients.objects.\
+                values_list("id", "recipe_id", "name",
+                            "canonical__synonym_group_id").iterator():
+            tokens = tokenize(name) | group_tokens.get(group_id, frozenset())
+            recipe_ingredients.setdefault(recipe_id, {})[ingredient_id] = \
+                tokens
+            for token in tokens:
+                ingredients.setdefault(token, set()).add(recipe_id)
+        with self.lock:
+            self.names.load(names)
+            self.ingredients.load(ingredients)
+            self.recipe_names = recipe_names
+            self.recipe_ingredients = recipe_ingredients
+            self.group_tokens = group_tokens
+            self.built = True
+
+    def ensure_built(self):
+        """Build the index if it has not been built yet"""
+        if not self.built:
+            self.build()
+
+    def _ingredient_tokens(self, recipe_id):
+        """:return: the union of the ingredient tokens of a recipe"""
+        ingredients = self.recipe_ingredients.get(recipe_id, {})
+        return frozenset().union(*ingredients.values())
+
+    def _update_ingredient_postings(self, recipe_id, old_tokens):
+        """Apply the difference between two ingredient token sets"""
+        new_tokens = self._ingredient_tokens(recipe_id)
+        for token in old_tokens - new_tokens:
+            self.ingredients.remove(token, recipe_id)
+        for token in new_tokens - old_tokens:
+            self.ingredients.add(token, recipe_id)
+
+    def update_recipe(self, recipe):
+        """Index the name of a saved recipe"""
+        new_tokens = tokenize(recipe.name)
+        with self.lock:
+            old_tokens = self.recipe_names.get(recipe.id, frozenset())
+            for token in old_tokens - new_tokens:
+                self.names.remove(token, recipe.id)
+            for token in new_tokens - old_tokens:
+                self.names.add(token, recipe.id)
+            self.recipe_names[recipe.id] = new_tokens
+            self.recipe_ingredients.setdefault(recipe.id, {})
+
+    def remove_recipe(self, recipe_id):
+        """Remove a deleted recipe from the index"""
+        with self.lock:
+            for token in self.recipe_names.pop(recipe_id, frozenset()):
+                self.names.remove(token, recipe_id)
+            for token in self._ingredient_tokens(recipe_id):
+                self.ingredients.remove(token, recipe_id)
+            self.recipe_ingredients.pop(recipe_id, None)
+
+    def update_ingredient(self, ingredient):
+        """Index the name of a saved ingredient"""
+        group_id = ingredient.canonical.synonym_group_id \
+            if ingredient.canonical_id is not None else None
+        with self.lock:
+            tokens = self.ingredient_tokens(ingredient.name, group_id)
+            old_tokens = self._ingredient_tokens(ingredient.recipe_id)
+            self.recipe_ingredients.setdefault(
+                ingredient.recipe_id, {})[ingredient.id] = tokens
+            self._update_ingredient_postings(ingredient.recipe_id, old_tokens)
+
+    def remove_ingredient(self, ingredient):
+        """Remove a deleted ingredient from the index"""
+        with self.lock:
+            ingredients = self.recipe_ingredients.get(ingredient.recipe_id)
+            if not ingredients or ingredient.id not in ingredients:
+                return
+            old_tokens = self._ingredient_tokens(ingredient.recipe_id)
+            del ingredients[ingredient.id]
+            self._update_ingredient_postings(ingredient.recipe_id, old_tokens)
+
+    def update_synonyms(self, canonical_ids):
+        """
+        Reindex the ingredients whose synonym group changed
+        :param canonical_ids: the ids of the canonical ingredients which
+                              joined, left or share a changed group
+        """
+        group_tokens = self.load_group_tokens()
+        recipes = {}
+        for ingredient_id, recipe_id, name, group_id in Ingredients.objects.\
+                filter(canonical_id__in=canonical_ids).values_list(
+                "id", "recipe_id", "name", "canonical__synonym_group_id"):
+            recipes.setdefault(recipe_id, []).append(
+                (ingredient_id, name, group_id))
+        with self.lock:
+            self.group_tokens = group_tokens
+            for recipe_id, ingredients in recipes.items():
+                old_tokens = self._ingredient_tokens(recipe_id)
+                recipe_ingredients = self.recipe_ingredients.setdefault(
+                    recipe_id, {})
+                for ingredient_id, name, group_id in ingredients:
+                    recipe_ingredients[ingredient_id] = \
+                        self.ingredient_tokens(name, group_id)
+                self._update_ingredient_postings(recipe_id, old_tokens)
+
+    def match(self, term):
+        """
+        :param term: a query term
+        :return: the sets of ids of the recipes with the term in their
+                 ingredients and in their name
+        """
+        term = fold_text(term)
+        self.ensure_built()
+        with self.lock:
+            return self.ingredients.match(term), self.names.match(term)
+
+    def memory_usage(self):
+        """
+        :return: the memory usage report of the posting lists and of the
+                 per recipe tokens
+        """
+        with self.lock:
+            tokens_size = sys.getsizeof(self.recipe_names) + \
+                sys.getsizeof(self.recipe_ingredients)
+            for tokens in self.recipe_names.values():
+                tokens_size += sys.getsizeof(tokens)
+            for ingredients in self.recipe_ingredients.values():
+                tokens_size += sys.getsizeof(ingredients)
+                for tokens in ingredients.values():
+                    tokens_size += sys.getsizeof(tokens)
+            report = {"names": self.names.memory_usage(),
+                      "ingredients": self.ingredients.memory_usage(),
+                      "recipe_tokens": {"recipes": len(self.recipe_names),
+                                        "bytes": tokens_size}}
+        report["bytes"] = report["names"]["bytes"] + \
+            report["ingredients"]["bytes"] + tokens_size
+        return report
+
+
+search_index = SearchIndex()
@@ -0,0 +1,14 @@
+"""
+Custom lookups used by the search algorithm
+"""
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """
+    Match the fields containing a word similar to the looked up term
+    The operator is supported by the gin_trgm_ops indexes, the similarity
+    threshold is the pg_trgm.word_similarity_threshold setting
+    """
+    lookup_name = "trigram_word_similar"
+    postgres_operator = "%%>"
@@ -0,0 +1,27 @@
+"""
+Management command building the spelling dictionary file
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from search.spelling import spelling_dictionary
+
+
+class Command(BaseCommand):
+    """Build the spelling dictionary from the database and save it"""
+    help = "Build the spelling dictionary of the search and save it"
+
+    def handle(self, *args, **options):
+        if settings.SEARCH_SPELLING_PATH is None:
+            raise CommandError("SEARCH_SPELLING_PATH is not set")
+        start = time.perf_counter()
+        spelling_dictionary.build()
+        try:
+            spelling_dictionary.save()
+        except OSError as error:
+            raise CommandError(f"Cannot save the dictionary: {error}")
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{len(spelling_dictionary.words)} words saved to "
+                          f"{settings.SEARCH_SPELLING_PATH} in {elapsed:.2f}s")
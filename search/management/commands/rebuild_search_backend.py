@@ -0,0 +1,21 @@
+"""
+Management command reloading the data of the search backend
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from search.backends import load_backend
+
+
+class Command(BaseCommand):
+    """Reload the data of the configured search backend from the database"""
+    help = "Reload the data of the configured search backend"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        load_backend(settings.SEARCH_BACKEND).rebuild()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{settings.SEARCH_BACKEND} rebuilt in "
+                          f"{elapsed:.2f}s")
@@ -0,0 +1,29 @@
+"""
+Management command building the in memory search index
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.index import search_index
+
+
+class Command(BaseCommand):
+    """Build the search index and report its memory usage"""
+    help = "Build the in memory search index and report its memory usage"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        search_index.build()
+        elapsed = time.perf_counter() - start
+        report = search_index.memory_usage()
+        self.stdout.write(f"Index built in {elapsed:.2f}s")
+        for field in ("names", "ingredients"):
+            usage = report[field]
+            self.stdout.write(f"{field}: {usage['tokens']} tokens, "
+                              f"{usage['postings']} postings, "
+                              f"{usage['bytes']} bytes")
+        self.stdout.write(f"recipe tokens: "
+                          f"{report['recipe_tokens']['recipes']} recipes, "
+                          f"{report['recipe_tokens']['bytes']} bytes")
+        self.stdout.write(f"total: {report['bytes']} bytes")
@@ -0,0 +1,310 @@
+"""
+Pantry search: rank the recipes by the share of their ingredients the user
+already has
+The recipes x canonical ingredients matrix is held in memory by columns: each
+canonical ingredient has the sorted array of the rows of the recipes using it.
+Scoring a pantry turns its columns into bitsets, integers whose bit n is set
+when the recipe of row n uses the ingredient, and adds them into a bit sliced
+counter. The number of owned ingredients of every recipe is then computed by a
+few operations on whole bitsets instead of a loop over the recipes, and the
+recipes are read tier by tier, from the best coverage down, until the page is
+full. The bitsets of the columns used by many recipes are kept between
+queries.
+
+The matrix is built from the database on first use and kept up to date by
+the post_save and post_delete signals of the Recipes and Ingredients models.
+Each process holds its own matrix.
+"""
+import re
+import threading
+
+from array import array
+from bisect import bisect_left, insort
+
+from recipes.models import CanonicalIngredients, Ingredients, Recipes
+from recipes.normalize import canonical_name
+
+# the bitset of a column is kept once it is smaller than its array of rows,
+# that is when it is used by more than one recipe out of DENSE_RATIO
+DENSE_RATIO = 32
+
+
+def parse_pantry(pantry):
+    """
+    :param pantry: the ingredients owned by the user, separated by commas or
+                   new lines
+    :return: the set of the canonical names of the ingredients
+    """
+    names = (canonical_name(name) for name in re.split(r"[,;\n]", pantry))
+    return {name for name in names if name}
+
+
+def to_bitset(rows):
+    """
+    :param rows: an iterable of row numbers
+    :return: the bitset of the rows
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    buffer = bytearray(max(rows) // 8 + 1)
+    for row in rows:
+        buffer[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def add_bitset(planes, bitset):
+    """
+    Add one to the counters of the rows of a bitset
+    :param planes: the bits of the counters, least significant first
+    :param bitset: the bitset of the rows to count
+    """
+    carry = bitset
+    for position, plane in enumerate(planes):
+        if not carry:
+            return
+        planes[position] = plane ^ carry
+        carry = plane & carry
+    if carry:
+        planes.append(carry)
+
+
+def equal_bitset(planes, value, all_rows):
+    """
+    :param planes: the bits of the counters, least significant first
+    :param value: a counter value
+    :param all_rows: the bitset of all the rows
+    :return: the bitset of the rows whose counter equals the value
+    """
+    if value >> len(planes):
+        return 0
+    bitset = all_rows
+    for position, plane in enumerate(planes):
+        bitset &= plane if value >> position & 1 else all_rows ^ plane
+        if not bitset:
+            break
+    return bitset
+
+
+class PantryMatrix:
+    """
+    Sparse matrix of the canonical ingredients of the recipes
+    Rows are numbered in the order the recipes are added, the rows of the
+    deleted recipes are left empty until the next build
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Empty the matrix, it will be rebuilt on next use"""
+        with self.lock:
+            self.built = False
+            # row -> recipe id
+            self.recipe_ids = array("Q")
+            # recipe id -> row
+            self.rows = {}
+            # row -> canonical ingredient ids of the recipe
+            self.recipe_columns = []
+            # canonical ingredient id -> sorted array of rows
+            self.columns = {}
+            # canonical ingredient id -> bitset of rows, for the dense columns
+            self.bitsets = {}
+            # number of ingredients -> bitset of rows
+            self.sizes = {}
+
+    def build(self):
+        """Build the matrix from the content of the database"""
+        recipe_ids = array("Q", Recipes.objects.order_by("id").
+                           values_list("id", flat=True).iterator())
+        rows = {recipe_id: row for row, recipe_id in enumerate(recipe_ids)}
+        recipe_columns = [set() for _ in recipe_ids]
+        for recipe_id, canonical_id in Ingredients.objects.values_list(
+                "recipe_id", "canonical_id").iterator():
+            row = rows.get(recipe_id)
+            if row is not None and canonical_id is not None:
+                recipe_columns[row].add(canonical_id)
+        columns, sizes = {}, {}
+        for row, canonical_ids in enumerate(recipe_columns):
+            for canonical_id in canonical_ids:
+                columns.setdefault(canonical_id, array("L")).append(row)
+            if canonical_ids:
+                sizes.setdefault(len(canonical_ids), []).append(row)
+        dense = len(recipe_ids) // DENSE_RATIO
+        with self.lock:
+            self.recipe_ids = recipe_ids
+            self.rows = rows
+            self.recipe_columns = [frozenset(canonical_ids)
+                                   for canonical_ids in recipe_columns]
+            self.columns = columns
+            self.bitsets = {canonical_id: to_bitset(column)
+                            for canonical_id, column in columns.items()
+                            if len(column) > dense}
+            self.sizes = {size: to_bitset(size_rows)
+                          for size, size_rows in sizes.items()}
+            self.built = True
+
+    def ensure_built(self):
+        """Build the matrix if it has not been built yet"""
+        if not self.built:
+            self.build()
+
+    def _add_cell(self, row, canonical_id):
+        """Add a recipe to the column of an ingredient"""
+        insort(self.columns.setdefault(canonical_id, array("L")), row)
+        bitset = self.bitsets.get(canonical_id)
+        if bitset is not None:
+            self.bitsets[canonical_id] = bitset | 1 << row
+
+    def _remove_cell(self, row, canonical_id):
+        """Remove a recipe from the column of an ingredient"""
+        column = self.columns[canonical_id]
+        del column[bisect_left(column, row)]
+        if not column:
+            del self.columns[canonical_id]
+            self.bitsets.pop(canonical_id, None)
+        elif canonical_id in self.bitsets:
+            self.bitsets[canonical_id] &= ~(1 << row)
+
+    def _resize(self, row, old_size, new_size):
+        """Move a recipe to the bitset of its new number of ingredients"""
+        if old_size == new_size:
+            return
+        if old_size:
+            self.sizes[old_size] &= ~(1 << row)
+            if not self.sizes[old_size]:
+                del self.sizes[old_size]
+        if new_size:
+            self.sizes[new_size] = self.sizes.get(new_size, 0) | 1 << row
+
+    def update_recipe(self, recipe_id, canonical_ids):
+        """
+        Set the canonical ingredients of a recipe
+        :param recipe_id: the id of the recipe
+        :param canonical_ids: the canonical ids of its ingredients
+        """
+        canonical_ids = frozenset(canonical_ids)
+        with self.lock:
+            row = self.rows.get(recipe_id)
+            if row is None:
+                row = len(self.recipe_ids)
+                self.recipe_ids.append(recipe_id)
+                self.rows[recipe_id] = row
+                self.recipe_columns.append(frozenset())
+            old_ids = self.recipe_columns[row]
+            for canonical_id in old_ids - canonical_ids:
+                self._remove_cell(row, canonical_id)
+            for canonical_id in canonical_ids - old_ids:
+                self._add_cell(row, canonical_id)
+            self._resize(row, len(old_ids), len(canonical_ids))
+            self.recipe_columns[row] = canonical_ids
+
+    def refresh_recipe(self, recipe_id):
+        """Reload the canonical ingredients of a recipe from the database"""
+        self.update_recipe(recipe_id, Ingredients.objects.filter(
+            recipe_id=recipe_id, canonical__isnull=False).values_list(
+            "canonical_id", flat=True))
+
+    def remove_recipe(self, recipe_id):
+        """Empty the row of a deleted recipe"""
+        with self.lock:
+            if recipe_id in self.rows:
+                self.update_recipe(recipe_id, ())
+
+    def _bitset(self, canonical_id):
+        """:return: the bitset of the column of an ingredient"""
+        bitset = self.bitsets.get(canonical_id)
+        if bitset is None:
+            column = self.columns.get(canonical_id, ())
+            bitset = to_bitset(column)
+            if len(column) > len(self.recipe_ids) // DENSE_RATIO:
+                self.bitsets[canonical_id] = bitset
+        return bitset
+
+    def rank(self, canonical_ids, limit, after=None):
+        """
+        Rank the recipes by the share of their ingredients in the pantry,
+        then by their number of missing ingredients, then by their number of
+        owned ingredients
+        :param canonical_ids: the canonical ids of the pantry ingredients
+        :param limit: the maximum number of recipes to return
+        :param after: the (owned, size, recipe id) tuple of the recipe to
+                      start after
+        :return: the list of the (owned, size, recipe id) tuples of the
+                 recipes using at least one of the pantry ingredients
+        :raise ValueError: if the recipe to start after is unknown
+        """
+        canonical_ids = set(canonical_ids)
+        self.ensure_built()
+        with self.lock:
+            planes = []
+            for canonical_id in canonical_ids:
+                add_bitset(planes, self._bitset(canonical_id))
+            if not planes:
+                return []
+            all_rows = (1 << len(self.recipe_ids)) - 1
+            owned = {count: equal_bitset(planes, count, all_rows)
+                     for count in range(1, min(len(canonical_ids),
+                                               max(self.sizes)) + 1)}
+            tiers = sorted(((count, size) for count in owned
+                            for size in self.sizes if count <= size),
+                           key=lambda tier: (-tier[0] / tier[1],
+                                             tier[1] - tier[0], -tier[0]))
+            if after is not None:
+                if after[2] not in self.rows:
+                    raise ValueError(f"Unknown recipe: {after[2]}")
+                tiers = tiers[tiers.index(after[:2]):] \
+                    if after[:2] in tiers else []
+            results = []
+            for count, size in tiers:
+                bitset = owned[count] & self.sizes[size]
+                if after is not None and (count, size) == after[:2]:
+                    start = self.rows[after[2]] + 1
+                    bitset = bitset >> start << start
+                while bitset and len(results) < limit:
+                    lowest = bitset & -bitset
+                    results.append((count, size, self.recipe_ids[
+                        lowest.bit_length() - 1]))
+                    bitset ^= lowest
+                if len(results) >= limit:
+                    break
+            return results
+
+
+pantry_matrix = PantryMatrix()
+
+
+def get_pantry_results(pantry, limit, after=None):
+    """
+    Produce a page of the recipes best covered by the pantry ingredients
+    Each recipe gets owned, missing and coverage attributes, and a cursor
+    attribute usable to fetch the following page
+    :param pantry: the ingredients owned by the user
+    :param limit: the number of recipes in a page
+    :param after: the cursor of the last recipe of the previous page
+    :return: the list of the recipes of the page and the cursor of the next
+             page, None if there is no such page
+    :raise ValueError: if the cursor is malformed
+    """
+    if after is not None:
+        after = tuple(int(value) for value in after.split("."))
+        if len(after) != 3:
+            raise ValueError(f"Invalid cursor: {after}")
+    canonical_ids = CanonicalIngredients.objects.filter(
+        name__in=parse_pantry(pantry)).values_list("id", flat=True)
+    rows = pantry_matrix.rank(list(canonical_ids), limit + 1, after)
+    recipes = Recipes.objects.select_related('category').in_bulk(
+        [recipe_id for _, _, recipe_id in rows])
+    results = []
+    for owned, size, recipe_id in rows[:limit]:
+        if recipe_id in recipes:
+            recipe = recipes[recipe_id]
+            recipe.owned = owned
+            recipe.missing = size - owned
+            recipe.coverage = owned / size
+            recipe.cursor = f"{owned}.{size}.{recipe_id}"
+            results.append(recipe)
+    next_cursor = results[-1].cursor if len(rows) > limit and results \
+        else None
+    return results, next_cursor
@@ -7,31 +7,748 @@ of recipes, in order:
       one query term
     - all the recipes with one of the query terms in the recipe name
     - all the recipes whose list of ingredients contains one query term
+
+get_results matches the recipes, get_ranked_results also orders them as
+described above, scoring each recipe in the database. The result pages are
+ranked by the search backend selected by the SEARCH_BACKEND setting, see
+search.backends.
+
+The search modes are selected by the SEARCH_MODE setting:
+    - icontains: substring matching on the folded recipe names and on the
+      canonical ingredient names, see recipes.normalize
+    - fulltext: PostgreSQL full text search on the search_vector columns
+      maintained by the database, using the french configuration
+    - fuzzy: typo tolerant matching on the trigram indexed names, the fuzzy
+      matches are ranked below the recipes with an exact match
+    - index: prefix matching on the tokens of the in memory inverted index,
+      see search.index
+
+Except in the fuzzy mode, an ingredient also matches the terms naming one of
+its synonyms, see recipes.models.SynonymGroups.
 """
 # Thanks to https://www.cyberhavenprogramming.com/blog/2019/4/23/django-q-object-how-make-many-complex-multiple-and-dynamic-queries-python-reduce-function-functools-or-operator-and-requestget-search-fields-parameters/  # noqa
 import operator
 import re
 
-from functools import reduce
-from django.db.models import Q
+from collections import namedtuple
+from functools import lru_cache, reduce
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Case, Count, Exists, IntegerField, Max, \
+    OuterRef, Q, Subquery, Value, When
+
+from recipes.models import CanonicalIngredients, Recipes, Ingredients
+from recipes.normalize import canonical_name, fold_text, singularize
+from .backends import SearchBackend, get_backend
+from .cache import search_cache
+from .index import search_index
+
+SEARCH_CONFIG = "french"
+
+# ranks of the result tiers, highest first
+ALL_INGREDIENTS_RANK = 4
+SEVERAL_INGREDIENTS_RANK = 3
+NAME_RANK = 2
+ONE_INGREDIENT_RANK = 1
 
-from recipes.models import Recipes
 
+# terms: the distinct terms ranking the recipes, required and optional
+# required: the terms every matching recipe must contain, a subset of terms
+# excluded: the terms no matching recipe may contain
+ParsedQuery = namedtuple("ParsedQuery", ["terms", "required", "excluded"])
 
-def get_results(query):
+# an optional + or - operator followed by a quoted phrase or by a word
+QUERY_TOKEN = re.compile(r'([+-]?)(?:"([^"]*)"?|(\S+))')
+
+# elided articles and pronouns: d'agneau, l'huile, qu'il
+ELISION = re.compile(r"\b(?:[cdjlmnst]|qu)['’]", re.IGNORECASE)
+
+# french words found in too many names to select recipes, ignored unless
+# they are part of a phrase or prefixed by an operator
+STOP_WORDS = frozenset({
+    "a", "à", "au", "aux", "avec", "ce", "ces", "cet", "cette", "dans", "de",
+    "des", "du", "en", "et", "la", "le", "les", "leur", "ma", "me", "mes",
+    "mon", "ou", "où", "par", "pour", "sa", "se", "ses", "son", "sur", "ta",
+    "tes", "ton", "un", "une", "y",
+})
+
+
+def normalize_term(text):
     """
-    The algorithm used to produce the set of recipes from the query term
+    :param text: a word or a quoted phrase of the user query
+    :return: its words lower cased, stripped of elisions, of non word
+             characters and of their plural marks, separated by single spaces
+    """
+    words = (re.sub(r'[^\w]', "", word)
+             for word in ELISION.sub(" ", text.lower()).split())
+    return " ".join(singularize(word) for word in words if word)
+
+
+def is_stop_word(term):
+    """
+    :param term: a normalized query word
+    :return: True if the word is too common or too short to search for
+    """
+    return term in STOP_WORDS or len(term) < settings.SEARCH_MIN_TERM_LENGTH
+
+
+@lru_cache(maxsize=settings.SEARCH_PLAN_CACHE_SIZE)
+def parse_query(query):
+    """
+    Split the user query into search terms
+    A term is a word or a quoted phrase ("pomme de terre"), matched as a
+    whole. A term prefixed by + is required, a term prefixed by - excluded,
+    the other terms are optional. The optional words are dropped when they
+    are stop words or shorter than the SEARCH_MIN_TERM_LENGTH setting, and
+    the words are deduplicated once their plural marks are removed.
     :param query: the user query
+    :return: the ParsedQuery of the distinct terms of the query
+    """
+    terms, required, excluded = {}, {}, {}
+    for sign, phrase, word in QUERY_TOKEN.findall(query):
+        term = normalize_term(phrase or word)
+        if not term or not sign and not phrase and is_stop_word(term):
+            continue
+        if sign == "-":
+            excluded[term] = None
+            continue
+        terms[term] = None
+        if sign == "+":
+            required[term] = None
+    return ParsedQuery(tuple(terms), tuple(required), tuple(excluded))
+
+
+def normalize_query(query):
+    """
+    :param query: the user query
+    :return: the list of the distinct terms ranking the recipes, the
+             excluded terms left out
+    """
+    return list(parse_query(query).terms)
+
+
+def query_tokens(parsed):
+    """
+    :param parsed: a ParsedQuery
+    :return: the terms with their operators, phrases and stop words quoted
+             so that they are kept when parsed again: the optional terms,
+             then the required and the excluded ones, each group sorted
+    """
+    def token(term, sign=""):
+        if " " in term or is_stop_word(term):
+            return f'{sign}"{term}"'
+        return f"{sign}{term}"
+
+    return sorted(token(term) for term in parsed.terms
+                  if term not in parsed.required) + \
+        sorted(token(term, "+") for term in parsed.required) + \
+        sorted(token(term, "-") for term in parsed.excluded)
+
+
+def canonical_query(query):
+    """
+    :param query: the user query
+    :return: the canonical form of the query: its distinct terms with their
+             operators, sorted and separated by spaces
+    """
+    return " ".join(query_tokens(parse_query(query)))
+
+
+def get_icontains_results(terms):
+    """
+    Match the query terms as substrings of the folded recipe names and of
+    the canonical ingredient names
+    :param terms: the normalized query terms
     :return: a query set of the recipes matching the query terms
     """
-    normalized_queries = [re.sub(r'[^\w]', "", i) for i in query.split()]
-    all_ingredients = reduce(operator.and_, (
-        Q(ingredients__name__icontains=term) for term in normalized_queries
-    ))
-    multiple_lookups = reduce(operator.or_, (
-        Q(ingredients__name__icontains=term) |
-        Q(name__icontains=term) for term in normalized_queries
+    final_query = reduce(operator.or_, (
+        ingredient | name for ingredient, name in
+        (icontains_lookups(term) for term in terms)
     ))
-    final_query = reduce(operator.or_, (all_ingredients, multiple_lookups))
     return Recipes.objects.select_related('category').filter(final_query).\
         distinct()
+
+
+def get_fulltext_results(terms):
+    """
+    Match the query terms against the indexed search vectors of the recipe
+    and ingredient names
+    :param terms: the normalized query terms
+    :return: a query set of the recipes matching the query terms
+    """
+    search_query = reduce(operator.or_, (
+        fulltext_query(term) for term in terms
+    ))
+    matching_ingredients = Ingredients.objects.filter(
+        reduce(operator.or_, (synonym_lookup(term) for term in terms),
+               Q(search_vector=search_query))).values("recipe_id")
+    return Recipes.objects.select_related('category').filter(
+        Q(search_vector=search_query) | Q(id__in=matching_ingredients))
+
+
+def get_fuzzy_results(terms):
+    """
+    Match the query terms against the words of the recipe and ingredient
+    names, allowing for typos
+    :param terms: the normalized query terms
+    :return: a query set of the recipes matching the query terms
+    """
+    matching_ingredients = Ingredients.objects.filter(reduce(operator.or_, (
+        Q(name__trigram_word_similar=term) for term in terms
+    ))).values("recipe_id")
+    return Recipes.objects.select_related('category').filter(
+        reduce(operator.or_, (
+            Q(name__trigram_word_similar=term) for term in terms
+        )) | Q(id__in=matching_ingredients))
+
+
+def get_index_results(terms):
+    """
+    Match the query terms against the tokens of the in memory index
+    :param terms: the normalized query terms
+    :return: a query set of the recipes matching the query terms
+    """
+    recipe_ids = set()
+    for term in terms:
+        if " " in term:
+            # the tokens of the index are single words
+            ingredient, name = icontains_lookups(term)
+            recipe_ids.update(Recipes.objects.filter(ingredient | name).
+                              values_list("id", flat=True))
+            continue
+        ingredient_ids, name_ids = search_index.match(term)
+        recipe_ids |= ingredient_ids | name_ids
+    return Recipes.objects.select_related('category').filter(
+        id__in=recipe_ids)
+
+
+def synonym_lookup(term, prefix=""):
+    """
+    Match the ingredients of the synonym group named by the term
+    The term resolves to a single group id, looked up once by the database
+    :param term: a normalized query term
+    :param prefix: the path from the queried model to the ingredients
+    :return: the lookup of the ingredients whose canonical ingredient is in
+             the synonym group of the term
+    """
+    group = CanonicalIngredients.objects.filter(
+        name=canonical_name(term)).values("synonym_group_id")[:1]
+    return Q(**{f"{prefix}canonical__synonym_group": Subquery(group)})
+
+
+def icontains_lookups(term):
+    """
+    :param term: a normalized query term
+    :return: the ingredient and recipe name lookups of the icontains mode
+    """
+    return Q(ingredients__canonical__name__contains=canonical_name(term)) | \
+        synonym_lookup(term, "ingredients__"), \
+        Q(folded_name__contains=fold_text(term))
+
+
+def fulltext_query(term):
+    """
+    :param term: a normalized query term
+    :return: the full text query of the term, a phrase query for the terms
+             of several words
+    """
+    return SearchQuery(term, config=SEARCH_CONFIG,
+                       search_type="phrase" if " " in term else "plain")
+
+
+def fulltext_lookups(term):
+    """
+    :param term: a normalized query term
+    :return: the ingredient and recipe name lookups of the fulltext mode
+    """
+    search_query = fulltext_query(term)
+    return Q(ingredients__search_vector=search_query) | \
+        synonym_lookup(term, "ingredients__"), \
+        Q(search_vector=search_query)
+
+
+def fuzzy_lookups(term):
+    """
+    :param term: a normalized query term
+    :return: the ingredient and recipe name lookups of the fuzzy mode
+    """
+    return Q(ingredients__name__trigram_word_similar=term), \
+        Q(name__trigram_word_similar=term)
+
+
+def index_lookups(term):
+    """
+    :param term: a normalized query term
+    :return: the ingredient and recipe name lookups of the index mode
+    """
+    if " " in term:
+        return icontains_lookups(term)
+    ingredient_ids, name_ids = search_index.match(term)
+    return Q(id__in=ingredient_ids), Q(id__in=name_ids)
+
+
+# results: the function matching the recipes
+# lookups: the function building the lookups used to rank the recipes
+# exact_lookups: if set, the recipes matching these lookups are ranked first
+# static: True if the lookups only depend on the terms, so that the compiled
+#         query plans can be cached
+SearchMode = namedtuple("SearchMode", ["results", "lookups", "exact_lookups",
+                                       "static"])
+
+SEARCH_MODES = {
+    "icontains": SearchMode(get_icontains_results, icontains_lookups, None,
+                            True),
+    "fulltext": SearchMode(get_fulltext_results, fulltext_lookups, None,
+                           True),
+    "fuzzy": SearchMode(get_fuzzy_results, fuzzy_lookups, icontains_lookups,
+                        True),
+    "index": SearchMode(get_index_results, index_lookups, None, False),
+}
+
+
+def get_search_mode(mode):
+    """
+    :param mode: the search mode name, defaults to the SEARCH_MODE setting
+    :return: the SearchMode tuple of the search mode
+    """
+    mode = mode or settings.SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+    return SEARCH_MODES[mode]
+
+
+def get_term_filters(parsed, search_mode):
+    """
+    Build the conditions of the required and excluded terms
+    A required term is an EXISTS semi-join on the recipe matching it with
+    the lookups of the search mode. An excluded term is a NOT EXISTS
+    anti-join on the ingredients whose canonical name contains it or which
+    are in its synonym group, along with a recipe name not containing it,
+    whatever the search mode.
+    :param parsed: the ParsedQuery of the user query
+    :param search_mode: the SearchMode of the query
+    :return: the list of the conditions to filter the recipes on
+    """
+    filters = []
+    for term in parsed.required:
+        ingredient, name = search_mode.lookups(term)
+        filters.append(Exists(Recipes.objects.filter(
+            ingredient | name, id=OuterRef("id"))))
+    for term in parsed.excluded:
+        filters.append(~Exists(Ingredients.objects.filter(
+            Q(canonical__name__contains=canonical_name(term)) |
+            synonym_lookup(term), recipe=OuterRef("id"))))
+        filters.append(~Q(folded_name__contains=fold_text(term)))
+    return tuple(filters)
+
+
+# any_term: the lookup matching the recipes with one of the terms
+# ingredient_hits: the aggregate counting the terms found in the ingredients
+# rank: the expression of the relevance tier, see get_rank
+# exact: the aggregate flagging the exact matches, None if the mode has none
+# filters: the conditions of the required and excluded terms
+QueryPlan = namedtuple("QueryPlan", ["any_term", "ingredient_hits", "rank",
+                                     "exact", "filters"])
+
+
+def compile_query(parsed, search_mode):
+    """
+    Build the lookups and aggregates ranking the recipes matching a query
+    :param parsed: the ParsedQuery of the user query, with at least a term
+    :param search_mode: the SearchMode of the query
+    :return: the QueryPlan of the query
+    """
+    term_lookups = [search_mode.lookups(term) for term in parsed.terms]
+    any_term = reduce(operator.or_, (
+        ingredient | name for ingredient, name in term_lookups
+    ))
+    ingredient_hits = reduce(operator.add, (
+        Max(Case(When(ingredient, then=Value(1)), default=Value(0),
+                 output_field=IntegerField()))
+        for ingredient, _ in term_lookups
+    ))
+    name_hit = reduce(operator.or_, (name for _, name in term_lookups))
+    rank = Case(
+        When(ingredient_hits=len(parsed.terms),
+             then=Value(ALL_INGREDIENTS_RANK)),
+        When(ingredient_hits__gt=1, then=Value(SEVERAL_INGREDIENTS_RANK)),
+        When(name_hit, then=Value(NAME_RANK)),
+        default=Value(ONE_INGREDIENT_RANK),
+        output_field=IntegerField())
+    exact = None
+    if search_mode.exact_lookups:
+        exact_match = reduce(operator.or_, (
+            ingredient | name for ingredient, name in
+            (search_mode.exact_lookups(term) for term in parsed.terms)
+        ))
+        exact = Max(Case(When(exact_match, then=Value(1)), default=Value(0),
+                         output_field=IntegerField()))
+    return QueryPlan(any_term, ingredient_hits, rank, exact,
+                     get_term_filters(parsed, search_mode))
+
+
+@lru_cache(maxsize=settings.SEARCH_PLAN_CACHE_SIZE)
+def compile_cached_query(parsed, mode):
+    """
+    :param parsed: the ParsedQuery of the user query, with at least a term
+    :param mode: the name of a static search mode
+    :return: the QueryPlan of the query, compiled once per process
+    """
+    return compile_query(parsed, SEARCH_MODES[mode])
+
+
+def get_query_plan(parsed, mode=None):
+    """
+    :param parsed: the ParsedQuery of the user query, with at least a term
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :return: the QueryPlan of the query, from the plan cache when the
+             lookups of the mode only depend on the terms
+    """
+    mode = mode or settings.SEARCH_MODE
+    search_mode = get_search_mode(mode)
+    if search_mode.static:
+        return compile_cached_query(parsed, mode)
+    return compile_query(parsed, search_mode)
+
+
+def plan_cache_stats():
+    """
+    :return: the counters of the parsed queries and compiled plans caches
+    """
+    return {name: function.cache_info()._asdict() for name, function in
+            (("queries", parse_query), ("plans", compile_cached_query))}
+
+
+def get_results(query, mode=None):
+    """
+    The algorithm used to produce the set of recipes from the query term
+    :param query: the user query
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :return: a query set of the recipes matching the query terms
+    """
+    search_mode = get_search_mode(mode)
+    parsed = parse_query(query)
+    if not parsed.terms:
+        return Recipes.objects.none()
+    return search_mode.results(parsed.terms).filter(
+        *get_query_plan(parsed, mode).filters)
+
+
+def get_category_counts(query, mode=None):
+    """
+    Count the recipes matching the query in each category, with a single
+    grouped query
+    :param query: the user query
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :return: the list of the (category id, category name, count) tuples,
+             the largest count first
+    """
+    if not normalize_query(query):
+        return []
+    matching = get_results(query, mode).values("id")
+    return list(Recipes.objects.filter(id__in=matching).
+                values_list("category_id", "category__name").
+                annotate(count=Count("id")).
+                order_by("-count", "category__name"))
+
+
+def get_ranking_fields(mode=None):
+    """
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :return: the annotations ordering the ranked results, the id being the
+             only ascending one
+    """
+    fields = ["rank", "ingredient_hits", "id"]
+    if get_search_mode(mode).exact_lookups:
+        fields.insert(0, "exact")
+    return fields
+
+
+def get_ordering(fields, reverse=False):
+    """
+    :param fields: the ranking fields
+    :param reverse: True to produce the reversed ranking order
+    :return: the order_by arguments of the ranking
+    """
+    return [field if (field == "id") != reverse else f"-{field}"
+            for field in fields]
+
+
+def get_keyset_filter(fields, values, reverse=False):
+    """
+    Build the lookup selecting the rows ranked after a cursor row
+    :param fields: the ranking fields
+    :param values: the ranking values of the cursor row
+    :param reverse: True to select the rows ranked before the cursor row
+    :return: a Q object comparing the ranking fields to the cursor values
+    """
+    lookup = None
+    for field, value in reversed(list(zip(fields, values))):
+        operator_name = "gt" if (field == "id") != reverse else "lt"
+        after = Q(**{f"{field}__{operator_name}": value})
+        if lookup is not None:
+            after |= Q(**{field: value}) & lookup
+        lookup = after
+    return lookup
+
+
+def encode_cursor(values):
+    """
+    :param values: the ranking values of a row
+    :return: the cursor string of the row
+    """
+    return ".".join(str(value) for value in values)
+
+
+def decode_cursor(cursor, fields):
+    """
+    :param cursor: a cursor string
+    :param fields: the ranking fields
+    :return: the ranking values of the cursor row
+    :raise ValueError: if the cursor is malformed
+    """
+    values = tuple(int(value) for value in cursor.split("."))
+    if len(values) != len(fields):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def get_ranked_results(query, limit=None, mode=None, category=None):
+    """
+    Produce the recipes matching the query, ordered by relevance tier
+    The rank is computed in a single grouped query: the ingredients join is
+    restricted to the matching rows and each term is counted once per recipe.
+    The required and excluded terms filter the recipes, see get_term_filters.
+    The lookups and aggregates come from the compiled plan of the query
+    :param query: the user query
+    :param limit: the maximum number of recipes to return
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :param category: the id of the category to restrict the recipes to
+    :return: a query set of the matching recipes annotated with their rank
+    """
+    parsed = parse_query(query)
+    if not parsed.terms:
+        return Recipes.objects.none()
+    plan = get_query_plan(parsed, mode)
+    results = Recipes.objects.select_related('category').filter(
+        plan.any_term, *plan.filters)
+    if category is not None:
+        results = results.filter(category_id=category)
+    results = results.annotate(ingredient_hits=plan.ingredient_hits).\
+        annotate(rank=plan.rank)
+    if plan.exact is not None:
+        results = results.annotate(exact=plan.exact)
+    results = results.order_by(*get_ordering(get_ranking_fields(mode)))
+    if limit is not None:
+        results = results[:limit]
+    return results
+
+
+def get_rank(ingredient_hits, name_hit, terms_count):
+    """
+    :param ingredient_hits: the number of terms found in the ingredients
+    :param name_hit: True if a term is found in the recipe name
+    :param terms_count: the number of query terms
+    :return: the rank of the recipe, as annotated by get_ranked_results
+    """
+    if ingredient_hits == terms_count:
+        return ALL_INGREDIENTS_RANK
+    if ingredient_hits > 1:
+        return SEVERAL_INGREDIENTS_RANK
+    if name_hit:
+        return NAME_RANK
+    return ONE_INGREDIENT_RANK
+
+
+def get_batch_results(queries, mode=None):
+    """
+    Rank the recipes matching several queries with a single database query
+    The matches of each distinct term of the queries are fetched once, as
+    one aggregate per term, and each query is then ranked in memory as in
+    get_ranked_results. The excluded terms are flagged per recipe by NOT
+    EXISTS anti-joins in the same query.
+    :param queries: the list of the (user query, limit) tuples, a limit of
+                    None returning all the matching recipes
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :return: the list of the ranked (recipe id, recipe name) tuples of each
+             query
+    """
+    search_mode = get_search_mode(mode)
+    parsed_queries = [parse_query(query) for query, _ in queries]
+    terms = sorted({term for parsed in parsed_queries
+                    for term in parsed.terms})
+    if not terms:
+        return [[] for _ in queries]
+    excluded = sorted({term for parsed in parsed_queries
+                       for term in parsed.excluded})
+    annotations = {}
+    any_term = Q()
+    for position, term in enumerate(terms):
+        ingredient, name = search_mode.lookups(term)
+        any_term |= ingredient | name
+        annotations[f"ingredient_{position}"] = Max(Case(
+            When(ingredient, then=Value(1)), default=Value(0),
+            output_field=IntegerField()))
+        annotations[f"name_{position}"] = Max(Case(
+            When(name, then=Value(1)), default=Value(0),
+            output_field=IntegerField()))
+        if search_mode.exact_lookups:
+            ingredient, name = search_mode.exact_lookups(term)
+            annotations[f"exact_{position}"] = Max(Case(
+                When(ingredient | name, then=Value(1)), default=Value(0),
+                output_field=IntegerField()))
+    for position, term in enumerate(excluded):
+        annotations[f"excluded_{position}"] = Case(
+            When(~Exists(Ingredients.objects.filter(
+                Q(canonical__name__contains=canonical_name(term)) |
+                synonym_lookup(term), recipe=OuterRef("id"))) &
+                ~Q(folded_name__contains=fold_text(term)), then=Value(0)),
+            default=Value(1), output_field=IntegerField())
+    rows = list(Recipes.objects.filter(any_term).annotate(**annotations).
+                values_list("id", "name", *annotations).order_by())
+    columns = {name: position for position, name in
+               enumerate(["id", "name"] + list(annotations))}
+    results = []
+    for (_, limit), parsed in zip(queries, parsed_queries):
+        positions = [terms.index(term) for term in parsed.terms]
+        required = [terms.index(term) for term in parsed.required]
+        exclusions = [excluded.index(term) for term in parsed.excluded]
+        ranked = []
+        for row in rows:
+            if any(row[columns[f"excluded_{position}"]]
+                   for position in exclusions) or \
+                    not all(row[columns[f"ingredient_{position}"]] or
+                            row[columns[f"name_{position}"]]
+                            for position in required):
+                continue
+            ingredient_hits = sum(row[columns[f"ingredient_{position}"]]
+                                  for position in positions)
+            name_hit = any(row[columns[f"name_{position}"]]
+                           for position in positions)
+            if not ingredient_hits and not name_hit:
+                continue
+            exact = max(row[columns[f"exact_{position}"]]
+                        for position in positions) \
+                if search_mode.exact_lookups else 0
+            rank = get_rank(ingredient_hits, name_hit, len(positions))
+            ranked.append(((-exact, -rank, -ingredient_hits, row[0]),
+                           (row[0], row[1])))
+        ranked.sort()
+        results.append([recipe for _, recipe in ranked[:limit]])
+    return results
+
+
+class PostgresBackend(SearchBackend):
+    """
+    Search backend ranking the recipes in the PostgreSQL database, with the
+    lookups of the search modes
+    """
+
+    def ranking_fields(self, mode):
+        return get_ranking_fields(mode)
+
+    def ranked_rows(self, query, limit=None, cursor=None, reverse=False,
+                    mode=None, category=None):
+        if not normalize_query(query):
+            return []
+        fields = get_ranking_fields(mode)
+        results = get_ranked_results(query, mode=mode, category=category)
+        if cursor is not None:
+            results = results.filter(
+                get_keyset_filter(fields, cursor, reverse))
+        results = results.order_by(*get_ordering(fields, reverse)).\
+            values_list(*fields)
+        if limit is not None:
+            results = results[:limit]
+        return list(results)
+
+
+def get_recipes(rows):
+    """
+    Fetch the ranked recipes by id
+    Each recipe gets a cursor attribute usable to fetch the following page
+    :param rows: the ranked (recipe id, cursor) tuples
+    :return: the list of the recipes, in the order of the rows
+    """
+    if not rows:
+        return []
+    recipes = Recipes.objects.select_related('category').\
+        in_bulk([recipe_id for recipe_id, _ in rows])
+    results = []
+    for recipe_id, cursor in rows:
+        if recipe_id in recipes:
+            recipes[recipe_id].cursor = cursor
+            results.append(recipes[recipe_id])
+    return results
+
+
+def get_cursor_rows(ranked_rows, fields):
+    """
+    :param ranked_rows: the ranking values of the ranked recipes
+    :param fields: the ranking fields
+    :return: the (recipe id, cursor) tuples of the ranked recipes
+    """
+    id_position = fields.index("id")
+    return [(row[id_position], encode_cursor(row)) for row in ranked_rows]
+
+
+def get_cached_results(query, limit=None, mode=None, category=None):
+    """
+    Produce the ranked recipes matching the query, using the results cache
+    Each recipe gets a cursor attribute usable to fetch the following page
+    :param query: the user query
+    :param limit: the maximum number of recipes to return
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :param category: the id of the category to restrict the recipes to
+    :return: the list of the matching recipes, ordered by relevance
+    """
+    mode = mode or settings.SEARCH_MODE
+    backend = get_backend(mode)
+    key = search_cache.make_key(mode, query_tokens(parse_query(query)),
+                                limit, category)
+    rows = search_cache.get(key)
+    if rows is None:
+        rows = get_cursor_rows(
+            backend.ranked_rows(query, limit, mode=mode, category=category),
+            backend.ranking_fields(mode))
+        search_cache.set(key, rows)
+    return get_recipes(rows)
+
+
+def get_results_page(query, page_size, after=None, before=None, mode=None,
+                     category=None):
+    """
+    Produce a page of the ranked recipes matching the query
+    Pages are delimited by the ranking values of their first and last rows,
+    so that deep pages are fetched without an OFFSET. The first page goes
+    through the results cache.
+    :param query: the user query
+    :param page_size: the number of recipes in a page
+    :param after: the cursor of the last row of the previous page
+    :param before: the cursor of the first row of the following page
+    :param mode: the search mode to use, defaults to the SEARCH_MODE setting
+    :param category: the id of the category to restrict the recipes to
+    :return: the list of the recipes of the page, the cursors of the
+             previous and the next pages, None if there are no such pages
+    :raise ValueError: if a cursor is malformed
+    """
+    mode = mode or settings.SEARCH_MODE
+    backend = get_backend(mode)
+    cursor = after or before
+    if cursor is None:
+        recipes = get_cached_results(query, page_size + 1, mode, category)
+    else:
+        fields = backend.ranking_fields(mode)
+        recipes = get_recipes(get_cursor_rows(backend.ranked_rows(
+            query, page_size + 1, decode_cursor(cursor, fields),
+            before is not None, mode, category), fields))
+    has_more = len(recipes) > page_size
+    recipes = recipes[:page_size]
+    if before is not None:
+        recipes.reverse()
+        previous_cursor = recipes[0].cursor if has_more else None
+        next_cursor = recipes[-1].cursor if recipes else None
+    else:
+        previous_cursor = recipes[0].cursor if after and recipes else None
+        next_cursor = recipes[-1].cursor if has_more else None
+    return recipes, previous_cursor, next_cursor
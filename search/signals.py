@@ -0,0 +1,214 @@
+"""
+Signal handlers keeping the in memory search index, results cache,
+ingredient suggestions, spelling dictionary, pantry matrix and search backend
+up to date, all but the results cache once the transaction commits
+The index, the suggestions, the dictionary and the matrix are only
+maintained once they have been built
+"""
+from copy import copy
+
+from django.conf import settings
+from django.db import transaction
+
+from recipes.models import CanonicalIngredients, Ingredients, Recipes
+from recipes.signals import is_bulk_delete, is_cascade_delete
+from .autocomplete import autocomplete
+from .backends import load_backend
+from .cache import search_cache
+from .index import search_index
+from .pantry import pantry_matrix
+from .spelling import spelling_dictionary
+
+
+def get_stored_name(model, instance):
+    """
+    :return: the name of an updated instance, as stored in the database
+    """
+    return model.objects.filter(pk=instance.pk).values_list(
+        "name", flat=True).first()
+
+
+def write_backend(method, *args):
+    """
+    Apply a write to the search backend once the transaction commits, so
+    that a backend holding its own copy of the names never keeps a rolled
+    back write
+    :param method: the name of the write method of the backend
+    :param args: its arguments, the instances are copied by the callers
+                 since a delete resets their primary key before the commit
+    """
+    transaction.on_commit(lambda: getattr(
+        load_backend(settings.SEARCH_BACKEND), method)(*args))
+
+
+def write_index(structure, method, *args):
+    """
+    Apply a write to an in memory structure once the transaction commits, if
+    it has been built by then, so that a rolled back write never shows in
+    the results
+    :param structure: the search index or the pantry matrix
+    :param method: the name of its write method
+    :param args: its arguments, copied by the callers like for write_backend
+    """
+    def apply():
+        if structure.built:
+            getattr(structure, method)(*args)
+    transaction.on_commit(apply)
+
+
+def write_names(structures, removed, added):
+    """
+    Apply a change of the used names to the suggestions or the dictionary
+    once the transaction commits, if they have been built by then
+    :param structures: the suggestions and or the spelling dictionary
+    :param removed: the names no longer used by the written rows
+    :param added: the names now used by the written rows
+    """
+    def apply():
+        for names in structures:
+            if names.built:
+                for name in removed:
+                    names.remove(name)
+                for name in added:
+                    names.add(name)
+    transaction.on_commit(apply)
+
+
+def invalidate_results(recipe_id, name=None, category=None):
+    """
+    Drop the cached results a write could change, and again once the
+    transaction commits, in case a search read the previous rows meanwhile,
+    see search.cache.SearchCache.invalidate
+    """
+    search_cache.invalidate(recipe_id, name, category)
+    transaction.on_commit(
+        lambda: search_cache.invalidate(recipe_id, name, category))
+
+
+def synonym_names(ingredients):
+    """
+    :param ingredients: written or deleted ingredients
+    :return: the canonical names of the members of their synonym groups,
+             whose cached results the ingredients could enter as well
+    """
+    canonical_ids = {ingredient.canonical_id for ingredient in ingredients}
+    canonical_ids.discard(None)
+    if not search_cache.entries or not canonical_ids:
+        return set()
+    return set(CanonicalIngredients.objects.filter(
+        synonym_group__ingredients__id__in=canonical_ids).values_list(
+        "name", flat=True))
+
+
+def recipe_saving(sender, instance, **kwargs):
+    """Keep the stored name of an updated recipe for the dictionary"""
+    if spelling_dictionary.built and instance.pk is not None:
+        instance.stored_name = get_stored_name(Recipes, instance)
+
+
+def recipe_saved(sender, instance, **kwargs):
+    """Index the name of a saved recipe and invalidate its results"""
+    write_index(search_index, "update_recipe", copy(instance))
+    previous_name = getattr(instance, "stored_name", None)
+    write_names((spelling_dictionary,),
+                [previous_name] if previous_name is not None else [],
+                [instance.name])
+    instance.stored_name = instance.name
+    write_backend("update_recipe", copy(instance))
+    invalidate_results(instance.id, instance.name, instance.category_id)
+
+
+def recipe_deleted(sender, instance, **kwargs):
+    """Remove a deleted recipe from the index and from the results"""
+    write_index(search_index, "remove_recipe", instance.id)
+    write_index(pantry_matrix, "remove_recipe", instance.id)
+    write_names((spelling_dictionary,), [instance.name], [])
+    write_backend("remove_recipe", instance.id)
+    invalidate_results(instance.id)
+
+
+def ingredient_saving(sender, instance, **kwargs):
+    """
+    Keep the stored name of an updated ingredient for the suggestions and
+    the dictionary
+    """
+    if (autocomplete.built or spelling_dictionary.built) and \
+            instance.pk is not None:
+        instance.stored_name = get_stored_name(Ingredients, instance)
+
+
+def ingredient_saved(sender, instance, **kwargs):
+    """
+    Index the name of a saved ingredient and invalidate its results and the
+    results of its synonyms
+    """
+    write_index(search_index, "update_ingredient", copy(instance))
+    write_index(pantry_matrix, "refresh_recipe", instance.recipe_id)
+    previous_name = getattr(instance, "stored_name", None)
+    write_names((autocomplete, spelling_dictionary),
+                [previous_name] if previous_name is not None else [],
+                [instance.name])
+    instance.stored_name = instance.name
+    write_backend("update_ingredient", copy(instance))
+    for name in {instance.name} | synonym_names([instance]):
+        invalidate_results(instance.recipe_id, name)
+
+
+def ingredient_deleted(sender, instance, **kwargs):
+    """
+    Remove a deleted ingredient from the index and from its results and the
+    results of its synonyms. An ingredient deleted with its recipe is only
+    removed from the suggestions and the dictionary, the rest is done for
+    the whole recipe by recipe_deleted. An ingredient deleted by a bulk write
+    is left to recipe_content_changed
+    """
+    if is_bulk_delete(instance):
+        return
+    write_names((autocomplete, spelling_dictionary), [instance.name], [])
+    if is_cascade_delete(instance):
+        return
+    write_index(search_index, "remove_ingredient", copy(instance))
+    write_index(pantry_matrix, "refresh_recipe", instance.recipe_id)
+    write_backend("remove_ingredient", copy(instance))
+    for name in {instance.name} | synonym_names([instance]):
+        invalidate_results(instance.recipe_id, name)
+
+
+def synonyms_changed(sender, canonical_ids, names, **kwargs):
+    """
+    Reindex the ingredients of a changed synonym group and invalidate the
+    results of the queries naming one of its synonyms
+    """
+    write_index(search_index, "update_synonyms", canonical_ids)
+    write_backend("update_synonyms", canonical_ids)
+    for name in names:
+        invalidate_results(None, name)
+
+
+def recipe_content_changed(sender, recipe_id, saved, deleted, **kwargs):
+    """
+    Index the ingredients of a recipe written in bulk and invalidate their
+    results and the results of their synonyms, the saved ingredients may
+    carry their previous stored name
+    """
+    for ingredient in saved:
+        write_index(search_index, "update_ingredient", copy(ingredient))
+    for ingredient in deleted:
+        write_index(search_index, "remove_ingredient", copy(ingredient))
+    if saved or deleted:
+        write_index(pantry_matrix, "refresh_recipe", recipe_id)
+    previous_names = [getattr(ingredient, "stored_name", None)
+                      for ingredient in saved]
+    write_names((autocomplete, spelling_dictionary),
+                [ingredient.name for ingredient in deleted] +
+                [name for name in previous_names if name is not None],
+                [ingredient.name for ingredient in saved])
+    for ingredient in saved:
+        ingredient.stored_name = ingredient.name
+    if saved:
+        write_backend("update_ingredients", saved)
+    if deleted:
+        write_backend("remove_ingredients", deleted)
+    for name in {ingredient.name for ingredient in saved + deleted} | \
+            synonym_names(saved + deleted):
+        invalidate_results(recipe_id, name)
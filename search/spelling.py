@@ -0,0 +1,257 @@
+"""
+Spelling correction of the query terms
+The dictionary maps every string obtained by deleting up to
+SEARCH_SPELLING_DISTANCE characters from a word of the vocabulary to the
+words it comes from. A misspelled word is corrected by looking up its own
+deletions: the words sharing one of them are the only ones compared to it,
+the vocabulary is never scanned. Only the first PREFIX_LENGTH characters of
+the words are deleted from, which bounds the size of the dictionary.
+
+The vocabulary is made of the canonical words of the recipe and ingredient
+names, weighted by the number of names using them. The dictionary is loaded
+from the SEARCH_SPELLING_PATH file, or built from the database when the file
+is missing or was built with other parameters, and kept up to date in memory
+by the model signals. The file is only written by the
+build_spelling_dictionary command, never while serving a request. Each
+process holds its own dictionary.
+"""
+import json
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+from recipes.models import Recipes, Ingredients
+from recipes.normalize import canonical_name, fold_text
+from .search import ParsedQuery, parse_query, query_tokens
+
+# number of leading characters of the words deletions are made from
+PREFIX_LENGTH = 7
+
+# version of the format of the dictionary file
+FILE_VERSION = 1
+
+
+def edit_distance(source, target, max_distance):
+    """
+    Optimal string alignment distance: the number of insertions, deletions,
+    substitutions and transpositions of adjacent characters
+    :param source: a word
+    :param target: another word
+    :param max_distance: the distance above which the computation stops
+    :return: the distance between the words, max_distance + 1 if it is
+             larger than max_distance
+    """
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+    previous_row = None
+    row = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        previous_row, row, before = row, [i] + [0] * len(target), previous_row
+        for j in range(1, len(target) + 1):
+            cost = source[i - 1] != target[j - 1]
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1,
+                         previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and source[i - 1] == target[j - 2] and \
+                    source[i - 2] == target[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return min(row[-1], max_distance + 1)
+
+
+def deletions(word, max_distance):
+    """
+    :param word: a word
+    :param max_distance: the maximum number of deleted characters
+    :return: the set of the strings obtained by deleting up to max_distance
+             characters from the prefix of the word, the prefix included
+    """
+    results = {word[:PREFIX_LENGTH]}
+    level = set(results)
+    for _ in range(max_distance):
+        level = {text[:position] + text[position + 1:]
+                 for text in level for position in range(len(text))}
+        results |= level
+    return results
+
+
+def name_words(name):
+    """
+    :param name: a recipe or ingredient name
+    :return: the list of the canonical words of the name
+    """
+    return [word for word in canonical_name(name).split()
+            if not word.isdigit()]
+
+
+class SpellingDictionary:
+    """
+    Precomputed deletions of the vocabulary words
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Empty the dictionary, it will be loaded again on next use"""
+        with self.lock:
+            self.built = False
+            self.max_distance = settings.SEARCH_SPELLING_DISTANCE
+            # word -> number of names using the word
+            self.words = {}
+            # deletion -> words it comes from
+            self.deletes = {}
+
+    def _add_word(self, word, count=1):
+        """Count the uses of a word, indexing its deletions if it is new"""
+        if word not in self.words:
+            self.words[word] = 0
+            for deletion in deletions(word, self.max_distance):
+                self.deletes.setdefault(deletion, []).append(word)
+        self.words[word] += count
+
+    def build(self):
+        """Build the dictionary from the names of the database"""
+        words = {}
+        for model in (Recipes, Ingredients):
+            for name in model.objects.values_list("name", flat=True).\
+                    iterator():
+                for word in name_words(name):
+                    words[word] = words.get(word, 0) + 1
+        with self.lock:
+            self.max_distance = settings.SEARCH_SPELLING_DISTANCE
+            self.words = {}
+            self.deletes = {}
+            for word, count in words.items():
+                self._add_word(word, count)
+            self.built = True
+
+    def load(self):
+        """
+        Load the dictionary from its file
+        :return: True if the file exists and was built with the current
+                 parameters
+        """
+        path = settings.SEARCH_SPELLING_PATH
+        try:
+            with open(path, encoding="utf-8") as file:
+                content = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if content.get("version") != FILE_VERSION or \
+                content.get("max_distance") != \
+                settings.SEARCH_SPELLING_DISTANCE or \
+                content.get("prefix_length") != PREFIX_LENGTH:
+            return False
+        with self.lock:
+            self.max_distance = content["max_distance"]
+            self.words = content["words"]
+            self.deletes = content["deletes"]
+            self.built = True
+        return True
+
+    def save(self):
+        """
+        Write the dictionary to its file, replaced at once by a temporary
+        file unique to the writer
+        :raise OSError: if the file cannot be written
+        """
+        path = os.path.abspath(settings.SEARCH_SPELLING_PATH)
+        with self.lock:
+            content = json.dumps({
+                "version": FILE_VERSION, "max_distance": self.max_distance,
+                "prefix_length": PREFIX_LENGTH, "words": self.words,
+                "deletes": self.deletes}, ensure_ascii=False)
+        file = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=os.path.dirname(path),
+            prefix=f"{os.path.basename(path)}.", suffix=".tmp", delete=False)
+        try:
+            with file:
+                file.write(content)
+            os.replace(file.name, path)
+        except OSError:
+            os.unlink(file.name)
+            raise
+
+    def ensure_built(self):
+        """Load the dictionary, building it if the file is missing or stale"""
+        if self.built:
+            return
+        if settings.SEARCH_SPELLING_PATH is None or not self.load():
+            self.build()
+
+    def add(self, name):
+        """Count the words of a written name"""
+        with self.lock:
+            for word in name_words(name):
+                self._add_word(word)
+
+    def remove(self, name):
+        """Remove a use of the words of a deleted name"""
+        with self.lock:
+            for word in name_words(name):
+                if word in self.words:
+                    self.words[word] -= 1
+                    if self.words[word] <= 0:
+                        del self.words[word]
+
+    def correct_word(self, word):
+        """
+        :param word: a folded word
+        :return: the closest vocabulary word, the most used one between words
+                 at the same distance, None if there is none within the
+                 maximum distance, one edit per three characters
+        """
+        if word in self.words:
+            return word
+        max_distance = min(self.max_distance, max(1, len(word) // 3))
+        best = None
+        seen = set()
+        for deletion in deletions(word, max_distance):
+            for candidate in self.deletes.get(deletion, ()):
+                if candidate in seen or candidate not in self.words:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, max_distance)
+                if distance <= max_distance:
+                    key = (distance, -self.words[candidate], candidate)
+                    best = min(best, key) if best else key
+        return best[2] if best else None
+
+    def correct(self, term):
+        """
+        :param term: a normalized query term
+        :return: the term with its unknown words replaced by their
+                 correction
+        """
+        self.ensure_built()
+        words = []
+        with self.lock:
+            for word in term.split():
+                folded = fold_text(word)
+                correction = self.correct_word(folded)
+                words.append(word if correction in (None, folded)
+                             else correction)
+        return " ".join(words)
+
+
+spelling_dictionary = SpellingDictionary()
+
+
+def correct_query(query):
+    """
+    :param query: the user query
+    :return: the canonical form of the query with its misspelled terms
+             corrected, None if no term was corrected
+    """
+    parsed = parse_query(query)
+    corrected = ParsedQuery(*(
+        tuple(dict.fromkeys(spelling_dictionary.correct(term)
+                            for term in terms))
+        for terms in parsed))
+    if corrected == parsed:
+        return None
+    return " ".join(query_tokens(corrected))
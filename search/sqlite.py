@@ -0,0 +1,366 @@
+"""
+SQLite search backend
+The folded recipe names and the canonical ingredient names are copied in a
+local SQLite file, indexed by FTS5 tables with external content: the names are
+stored once in the recipes and ingredients tables, the FTS5 tables only hold
+their trigram index and are kept in sync by triggers. A term matches a name
+containing it or the ingredients of the synonym group it names, as in the
+icontains mode, and the recipes are ranked in the same tiers by a single
+SQLite query, which also applies the required and excluded terms.
+
+The file is filled by the rebuild_search_backend command, or on first read
+when it is missing or its schema is outdated, and kept up to date by the
+model signals once their transaction commits. The writes to a missing or
+outdated file are skipped, the rebuild of the first read loads them. Read
+only nodes can serve the ranked results from a copy of the file.
+"""
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from recipes.models import CanonicalIngredients, Recipes, Ingredients
+from recipes.normalize import canonical_name, fold_text
+from .backends import SearchBackend
+from .search import ALL_INGREDIENTS_RANK, NAME_RANK, ONE_INGREDIENT_RANK, \
+    SEVERAL_INGREDIENTS_RANK, parse_query
+
+# stored in the user_version of the file, an outdated file is rebuilt
+SCHEMA_VERSION = 2
+
+TABLES = (
+    "CREATE TABLE IF NOT EXISTS recipes ("
+    "id INTEGER PRIMARY KEY, folded_name TEXT NOT NULL, "
+    "category_id INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS ingredients ("
+    "id INTEGER PRIMARY KEY, recipe_id INTEGER NOT NULL, "
+    "canonical_name TEXT NOT NULL, group_id INTEGER)",
+    "CREATE INDEX IF NOT EXISTS ingredients_recipe_idx "
+    "ON ingredients (recipe_id)",
+    "CREATE INDEX IF NOT EXISTS ingredients_canonical_idx "
+    "ON ingredients (canonical_name)",
+    "CREATE INDEX IF NOT EXISTS ingredients_group_idx "
+    "ON ingredients (group_id)",
+    # the synonym group of the canonical names in a group
+    "CREATE TABLE IF NOT EXISTS synonyms ("
+    "canonical_name TEXT PRIMARY KEY, group_id INTEGER NOT NULL)",
+)
+
+FTS_TABLES = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5("
+    "folded_name, content='recipes', content_rowid='id', "
+    "tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ingredients_fts USING fts5("
+    "canonical_name, content='ingredients', content_rowid='id', "
+    "tokenize='trigram')",
+)
+
+# the external content tables are not updated by FTS5 itself
+TRIGGERS = tuple(
+    statement.format(table=table, column=column)
+    for table, column in (("recipes", "folded_name"),
+                          ("ingredients", "canonical_name"))
+    for statement in (
+        "CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table} "
+        "BEGIN INSERT INTO {table}_fts (rowid, {column}) "
+        "VALUES (new.id, new.{column}); END",
+        "CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {table} "
+        "BEGIN INSERT INTO {table}_fts ({table}_fts, rowid, {column}) "
+        "VALUES ('delete', old.id, old.{column}); END",
+        "CREATE TRIGGER IF NOT EXISTS {table}_au "
+        "AFTER UPDATE OF {column} ON {table} "
+        "BEGIN INSERT INTO {table}_fts ({table}_fts, rowid, {column}) "
+        "VALUES ('delete', old.id, old.{column}); "
+        "INSERT INTO {table}_fts (rowid, {column}) "
+        "VALUES (new.id, new.{column}); END",
+    ))
+
+DROP_TABLES = (
+    "DROP TABLE IF EXISTS recipes_fts",
+    "DROP TABLE IF EXISTS ingredients_fts",
+    "DROP TABLE IF EXISTS recipes",
+    "DROP TABLE IF EXISTS ingredients",
+    "DROP TABLE IF EXISTS synonyms",
+)
+
+# the ingredients of the synonym group named by a canonical name
+GROUP_SQL = """
+    SELECT recipe_id FROM ingredients WHERE group_id = (
+        SELECT group_id FROM synonyms WHERE canonical_name = ?)
+"""
+
+# recipes matching one query term by an ingredient, a synonym or by their
+# name, the GLOB operator is served by the trigram index, unlike LIKE with an
+# ESCAPE clause
+TERM_HITS_SQL = f"""
+    SELECT ? AS term, ? AS required, ingredients.recipe_id AS recipe_id,
+           1 AS ingredient_hit, 0 AS name_hit
+    FROM ingredients_fts
+    JOIN ingredients ON ingredients.id = ingredients_fts.rowid
+    WHERE ingredients_fts.canonical_name GLOB ?
+    UNION ALL
+    SELECT ?, ?, recipe_id, 1, 0 FROM ({GROUP_SQL})
+    UNION ALL
+    SELECT ?, ?, rowid, 0, 1 FROM recipes_fts
+    WHERE recipes_fts.folded_name GLOB ?
+"""
+
+# recipes containing an excluded term, the subquery is run once for the
+# anti-join instead of once per ranked recipe
+EXCLUDED_SQL = f"""
+    id NOT IN (
+        SELECT ingredients.recipe_id FROM ingredients_fts
+        JOIN ingredients ON ingredients.id = ingredients_fts.rowid
+        WHERE ingredients_fts.canonical_name GLOB ?
+        UNION {GROUP_SQL}
+        UNION
+        SELECT rowid FROM recipes_fts WHERE recipes_fts.folded_name GLOB ?
+    )
+"""
+
+# the ranking of search.search.get_ranked_results
+RANKED_SQL = """
+    SELECT rank, ingredient_hits, id FROM (
+        SELECT CASE WHEN ingredient_hits = ? THEN ?
+                    WHEN ingredient_hits > 1 THEN ?
+                    WHEN name_hit = 1 THEN ?
+                    ELSE ? END AS rank,
+               ingredient_hits, required_hits, id
+        FROM (
+            SELECT recipe_id AS id, SUM(ingredient_hit) AS ingredient_hits,
+                   MAX(name_hit) AS name_hit, SUM(required) AS required_hits
+            FROM (
+                SELECT term, MAX(required) AS required, recipe_id,
+                       MAX(ingredient_hit) AS ingredient_hit,
+                       MAX(name_hit) AS name_hit
+                FROM ({hits}) GROUP BY term, recipe_id
+            ) GROUP BY recipe_id
+        )
+    ) {where}
+    ORDER BY {ordering} LIMIT ?
+"""
+
+
+def glob_pattern(text):
+    """
+    :param text: a folded query term
+    :return: the GLOB pattern matching the names containing the term
+    """
+    escaped = "".join(f"[{char}]" if char in "*?[" else char
+                      for char in text)
+    return f"*{escaped}*"
+
+
+class SqliteBackend(SearchBackend):
+    """
+    Search backend ranking the recipes in a local SQLite file
+    Each thread uses its own connection to the file
+    """
+    modes = ("icontains",)
+
+    def __init__(self, path=None):
+        self.path = path or settings.SEARCH_SQLITE_PATH
+        self.local = threading.local()
+
+    def connection(self):
+        """
+        :return: the connection of the current thread
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+            self.local.current = False
+        return connection
+
+    def current(self):
+        """
+        :return: True if the file has the current schema
+        """
+        connection = self.connection()
+        if not self.local.current:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            self.local.current = version == SCHEMA_VERSION
+        return self.local.current
+
+    def ensure_current(self):
+        """Rebuild the file if it is missing or its schema is outdated"""
+        if not self.current():
+            self.rebuild()
+
+    def close(self):
+        """Close the connection of the current thread"""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    @contextmanager
+    def transaction(self):
+        """Run the statements of the block in a write transaction"""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def ranking_fields(self, mode):
+        return ["rank", "ingredient_hits", "id"]
+
+    def ranked_rows(self, query, limit=None, cursor=None, reverse=False,
+                    mode=None, category=None):
+        parsed = parse_query(query)
+        terms = parsed.terms
+        if not terms:
+            return []
+        required = set(parsed.required)
+        rank_params = [len(terms), ALL_INGREDIENTS_RANK,
+                       SEVERAL_INGREDIENTS_RANK, NAME_RANK,
+                       ONE_INGREDIENT_RANK]
+        hits_params = []
+        for position, term in enumerate(terms):
+            flag = int(term in required)
+            hits_params += [position, flag,
+                            glob_pattern(canonical_name(term)),
+                            position, flag, canonical_name(term),
+                            position, flag, glob_pattern(fold_text(term))]
+        conditions, where_params = [], []
+        if required:
+            conditions.append("required_hits = ?")
+            where_params.append(len(required))
+        for term in parsed.excluded:
+            conditions.append(EXCLUDED_SQL)
+            where_params += [glob_pattern(canonical_name(term)),
+                             canonical_name(term),
+                             glob_pattern(fold_text(term))]
+        if cursor is not None:
+            # the ranking order is the ascending order of (-rank, -hits, id)
+            rank, ingredient_hits, recipe_id = cursor
+            conditions.append("(-rank, -ingredient_hits, id) {} (?, ?, ?)".
+                              format("<" if reverse else ">"))
+            where_params += [-rank, -ingredient_hits, recipe_id]
+        if category is not None:
+            conditions.append(
+                "id IN (SELECT id FROM recipes WHERE category_id = ?)")
+            where_params.append(category)
+        ordering = "rank, ingredient_hits, id DESC" if reverse else \
+            "rank DESC, ingredient_hits DESC, id"
+        sql = RANKED_SQL.format(
+            hits=" UNION ALL ".join([TERM_HITS_SQL] * len(terms)),
+            where=f"WHERE {' AND '.join(conditions)}" if conditions else "",
+            ordering=ordering)
+        params = rank_params + hits_params + where_params + \
+            [limit if limit is not None else -1]
+        self.ensure_current()
+        return self.connection().execute(sql, params).fetchall()
+
+    def rebuild(self):
+        """
+        Replace the content of the file by the names of the database
+        The FTS5 indexes are built once the names are loaded
+        """
+        recipes = Recipes.objects.values_list(
+            "id", "folded_name", "category_id").iterator()
+        ingredients = Ingredients.objects.values_list(
+            "id", "recipe_id", "canonical__name",
+            "canonical__synonym_group_id").iterator()
+        synonyms = CanonicalIngredients.objects.filter(
+            synonym_group__isnull=False).values_list(
+            "name", "synonym_group_id").iterator()
+        with self.transaction() as cursor:
+            for statement in DROP_TABLES + TABLES:
+                cursor.execute(statement)
+            cursor.executemany(
+                "INSERT INTO recipes (id, folded_name, category_id) "
+                "VALUES (?, ?, ?)", recipes)
+            cursor.executemany(
+                "INSERT INTO ingredients "
+                "(id, recipe_id, canonical_name, group_id) "
+                "VALUES (?, ?, ?, ?)", ingredients)
+            cursor.executemany(
+                "INSERT INTO synonyms (canonical_name, group_id) "
+                "VALUES (?, ?)", synonyms)
+            for statement in FTS_TABLES:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild')")
+            cursor.execute("INSERT INTO ingredients_fts (ingredients_fts) "
+                           "VALUES ('rebuild')")
+            for statement in TRIGGERS:
+                cursor.execute(statement)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.local.current = True
+
+    def update_recipe(self, recipe):
+        if not self.current():
+            return
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO recipes (id, folded_name, category_id) "
+                "VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE "
+                "SET folded_name = excluded.folded_name, "
+                "category_id = excluded.category_id",
+                [recipe.id, fold_text(recipe.name), recipe.category_id])
+
+    def remove_recipe(self, recipe_id):
+        if not self.current():
+            return
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM ingredients WHERE recipe_id = ?",
+                           [recipe_id])
+            cursor.execute("DELETE FROM recipes WHERE id = ?", [recipe_id])
+
+    def update_ingredient(self, ingredient):
+        self.update_ingredients([ingredient])
+
+    def update_ingredients(self, ingredients):
+        if not self.current():
+            return
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "INSERT INTO ingredients "
+                "(id, recipe_id, canonical_name, group_id) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (id) DO UPDATE "
+                "SET recipe_id = excluded.recipe_id, "
+                "canonical_name = excluded.canonical_name, "
+                "group_id = excluded.group_id",
+                [[ingredient.id, ingredient.recipe_id,
+                  canonical_name(ingredient.name),
+                  ingredient.canonical.synonym_group_id
+                  if ingredient.canonical_id is not None else None]
+                 for ingredient in ingredients])
+
+    def remove_ingredient(self, ingredient):
+        self.remove_ingredients([ingredient])
+
+    def remove_ingredients(self, ingredients):
+        if not self.current():
+            return
+        with self.transaction() as cursor:
+            cursor.executemany("DELETE FROM ingredients WHERE id = ?",
+                               [[ingredient.id] for ingredient in ingredients])
+
+    def update_synonyms(self, canonical_ids):
+        if not self.current():
+            return
+        rows = list(CanonicalIngredients.objects.filter(
+            id__in=canonical_ids).values_list("name", "synonym_group_id"))
+        with self.transaction() as cursor:
+            cursor.executemany(
+                "DELETE FROM synonyms WHERE canonical_name = ?",
+                [[name] for name, _ in rows])
+            cursor.executemany(
+                "INSERT INTO synonyms (canonical_name, group_id) "
+                "VALUES (?, ?)",
+                [row for row in rows if row[1] is not None])
+            cursor.executemany(
+                "UPDATE ingredients SET group_id = ? "
+                "WHERE canonical_name = ?",
+                [[group_id, name] for name, group_id in rows])
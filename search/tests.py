@@ -1,9 +1,44 @@
 """
 Test file for the search algorithm
 """
-from django.test import TestCase
+import os
+import tempfile
 
-from .search import get_results
+import json
+
+from io import StringIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+
+from accounts.models import MyUser
+from recipes.models import Content, Ingredients, Recipes, SynonymGroups
+from recipes.services import save_new_recipe
+from .autocomplete import autocomplete
+from .backends import get_backend, load_backend
+from .cache import SearchCache, search_cache
+from .index import search_index, tokenize
+from .pantry import add_bitset, equal_bitset, get_pantry_results, \
+    pantry_matrix, parse_pantry
+from .search import PostgresBackend, get_batch_results, get_cached_results, \
+    canonical_query, compile_cached_query, get_category_counts, \
+    get_ranked_results, get_results, get_results_page, normalize_query, \
+    parse_query, plan_cache_stats
+from .spelling import SpellingDictionary, correct_query, edit_distance, \
+    spelling_dictionary
+from .sqlite import SqliteBackend
+
+
+def create_paella():
+    """:return: a recipe written with its ingredients by bulk queries"""
+    return save_new_recipe(
+        Recipes(name="Paella royale", creator_id=1, category_id=1),
+        [Ingredients(name="Tomates", quantity="2"),
+         Ingredients(name="Safran", quantity="1")],
+        [Content(instructions="cuire")])
 
 
 class SearchTest(TestCase):
@@ -33,6 +68,221 @@ class SearchTest(TestCase):
         self.assertEqual(8, results[5].id)
         self.assertEqual(9, results[6].id)
 
+    def test_search_canonical_ingredients(self):
+        """Validate the ingredients are matched by their canonical name"""
+        Ingredients.objects.create(recipe_id=9, name="Tomates", quantity="2")
+        results = get_results("tomate")
+        self.assertEqual([9], [recipe.id for recipe in results])
+        results = get_ranked_results("TOMATES champignon")
+        self.assertEqual([9, 1, 6, 3], [recipe.id for recipe in results])
+
+    def test_search_folded_recipe_names(self):
+        """Validate the recipe names are matched without case or accents"""
+        recipe = Recipes.objects.get(id=9)
+        recipe.name = "Crème brûlée"
+        recipe.save()
+        results = get_results("creme BRULEE")
+        self.assertEqual([9], [recipe.id for recipe in results])
+        self.assertEqual([9], [recipe.id for recipe in
+                               get_ranked_results("brûlée")])
+
+    def test_backfill_folded_names(self):
+        """Validate the backfill command fills the stale folded names"""
+        Recipes.objects.filter(id__in=[1, 2]).update(folded_name="")
+        out = StringIO()
+        call_command("backfill_folded_names", batch_size=2, stdout=out)
+        self.assertIn("2 recipes updated", out.getvalue())
+        self.assertFalse(Recipes.objects.filter(folded_name="").exists())
+
+    def test_normalize_query(self):
+        """Validate the query terms are stripped of non word characters"""
+        self.assertEqual(["galette", "champignon"],
+                         normalize_query("galette, champignons , Galette"))
+        self.assertEqual(0, len(get_results(" , ")))
+
+    def test_query_analysis(self):
+        """Validate the stop words, elisions and plurals of the query"""
+        self.assertEqual(["gratin", "pomme", "terre"],
+                         normalize_query("Gratin de pommes de TERRE"))
+        self.assertEqual(["gigot", "agneau", "huile", "olive"],
+                         normalize_query("gigot d'agneau à l’huile d'olive"))
+        self.assertEqual(["riz"], normalize_query("riz x y"))
+        self.assertEqual(["pomme de terre", "de"],
+                         normalize_query('"pommes de terre" +de'))
+        self.assertEqual(["chorizo"], normalize_query("chorizo -de"))
+        self.assertEqual(0, len(get_results("de la")))
+
+    def test_query_plan_cache(self):
+        """Validate the plans of the repeated queries are compiled once"""
+        compile_cached_query.cache_clear()
+        self.assertEqual([1, 2, 7, 4], [recipe.id for recipe in
+                                        get_ranked_results("chorizos")])
+        self.assertEqual([1, 2, 7, 4], [recipe.id for recipe in
+                                        get_ranked_results("Chorizo, du")])
+        self.assertEqual({"hits": 1, "misses": 1},
+                         {key: value for key, value in
+                          plan_cache_stats()["plans"].items()
+                          if key in ("hits", "misses")})
+        get_ranked_results("chorizo", mode="index")
+        self.assertEqual(1, compile_cached_query.cache_info().currsize)
+
+    def test_parse_query(self):
+        """Validate the operators and the phrases of the query language"""
+        parsed = parse_query('+galette "Pomme  de, terre" -chorizo Galette -')
+        self.assertEqual(("galette", "pomme de terre"), parsed.terms)
+        self.assertEqual(("galette",), parsed.required)
+        self.assertEqual(("chorizo",), parsed.excluded)
+        self.assertEqual('galette +"pomme de terre" -chorizo',
+                         canonical_query('-Chorizo galette +"Pomme de terre"'))
+        self.assertEqual(0, len(get_results("-chorizo")))
+
+    def test_canonical_query_idempotent(self):
+        """Validate the quoted stop words survive a second canonicalization"""
+        self.assertEqual('"de" tomate', canonical_query('"de" tomate'))
+        for query in ('"de" tomate', 'galette "x"', '+"la" -"de" riz',
+                      '"pommes de terre" du', "-Chorizo galette +Riz"):
+            canonical = canonical_query(query)
+            self.assertEqual(canonical, canonical_query(canonical))
+
+    def test_search_excluded_terms(self):
+        """Validate the recipes containing an excluded term are left out"""
+        self.assertEqual([3, 5, 6, 8, 9], [
+            recipe.id for recipe in
+            get_ranked_results("galette champignons -chorizo")])
+        for mode in ("icontains", "fulltext", "fuzzy", "index"):
+            self.assertEqual({3, 5, 6, 8, 9}, {
+                recipe.id for recipe in
+                get_results("galette champignons -Chorizo", mode=mode)})
+
+    def test_search_required_terms(self):
+        """Validate every recipe contains the required terms"""
+        self.assertEqual([1, 3, 5, 2, 8], [
+            recipe.id for recipe in
+            get_ranked_results("+galette champignons")])
+        self.assertEqual([1, 3], [
+            recipe.id for recipe in
+            get_ranked_results("+galette +champignons")])
+        self.assertEqual({1, 3}, {
+            recipe.id for recipe in
+            get_results("+galette +champignons", mode="fulltext")})
+
+    def test_search_phrases(self):
+        """Validate a phrase matches a multi-word name as a whole"""
+        Ingredients.objects.create(recipe_id=9, name="Pommes de terre",
+                                   quantity="2")
+        Ingredients.objects.create(recipe_id=6, name="Terre", quantity="1")
+        Ingredients.objects.create(recipe_id=8, name="Pomme", quantity="1")
+        self.assertEqual([9], [recipe.id for recipe in
+                               get_ranked_results('"pomme de terre"')])
+        self.assertEqual({6, 8, 9}, {recipe.id for recipe in
+                                     get_results("pomme de terre")})
+        for mode in ("fulltext", "index"):
+            self.assertEqual([9], [
+                recipe.id for recipe in
+                get_results('"pommes de terre"', mode=mode)])
+        self.assertEqual([8], [recipe.id for recipe in
+                               get_ranked_results('pomme -"pomme de terre"')])
+
+    def test_fulltext_search_single_term(self):
+        """Validate the full text search with a single term"""
+        results = get_results("chorizo", mode="fulltext")
+        self.assertEqual({1, 2, 4, 7}, {recipe.id for recipe in results})
+
+    def test_fulltext_search_multiple_terms(self):
+        """Validate the full text search with multiple terms"""
+        results = get_results("galette, champignons", mode="fulltext")
+        self.assertEqual({1, 2, 3, 5, 6, 8, 9},
+                         {recipe.id for recipe in results})
+
+    def test_fulltext_search_vector_updated_on_save(self):
+        """Validate the search vector follows the ingredient name"""
+        ingredient = Ingredients.objects.get(id=13)
+        ingredient.name = "tomates"
+        ingredient.save()
+        results = get_results("tomate", mode="fulltext")
+        self.assertEqual([6], [recipe.id for recipe in results])
+        self.assertEqual(0, len(get_results("vodka", mode="fulltext")))
+
+    def test_ranked_search_order(self):
+        """Validate the recipes are ordered by relevance tier"""
+        results = get_ranked_results("galette chorizo jambon")
+        self.assertEqual([2, 1, 3, 4, 5, 7, 8],
+                         [recipe.id for recipe in results])
+        self.assertEqual([4, 3, 3, 2, 2, 1, 1],
+                         [recipe.rank for recipe in results])
+
+    def test_ranked_search_fulltext(self):
+        """Validate the ranking is the same in the fulltext mode"""
+        results = get_ranked_results("galette, champignons", mode="fulltext")
+        self.assertEqual([1, 3, 5, 6, 2, 8, 9],
+                         [recipe.id for recipe in results])
+
+    def test_ranked_search_limit(self):
+        """Validate the number of ranked results can be limited"""
+        results = get_ranked_results("galette, champignons", limit=3)
+        self.assertEqual([1, 3, 5], [recipe.id for recipe in results])
+
+    def test_fuzzy_search_typo(self):
+        """Validate the fuzzy search tolerates typos"""
+        results = get_results("chorizzo", mode="fuzzy")
+        self.assertEqual({1, 2, 4, 7}, {recipe.id for recipe in results})
+        self.assertEqual(0, len(get_results("chorizzo")))
+
+    def test_fuzzy_threshold(self):
+        """Validate the connections get the configured threshold"""
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW pg_trgm.word_similarity_threshold")
+            self.assertEqual(str(settings.SEARCH_TRIGRAM_THRESHOLD),
+                             cursor.fetchone()[0])
+
+    def test_fuzzy_search_exact_first(self):
+        """Validate the fuzzy matches are ranked below the exact matches"""
+        results = get_ranked_results("galete champignons", mode="fuzzy")
+        self.assertEqual([1, 3, 6, 9, 5, 2, 8],
+                         [recipe.id for recipe in results])
+
+    def test_results_pages(self):
+        """Validate the keyset pagination of the ranked results"""
+        query = "galette, champignons"
+        first, previous_cursor, next_cursor = get_results_page(query, 3)
+        self.assertEqual([1, 3, 5], [recipe.id for recipe in first])
+        self.assertIsNone(previous_cursor)
+        second, previous_cursor, next_cursor = get_results_page(
+            query, 3, after=next_cursor)
+        self.assertEqual([6, 2, 8], [recipe.id for recipe in second])
+        self.assertIsNotNone(previous_cursor)
+        last, previous_cursor, next_cursor = get_results_page(
+            query, 3, after=next_cursor)
+        self.assertEqual([9], [recipe.id for recipe in last])
+        self.assertIsNone(next_cursor)
+        second, previous_cursor, next_cursor = get_results_page(
+            query, 3, before=previous_cursor)
+        self.assertEqual([6, 2, 8], [recipe.id for recipe in second])
+        first, previous_cursor, next_cursor = get_results_page(
+            query, 3, before=previous_cursor)
+        self.assertEqual([1, 3, 5], [recipe.id for recipe in first])
+        self.assertIsNone(previous_cursor)
+        self.assertIsNotNone(next_cursor)
+
+    def test_fuzzy_results_pages(self):
+        """Validate the keyset pagination with the fuzzy ranking"""
+        _, _, next_cursor = get_results_page("galete champignons", 4,
+                                             mode="fuzzy")
+        page, _, next_cursor = get_results_page(
+            "galete champignons", 4, after=next_cursor, mode="fuzzy")
+        self.assertEqual([5, 2, 8], [recipe.id for recipe in page])
+        self.assertIsNone(next_cursor)
+
+    def test_results_page_invalid_cursor(self):
+        """Validate a malformed cursor is rejected"""
+        with self.assertRaises(ValueError):
+            get_results_page("chorizo", 3, after="4.a")
+
+    def test_unknown_search_mode(self):
+        """Validate an unknown search mode is rejected"""
+        with self.assertRaises(ValueError):
+            get_results("chorizo", mode="unknown")
+
     def test_landing_view(self):
         """Test the landing page is displayed properly"""
         response = self.client.get("/")
@@ -41,17 +291,916 @@ class SearchTest(TestCase):
         self.assertTemplateUsed(response, "search/landing.html")
 
     def test_landing_view_post(self):
-        """Test the search result page is displayed properly"""
-        context_data = {"query": "champignons"}
-        response = self.client.post("/", data=context_data)
-        self.assertEqual(200, response.status_code)
+        """Test the search is redirected to the canonical results page"""
+        context_data = {"query": "Galette, champignons"}
+        response = self.client.post("/", data=context_data, follow=True)
+        self.assertRedirects(response, "/search?q=champignon+galette")
         self.assertTemplateUsed(response, "search/base.html")
         self.assertTemplateUsed(response, "search/results.html")
 
+    def test_search_view_canonical_redirect(self):
+        """Test the search page redirects to the canonical query"""
+        response = self.client.get("/search?q=galette+Champignons+galette")
+        self.assertRedirects(response, "/search?q=champignon+galette",
+                             status_code=301)
+        response = self.client.get("/search?q=-chorizo+galette")
+        self.assertRedirects(response, "/search?q=galette+-chorizo",
+                             status_code=301)
+
+    @override_settings(SEARCH_PAGE_SIZE=3)
+    def test_search_view_pages(self):
+        """Test the search result pages are linked"""
+        search_cache.clear()
+        response = self.client.get("/search?q=champignon")
+        self.assertEqual(3, len(response.context["results"]))
+        self.assertIsNone(response.context["previous_url"])
+        response = self.client.get(response.context["next_url"])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([6], [recipe.id for recipe in
+                               response.context["results"]])
+        self.assertIsNone(response.context["next_url"])
+
+    def test_search_view_conditional(self):
+        """Test the search page is revalidated with its validators"""
+        response = self.client.get("/search?q=chorizo")
+        self.assertEqual(200, response.status_code)
+        self.assertIn("max-age", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        self.assertNotIn("Last-Modified", response.headers)
+        response = self.client.get("/search?q=chorizo",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b"", response.content)
+        Recipes.objects.get(id=7).save()
+        response = self.client.get("/search?q=chorizo",
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    @override_settings(SEARCH_SPELLING_PATH=None)
     def test_landing_post_empty(self):
         """Test the empty results' page is displayed properly"""
         context_data = {"query": "bob"}
-        response = self.client.post("/", data=context_data)
+        response = self.client.post("/", data=context_data, follow=True)
         self.assertEqual(200, response.status_code)
         self.assertTemplateUsed(response, "search/base.html")
         self.assertTemplateUsed(response, "search/empty.html")
+        spelling_dictionary.clear()
+
+
+class FacetTest(TestCase):
+    """
+    Verify the category counts and the category filter of the results
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Start from an empty results cache"""
+        search_cache.clear()
+
+    def test_category_counts(self):
+        """Validate the recipes are counted by category in one query"""
+        with self.assertNumQueries(1):
+            counts = get_category_counts("galette champignons")
+        self.assertEqual([(1, "Category1", 4), (2, "Category2", 3)], counts)
+        self.assertEqual([], get_category_counts(" , "))
+
+    def test_category_counts_modes(self):
+        """Validate the counts match the results of each search mode"""
+        for mode in ("icontains", "fulltext", "fuzzy", "index"):
+            results = get_results("chorizo galette", mode=mode)
+            self.assertEqual(
+                len({recipe.id for recipe in results}),
+                sum(count for _, _, count in
+                    get_category_counts("chorizo galette", mode=mode)))
+        search_index.clear()
+
+    def test_category_filter(self):
+        """Validate the ranked pages are filtered on a category"""
+        page, _, next_cursor = get_results_page("galette champignons", 2,
+                                                category=1)
+        self.assertEqual([1, 3], [recipe.id for recipe in page])
+        page, _, next_cursor = get_results_page(
+            "galette champignons", 2, after=next_cursor, category=1)
+        self.assertEqual([5, 9], [recipe.id for recipe in page])
+        self.assertIsNone(next_cursor)
+        self.assertEqual([6, 2, 8], [
+            recipe.id for recipe in get_ranked_results(
+                "galette champignons", category=2)])
+
+    def test_category_cache_invalidation(self):
+        """Validate a recipe moved to a category enters its cached results"""
+        self.assertEqual([6, 2, 8], [recipe.id for recipe in
+                                     get_cached_results(
+                                         "galette champignons", 5,
+                                         category=2)])
+        recipe = Recipes.objects.get(id=9)
+        recipe.category_id = 2
+        recipe.save()
+        self.assertEqual([6, 2, 8, 9], [recipe.id for recipe in
+                                        get_cached_results(
+                                            "galette champignons", 5,
+                                            category=2)])
+
+    def test_search_view_facets(self):
+        """Validate the search page lists and applies the category filter"""
+        response = self.client.get("/search", {"q": "champignon galette"})
+        facets = response.context["facets"]
+        self.assertEqual(["Category1", "Category2"],
+                         [facet["name"] for facet in facets])
+        self.assertEqual([4, 3], [facet["count"] for facet in facets])
+        self.assertFalse(any(facet["active"] for facet in facets))
+        response = self.client.get(facets[1]["url"])
+        self.assertEqual([6, 2, 8], [recipe.id for recipe in
+                                     response.context["results"]])
+        facets = response.context["facets"]
+        self.assertTrue(facets[1]["active"])
+        self.assertEqual("/search?q=champignon+galette", facets[1]["url"])
+        self.assertContains(response, "Category2")
+
+    def test_search_view_invalid_category(self):
+        """Validate a malformed category is dropped"""
+        response = self.client.get("/search", {"q": "chorizo",
+                                               "category": "a"})
+        self.assertRedirects(response, "/search?q=chorizo",
+                             status_code=301)
+
+
+class BatchSearchTest(TestCase):
+    """
+    Verify the batch search ranks each query as the single query search
+    """
+    fixtures = ["test_recipes.json"]
+    queries = ["chorizo", "galette, champignons", "Champignons jambon",
+               "banane", "inconnu", " , ", "galette champignons -chorizo",
+               "+galette champignons -jambon", '"galette chorizo"']
+
+    def test_batch_ranking(self):
+        """Validate each query is ranked as by get_ranked_results"""
+        for mode in ("icontains", "fulltext", "fuzzy"):
+            results = get_batch_results(
+                [(query, None) for query in self.queries], mode=mode)
+            for query, recipes in zip(self.queries, results):
+                self.assertEqual(
+                    [(recipe.id, recipe.name) for recipe in
+                     get_ranked_results(query, mode=mode)], recipes)
+
+    def test_batch_single_query(self):
+        """Validate the queries share a single database query"""
+        with self.assertNumQueries(1):
+            get_batch_results([(query, None) for query in self.queries])
+
+    def test_batch_limit(self):
+        """Validate the limit of each query"""
+        results = get_batch_results([("galette, champignons", 3),
+                                     ("galette, champignons", 1)])
+        self.assertEqual([1, 3, 5], [recipe_id for recipe_id, _ in
+                                     results[0]])
+        self.assertEqual([1], [recipe_id for recipe_id, _ in results[1]])
+
+    def test_batch_view(self):
+        """Validate the batch search JSON API"""
+        response = self.client.post(
+            "/search/batch", {"queries": ["chorizo",
+                                          {"q": "galette", "limit": 2}]},
+            content_type="application/json")
+        self.assertEqual(200, response.status_code)
+        results = response.json()["results"]
+        self.assertEqual("chorizo", results[0]["query"])
+        self.assertEqual([1, 2, 7, 4], [recipe["id"] for recipe in
+                                        results[0]["recipes"]])
+        self.assertEqual(2, len(results[1]["recipes"]))
+        self.assertEqual(Recipes.objects.get(id=1).name,
+                         results[1]["recipes"][0]["name"])
+
+    def test_batch_view_errors(self):
+        """Validate the malformed batch requests are rejected"""
+        for body in ("{", "[]", '{"queries": []}', '{"queries": [1]}',
+                     '{"queries": [{"q": "riz", "limit": 0}]}'):
+            response = self.client.post("/search/batch", body,
+                                        content_type="application/json")
+            self.assertEqual(400, response.status_code)
+            self.assertIn("error", response.json())
+        self.assertEqual(405, self.client.get("/search/batch").status_code)
+
+
+class ExportTest(TestCase):
+    """
+    Verify the search exports stream all the ranked recipes
+    """
+    fixtures = ["test_recipes.json"]
+
+    def test_export_ndjson(self):
+        """Validate the recipes are streamed as lines of JSON objects"""
+        response = self.client.get("/search/export",
+                                   {"q": "galette champignons"})
+        self.assertTrue(response.streaming)
+        self.assertEqual("application/x-ndjson", response["Content-Type"])
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([1, 3, 5, 6, 2, 8, 9], [row["id"] for row in rows])
+        recipe = Recipes.objects.get(id=1)
+        self.assertEqual({"id": 1, "name": recipe.name,
+                          "category": recipe.category.name}, rows[0])
+
+    @override_settings(SEARCH_EXPORT_CHUNK_SIZE=2)
+    def test_export_json(self):
+        """Validate the recipes are streamed as a JSON array"""
+        response = self.client.get("/search/export",
+                                   {"q": "chorizo", "format": "json"})
+        self.assertEqual("application/json", response["Content-Type"])
+        rows = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([1, 2, 7, 4], [row["id"] for row in rows])
+        response = self.client.get("/search/export",
+                                   {"q": "inconnu", "format": "json"})
+        self.assertEqual([], json.loads(b"".join(response.streaming_content)))
+
+
+class SearchIndexTest(TestCase):
+    """
+    Verify the in memory index returns the same sets as the database search
+    and follows the writes to the recipes and ingredients
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Build the index from the fixture"""
+        search_index.build()
+
+    def tearDown(self):
+        """Drop the index built from the test database"""
+        search_index.clear()
+
+    def test_tokenize(self):
+        """Validate the names are split into normalized tokens"""
+        self.assertEqual({"creme", "brulee"}, tokenize("Crème  Brûlée"))
+
+    def test_index_search(self):
+        """Validate the index search matches the icontains search"""
+        for query in ("chorizo", "galette, champignons", "champignon"):
+            self.assertEqual(
+                {recipe.id for recipe in get_results(query)},
+                {recipe.id for recipe in get_results(query, mode="index")})
+
+    def test_index_ranked_search(self):
+        """Validate the ranking is the same in the index mode"""
+        results = get_ranked_results("galette chorizo jambon", mode="index")
+        self.assertEqual([2, 1, 3, 4, 5, 7, 8],
+                         [recipe.id for recipe in results])
+
+    def test_rolled_back_write(self):
+        """Validate a rolled back write is not indexed"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Ingredients.objects.create(recipe_id=9, name="Safran",
+                                           quantity="1")
+                raise RuntimeError("rollback")
+        self.assertEqual(0, len(get_results("safran", mode="index")))
+
+    def test_index_updated_on_ingredient_save(self):
+        """Validate the index follows the ingredient writes"""
+        ingredient = Ingredients.objects.get(id=13)
+        ingredient.name = "Tomates"
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual([6], [recipe.id for recipe in
+                               get_results("tomate", mode="index")])
+        self.assertEqual(0, len(get_results("vodka", mode="index")))
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+        self.assertEqual(0, len(get_results("tomate", mode="index")))
+
+    def test_index_updated_on_bulk_create(self):
+        """Validate the index follows the ingredients written in bulk"""
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_paella()
+        self.assertEqual([recipe.id], [recipe.id for recipe in
+                                       get_results("tomate", mode="index")])
+
+    def test_index_updated_on_recipe_delete(self):
+        """Validate the deleted recipes are removed from the index"""
+        Recipes.objects.get(id=1).delete()
+        results = get_results("chorizo", mode="index")
+        self.assertEqual({2, 4, 7}, {recipe.id for recipe in results})
+
+    def test_index_memory_usage(self):
+        """Validate the memory usage report"""
+        report = search_index.memory_usage()
+        self.assertEqual(9, report["recipe_tokens"]["recipes"])
+        self.assertEqual(13, report["ingredients"]["tokens"])
+        self.assertGreater(report["bytes"], 0)
+
+
+class SearchCacheTest(TestCase):
+    """
+    Verify the results cache sharing, eviction and invalidation
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Start from an empty cache"""
+        search_cache.clear()
+
+    def test_cache_key_ignores_terms_order(self):
+        """Validate reordered queries share a cache entry"""
+        first = get_cached_results("Galette  chorizo")
+        second = get_cached_results("chorizo galette")
+        self.assertEqual([recipe.id for recipe in first],
+                         [recipe.id for recipe in second])
+        self.assertEqual(1, search_cache.stats()["hits"])
+        self.assertEqual(1, search_cache.stats()["misses"])
+
+    def test_cache_lru_eviction(self):
+        """Validate the least recently used entry is evicted"""
+        cache = SearchCache(max_size=2, ttl=60)
+        cache.set(("icontains", ("a",), None), [(1, "4.1.1")])
+        cache.set(("icontains", ("b",), None), [(2, "4.1.2")])
+        cache.get(("icontains", ("a",), None))
+        cache.set(("icontains", ("c",), None), [(3, "4.1.3")])
+        self.assertEqual(((1, "4.1.1"),),
+                         cache.get(("icontains", ("a",), None)))
+        self.assertIsNone(cache.get(("icontains", ("b",), None)))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_cache_ttl(self):
+        """Validate the expired entries are not returned"""
+        cache = SearchCache(max_size=2, ttl=-1)
+        cache.set(("icontains", ("a",), None), [(1, "4.1.1")])
+        self.assertIsNone(cache.get(("icontains", ("a",), None)))
+
+    def test_cache_invalidated_by_listed_recipe(self):
+        """Validate a write to a listed recipe invalidates the entry"""
+        get_cached_results("chorizo")
+        Ingredients.objects.get(id=15).delete()
+        results = get_cached_results("chorizo")
+        self.assertEqual([1, 2, 4], [recipe.id for recipe in results])
+
+    def test_cache_invalidated_by_matching_name(self):
+        """Validate a write matching a term invalidates the entry"""
+        get_cached_results("vodka")
+        get_cached_results("tomate")
+        ingredient = Ingredients.objects.get(id=10)
+        ingredient.name = "Tomates"
+        ingredient.save()
+        self.assertEqual(1, search_cache.stats()["size"])
+        results = get_cached_results("tomate")
+        self.assertEqual([4], [recipe.id for recipe in results])
+
+    def test_cache_invalidated_on_commit(self):
+        """Validate the entries read before the commit are dropped by it"""
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredients.objects.get(id=10)
+            ingredient.name = "Tomates"
+            ingredient.save()
+            get_cached_results("tomate")
+            self.assertEqual(1, search_cache.stats()["size"])
+        self.assertEqual(0, search_cache.stats()["size"])
+
+    def test_cache_invalidated_by_excluded_term(self):
+        """Validate deleting an excluded ingredient invalidates the entry"""
+        self.assertEqual([1, 7, 4], [recipe.id for recipe in
+                                     get_cached_results("chorizo -jambon")])
+        Ingredients.objects.get(id=6).delete()
+        self.assertEqual([1, 2, 7, 4], [
+            recipe.id for recipe in get_cached_results("chorizo -jambon")])
+
+    def test_stats_view(self):
+        """Validate the cache counters are exposed to the staff"""
+        staff = MyUser.objects.create_user(username="staff", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get("/search/stats")
+        self.assertEqual(200, response.status_code)
+        self.assertIn("hits", response.json()["cache"])
+        self.assertIn("hits", response.json()["plans"]["queries"])
+
+
+class SynonymTest(TestCase):
+    """
+    Verify the ingredients are matched from the names of their synonyms
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Index the fixture and start from an empty cache"""
+        search_index.build()
+        search_cache.clear()
+
+    def tearDown(self):
+        """Drop the index built from the fixture"""
+        search_index.clear()
+
+    def test_synonym_search(self):
+        """Validate a synonym matches the ingredients of its group"""
+        with self.captureOnCommitCallbacks(execute=True):
+            SynonymGroups.objects.create(name="lardons",
+                                         synonyms="Lardons\njambon")
+        for mode in ("icontains", "fulltext", "index"):
+            self.assertEqual({2, 3}, {recipe.id for recipe in
+                                      get_results("lardon", mode=mode)})
+        self.assertEqual([2, 3], [recipe.id for recipe in
+                                  get_ranked_results("lardons")])
+        self.assertEqual([1, 8, 5], [
+            recipe.id for recipe in get_ranked_results("galette -lardons")])
+
+    def test_synonym_new_ingredient(self):
+        """Validate an ingredient added later is linked to its group"""
+        with self.captureOnCommitCallbacks(execute=True):
+            SynonymGroups.objects.create(name="lardons",
+                                         synonyms="lardons\njambon")
+            Ingredients.objects.create(recipe_id=8, name="Lardons",
+                                       quantity="100g")
+        self.assertEqual([2, 3, 8], [recipe.id for recipe in
+                                     get_ranked_results("jambon")])
+        self.assertEqual({2, 3, 8}, {recipe.id for recipe in
+                                     get_results("jambon", mode="index")})
+
+    def test_synonym_reindex(self):
+        """Validate a change of a group reindexes the affected recipes"""
+        self.assertEqual([], get_cached_results("lardons"))
+        with self.captureOnCommitCallbacks(execute=True):
+            group = SynonymGroups.objects.create(
+                name="lardons", synonyms="lardons\njambon")
+        self.assertEqual([2, 3], [recipe.id for recipe in
+                                  get_cached_results("lardons")])
+        group.synonyms = "lardons\nchorizo"
+        with self.captureOnCommitCallbacks(execute=True):
+            group.save()
+        self.assertEqual([1, 2, 7], [recipe.id for recipe in
+                                     get_cached_results("lardons")])
+        self.assertEqual({1, 2, 7}, {
+            recipe.id for recipe in get_results("lardons", mode="index")})
+        with self.captureOnCommitCallbacks(execute=True):
+            group.delete()
+        self.assertEqual([], get_cached_results("lardons"))
+        self.assertEqual(0, len(get_results("lardons", mode="index")))
+
+    def test_synonym_cache_invalidation(self):
+        """Validate a new ingredient enters the results of its synonyms"""
+        SynonymGroups.objects.create(name="lardons",
+                                     synonyms="lardons\npoitrine fumée")
+        self.assertEqual([], get_cached_results("lardons"))
+        Ingredients.objects.create(recipe_id=8, name="Poitrine fumée",
+                                   quantity="100g")
+        self.assertEqual([8], [recipe.id for recipe in
+                               get_cached_results("lardons")])
+        recipe = save_new_recipe(
+            Recipes(name="Quiche", creator_id=1, category_id=1),
+            [Ingredients(name="Poitrine fumée", quantity="200g")])
+        self.assertEqual({8, recipe.id}, {
+            recipe.id for recipe in get_cached_results("lardons")})
+
+    def test_synonym_group_validation(self):
+        """Validate a synonym belongs to a single group"""
+        SynonymGroups.objects.create(name="lardons",
+                                     synonyms="lardons\njambon")
+        group = SynonymGroups(name="charcuterie", synonyms="Jambons")
+        with self.assertRaises(ValidationError):
+            group.full_clean()
+
+
+class SpellingTest(TestCase):
+    """
+    Verify the spelling corrections and the automatic retry of the search
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Save the dictionary in a temporary directory"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(SEARCH_SPELLING_PATH=os.path.join(
+            self.directory.name, "search_spelling.json"))
+        self.settings.enable()
+        spelling_dictionary.clear()
+        search_cache.clear()
+
+    def tearDown(self):
+        """Drop the dictionary built from the fixture"""
+        spelling_dictionary.clear()
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_edit_distance(self):
+        """Validate the edits and the transpositions are counted"""
+        self.assertEqual(0, edit_distance("galette", "galette", 2))
+        self.assertEqual(1, edit_distance("galete", "galette", 2))
+        self.assertEqual(1, edit_distance("cohrizo", "chorizo", 2))
+        self.assertEqual(2, edit_distance("champinons", "champignon", 2))
+        self.assertEqual(3, edit_distance("riz", "banane", 2))
+
+    def test_correct_query(self):
+        """Validate the misspelled terms are corrected"""
+        self.assertEqual("chorizo galette -champignon",
+                         correct_query("chorizzo galete -champinons"))
+        self.assertEqual('+"galette chorizo"',
+                         correct_query('+"galete chorizo"'))
+        self.assertIsNone(correct_query("chorizo galette"))
+        self.assertIsNone(correct_query("zzzzzz"))
+
+    def test_dictionary_file(self):
+        """Validate the dictionary is loaded from the file of the command"""
+        spelling_dictionary.ensure_built()
+        self.assertEqual([], os.listdir(self.directory.name))
+        out = StringIO()
+        call_command("build_spelling_dictionary", stdout=out)
+        self.assertIn("words saved", out.getvalue())
+        self.assertEqual(["search_spelling.json"],
+                         os.listdir(self.directory.name))
+        dictionary = SpellingDictionary()
+        with self.assertNumQueries(0):
+            dictionary.ensure_built()
+        self.assertEqual("chorizo", dictionary.correct("chorizzo"))
+
+    def test_dictionary_file_error(self):
+        """Validate a dictionary which cannot be saved is reported"""
+        with override_settings(SEARCH_SPELLING_PATH=os.path.join(
+                self.directory.name, "missing", "search_spelling.json")):
+            with self.assertRaises(CommandError):
+                call_command("build_spelling_dictionary", stdout=StringIO())
+
+    def test_dictionary_updated_on_write(self):
+        """Validate the written names enter the dictionary"""
+        spelling_dictionary.ensure_built()
+        ingredient = Ingredients.objects.get(id=13)
+        ingredient.name = "Vermicelles"
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual("vermicelle", spelling_dictionary.correct(
+            "vermiceles"))
+        self.assertEqual("vodkaa", spelling_dictionary.correct("vodkaa"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipes.objects.get(id=7).delete()
+        self.assertEqual("paela", spelling_dictionary.correct("paela"))
+
+    def test_search_view_retry(self):
+        """Validate a query without results is retried with the correction"""
+        response = self.client.get("/search?q=chorizzo")
+        self.assertEqual([1, 2, 7, 4], [recipe.id for recipe in
+                                        response.context["results"]])
+        self.assertEqual("chorizzo", response.context["original_query"])
+        self.assertEqual("chorizo", response.context["query"])
+        with override_settings(SEARCH_SPELLING_RETRY=False):
+            response = self.client.get("/search?q=chorizzo")
+        self.assertTemplateUsed(response, "search/empty.html")
+        self.assertEqual("/search?q=chorizo",
+                         response.context["correction_url"])
+
+
+class AutocompleteTest(TestCase):
+    """
+    Verify the ingredient suggestions and their updates
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Build the suggestions from the fixture"""
+        autocomplete.build()
+
+    def tearDown(self):
+        """Drop the suggestions built from the test database"""
+        autocomplete.clear()
+
+    def test_suggest_by_usage(self):
+        """Validate the suggestions are ordered by number of uses"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredients.objects.create(recipe_id=9, name="Chorizo",
+                                       quantity="1")
+        self.assertEqual(["chorizo", "champignons"],
+                         autocomplete.suggest("CH", 5))
+        self.assertEqual(["chorizo"], autocomplete.suggest("ch", 1))
+        self.assertEqual([], autocomplete.suggest(" ", 5))
+
+    def test_suggest_updated_on_write(self):
+        """Validate the suggestions follow the ingredient writes"""
+        ingredient = Ingredients.objects.get(id=13)
+        ingredient.name = "Vodka Citron"
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(["Vodka Citron"], autocomplete.suggest("vodka", 5))
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+        self.assertEqual([], autocomplete.suggest("vodka", 5))
+
+    def test_suggest_updated_on_bulk_create(self):
+        """Validate the suggestions follow the ingredients written in bulk"""
+        with self.captureOnCommitCallbacks(execute=True):
+            create_paella()
+        self.assertEqual(["Safran"], autocomplete.suggest("saf", 5))
+
+    def test_suggest_rolled_back_write(self):
+        """Validate a rolled back write is not suggested"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Ingredients.objects.create(recipe_id=9, name="Zucchini",
+                                           quantity="1")
+                raise RuntimeError("rollback")
+        self.assertEqual([], autocomplete.suggest("zuc", 5))
+
+    def test_suggest_view(self):
+        """Validate the suggestions endpoint"""
+        response = self.client.get("/search/suggest?q=Cre&limit=3")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"suggestions": ["crevettes"]}, response.json())
+
+
+class BackendConformance:
+    """
+    Ranking expectations shared by the search backends, the backend under
+    test is set by the concrete test cases
+    """
+    fixtures = ["test_recipes.json"]
+    backend = None
+
+    def ranked_ids(self, query, limit=None, cursor=None, reverse=False):
+        """:return: the ids of the recipes ranked by the backend"""
+        fields = self.backend.ranking_fields("icontains")
+        return [row[fields.index("id")] for row in self.backend.ranked_rows(
+            query, limit, cursor, reverse, mode="icontains")]
+
+    def test_ranked_single_term(self):
+        """Validate the ranking of a single term"""
+        self.assertEqual([1, 2, 7, 4], self.ranked_ids("chorizo"))
+
+    def test_ranked_multiple_terms(self):
+        """Validate the ranking of several terms"""
+        self.assertEqual([1, 3, 5, 6, 2, 8, 9],
+                         self.ranked_ids("galette, champignons"))
+        self.assertEqual([1, 3, 5], self.ranked_ids("galette champignons",
+                                                    limit=3))
+
+    def test_ranked_keyset(self):
+        """Validate the rows ranked after and before a cursor"""
+        rows = self.backend.ranked_rows("galette champignons",
+                                        mode="icontains")
+        self.assertEqual([6, 2, 8],
+                         self.ranked_ids("galette champignons", 3, rows[2]))
+        self.assertEqual([6, 5],
+                         self.ranked_ids("galette champignons", 2, rows[4],
+                                         reverse=True))
+
+    def test_ranked_category(self):
+        """Validate the recipes are filtered on their category"""
+        self.assertEqual([6, 2, 8], [
+            row[-1] for row in self.backend.ranked_rows(
+                "galette champignons", mode="icontains", category=2)])
+
+    def test_ranked_operators(self):
+        """Validate the required and excluded terms"""
+        self.assertEqual([3, 5, 6, 8, 9],
+                         self.ranked_ids("galette champignons -chorizo"))
+        self.assertEqual([1, 3, 5, 2, 8],
+                         self.ranked_ids("+galette champignons"))
+        self.assertEqual([8, 5], self.ranked_ids("+galette -champignons "
+                                                 "-jambon"))
+        self.assertEqual([1], self.ranked_ids('"galette chorizo"'))
+
+    def test_ranked_synonyms(self):
+        """Validate the ingredients are matched from their synonyms"""
+        with self.captureOnCommitCallbacks(execute=True):
+            group = SynonymGroups.objects.create(name="lardons",
+                                                 synonyms="lardons\njambon")
+        self.assertEqual([2, 3], self.ranked_ids("lardons"))
+        self.assertEqual([1, 8, 5], self.ranked_ids("galette -lardons"))
+        with self.captureOnCommitCallbacks(execute=True):
+            group.synonyms = "lardons"
+            group.save()
+        self.assertEqual([], self.ranked_ids("lardons"))
+
+    def test_ranked_no_terms(self):
+        """Validate an empty query ranks no recipes"""
+        self.assertEqual([], self.ranked_ids(" , "))
+
+    def test_ranked_folded_names(self):
+        """Validate the names are matched without accents and plurals"""
+        recipe = Recipes.objects.get(id=9)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = "Crème brûlée"
+            recipe.save()
+            Ingredients.objects.create(recipe_id=9, name="Tomates",
+                                       quantity="2")
+        self.assertEqual([9], self.ranked_ids("creme BRULEE"))
+        self.assertEqual([9, 1, 6, 3],
+                         self.ranked_ids("TOMATES champignon"))
+
+    def test_ranked_deletions(self):
+        """Validate the deleted recipes and ingredients are not ranked"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredients.objects.filter(
+                recipe_id=1, name__icontains="chorizo").get().delete()
+            Recipes.objects.get(id=2).delete()
+        self.assertEqual([7, 1, 4], self.ranked_ids("chorizo"))
+
+    def test_ranked_bulk_create(self):
+        """Validate the ingredients written in bulk are ranked"""
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_paella()
+        self.assertEqual([recipe.id], self.ranked_ids("safran"))
+        self.assertEqual([recipe.id], self.ranked_ids("tomate"))
+
+    def test_results_pages(self):
+        """Validate the result pages are ranked by the backend"""
+        page, _, next_cursor = get_results_page("galette champignons", 4)
+        self.assertEqual([1, 3, 5, 6], [recipe.id for recipe in page])
+        page, _, next_cursor = get_results_page("galette champignons", 4,
+                                                after=next_cursor)
+        self.assertEqual([2, 8, 9], [recipe.id for recipe in page])
+        self.assertIsNone(next_cursor)
+
+
+class PostgresBackendTest(BackendConformance, TestCase):
+    """Run the conformance tests on the PostgreSQL backend"""
+
+    def setUp(self):
+        """Use the default backend"""
+        search_cache.clear()
+        self.backend = get_backend("icontains")
+
+    def test_default_backend(self):
+        """Validate the PostgreSQL backend is the default one"""
+        self.assertIsInstance(self.backend, PostgresBackend)
+
+
+class SqliteBackendTest(BackendConformance, TestCase):
+    """Run the conformance tests on the SQLite backend"""
+
+    def setUp(self):
+        """Build the SQLite file of the backend from the fixture"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            SEARCH_BACKEND="search.sqlite.SqliteBackend",
+            SEARCH_SQLITE_PATH=os.path.join(self.directory.name,
+                                            "search.sqlite3"))
+        self.settings.enable()
+        load_backend.cache_clear()
+        search_cache.clear()
+        self.backend = get_backend("icontains")
+        self.backend.rebuild()
+
+    def tearDown(self):
+        """Drop the SQLite file"""
+        self.backend.close()
+        self.settings.disable()
+        load_backend.cache_clear()
+        self.directory.cleanup()
+
+    def test_configured_backend(self):
+        """Validate the backend is selected from the settings"""
+        self.assertIsInstance(self.backend, SqliteBackend)
+        self.assertIsInstance(get_backend("fuzzy"), PostgresBackend)
+
+    def test_same_ranking_as_postgres(self):
+        """Validate both backends rank the recipes in the same order"""
+        postgres = PostgresBackend()
+        for query in ("chorizo", "galette, champignons", "champignon",
+                      "banane fraise", "hose", "riz crevettes linguine",
+                      "vodka", "inconnu"):
+            self.assertEqual(
+                postgres.ranked_rows(query, mode="icontains"),
+                self.backend.ranked_rows(query, mode="icontains"))
+
+    def test_rolled_back_write(self):
+        """Validate a rolled back write is not stored in the file"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Ingredients.objects.create(recipe_id=9, name="Safran",
+                                           quantity="1")
+                raise RuntimeError("rollback")
+        self.assertEqual([], self.ranked_ids("safran"))
+
+    def test_write_to_missing_file(self):
+        """Validate the writes skip a missing file, rebuilt on first read"""
+        backend = SqliteBackend(os.path.join(self.directory.name,
+                                             "missing.sqlite3"))
+        recipe = Recipes.objects.get(id=1)
+        with self.assertNumQueries(0):
+            backend.update_recipe(recipe)
+            backend.remove_recipe(2)
+        self.assertEqual([1, 2, 7, 4], [
+            row[-1] for row in backend.ranked_rows("chorizo",
+                                                   mode="icontains")])
+        backend.close()
+
+    def test_rebuild_command(self):
+        """Validate the rebuild command reloads the SQLite file"""
+        self.backend.remove_recipe(1)
+        out = StringIO()
+        call_command("rebuild_search_backend", stdout=out)
+        self.assertIn("rebuilt", out.getvalue())
+        self.assertEqual([1, 2, 7, 4], self.ranked_ids("chorizo"))
+
+
+class PantryTest(TestCase):
+    """
+    Verify the pantry ranking matches the coverage computed recipe by recipe
+    and follows the writes to the recipes and ingredients
+    """
+    fixtures = ["test_recipes.json"]
+
+    def setUp(self):
+        """Build the matrix from the fixture"""
+        pantry_matrix.build()
+
+    def tearDown(self):
+        """Drop the matrix built from the test database"""
+        pantry_matrix.clear()
+
+    @staticmethod
+    def expected_ranking(pantry):
+        """:return: the (owned, size, recipe id) ranking of a pantry"""
+        recipes = {}
+        for recipe_id, name in Ingredients.objects.values_list(
+                "recipe_id", "canonical__name"):
+            recipes.setdefault(recipe_id, set()).add(name)
+        names = parse_pantry(pantry)
+        ranking = [(len(names & ingredients), len(ingredients), recipe_id)
+                   for recipe_id, ingredients in recipes.items()
+                   if names & ingredients]
+        return sorted(ranking, key=lambda row: (-row[0] / row[1],
+                                                row[1] - row[0], -row[0],
+                                                row[2]))
+
+    def ranked_ids(self, pantry, limit=20, after=None):
+        """:return: the ids of the recipes of a pantry results page"""
+        recipes, _ = get_pantry_results(pantry, limit, after)
+        return [recipe.id for recipe in recipes]
+
+    def test_parse_pantry(self):
+        """Validate the pantry is split into canonical ingredient names"""
+        self.assertEqual({"tomate", "creme fraiche"},
+                         parse_pantry("Tomates,\n crème  fraîche ;,"))
+
+    def test_bit_sliced_counter(self):
+        """Validate the counters of the rows of several bitsets"""
+        planes = []
+        for bitset in (0b0111, 0b0110, 0b0100, 0):
+            add_bitset(planes, bitset)
+        all_rows = 0b1111
+        self.assertEqual(0b1000, equal_bitset(planes, 0, all_rows))
+        self.assertEqual(0b0001, equal_bitset(planes, 1, all_rows))
+        self.assertEqual(0b0010, equal_bitset(planes, 2, all_rows))
+        self.assertEqual(0b0100, equal_bitset(planes, 3, all_rows))
+        self.assertEqual(0, equal_bitset(planes, 4, all_rows))
+
+    def test_pantry_ranking(self):
+        """Validate the recipes are ranked by coverage then missing count"""
+        for pantry in ("chorizo", "galettes, champignons, jambon",
+                       "riz, crevettes, banane, vodka", "inconnu"):
+            self.assertEqual(
+                [recipe_id for _, _, recipe_id in
+                 self.expected_ranking(pantry)], self.ranked_ids(pantry))
+
+    def test_pantry_coverage(self):
+        """Validate the coverage and missing counts of the recipes"""
+        recipes, _ = get_pantry_results("galettes, champignons, jambon", 20)
+        for recipe, (owned, size, _) in zip(
+                recipes, self.expected_ranking(
+                    "galettes, champignons, jambon")):
+            self.assertEqual(owned, recipe.owned)
+            self.assertEqual(size - owned, recipe.missing)
+            self.assertAlmostEqual(owned / size, recipe.coverage)
+
+    def test_pantry_pages(self):
+        """Validate the pages follow each other"""
+        pantry = "galettes, champignons, jambon, chorizo"
+        expected = self.ranked_ids(pantry)
+        first, next_cursor = get_pantry_results(pantry, 2)
+        second, _ = get_pantry_results(pantry, 20, next_cursor)
+        self.assertEqual(expected, [recipe.id for recipe in first + second])
+        with self.assertRaises(ValueError):
+            get_pantry_results(pantry, 2, "1.a")
+
+    def test_pantry_updated_on_write(self):
+        """Validate the matrix follows the ingredient and recipe writes"""
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredients.objects.create(
+                recipe_id=9, name="Tomates", quantity="2")
+        self.assertEqual([9], self.ranked_ids("tomate"))
+        ingredient.name = "vodka"
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual([], self.ranked_ids("tomate"))
+        self.assertEqual([recipe_id for _, _, recipe_id in
+                          self.expected_ranking("vodka")],
+                         self.ranked_ids("vodka"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipes.objects.get(id=9).delete()
+        self.assertNotIn(9, self.ranked_ids("vodka"))
+
+    def test_pantry_view(self):
+        """Validate the pantry results page"""
+        response = self.client.get("/search/pantry", {"q": "chorizo"})
+        self.assertEqual(200, response.status_code)
+        self.assertTemplateUsed(response, "search/pantry.html")
+        self.assertEqual(self.ranked_ids("chorizo"),
+                         [recipe.id for recipe in response.context["results"]])
+        response = self.client.get("/search/pantry",
+                                   {"q": "chorizo, galettes"})
+        self.assertContains(response, "100 %")
+        self.assertContains(response, "Tous les ingrédients sont là")
+        self.assertContains(response, "67 %")
+        self.assertContains(response, "1 ingrédient manquant")
+
+    def test_pantry_form(self):
+        """Validate the landing page links to the pantry results"""
+        response = self.client.get("/")
+        self.assertContains(response, 'action="/search/pantry"')
+        response = self.client.get("/search/pantry", {"q": "inconnu"})
+        self.assertTemplateUsed(response, "search/empty.html")
@@ -1,19 +1,293 @@
 """
 Views for the Search app
 """
-from django.shortcuts import render
+import hashlib
+import json
 
-from .search import get_results
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+
+from .autocomplete import autocomplete
+from .cache import search_cache
+from .pantry import get_pantry_results
+from .search import canonical_query, get_batch_results, \
+    get_category_counts, get_ranked_results, get_results_page, \
+    plan_cache_stats
+from .spelling import correct_query
+
+
+def search_url(query, after=None, before=None, category=None):
+    """
+    :param query: the canonical query
+    :param after: the cursor of the last row of the previous page
+    :param before: the cursor of the first row of the following page
+    :param category: the id of the category to filter the results on
+    :return: the URL of the search results page
+    """
+    parameters = {"q": query}
+    if category:
+        parameters["category"] = category
+    if after:
+        parameters["after"] = after
+    elif before:
+        parameters["before"] = before
+    return f"{reverse('search')}?{urlencode(parameters)}"
 
 
 def landing(request):
     """
     The site landing page
+    Searches submitted from the landing page form are redirected to the
+    cacheable search results page
     """
     if request.method == "POST":
-        query = request.POST["query"]
-        recipes = get_results(query)
-        if recipes:
-            return render(request, "search/results.html", {"results": recipes})
+        query = canonical_query(request.POST["query"])
+        if query:
+            return redirect(search_url(query))
         return render(request, "search/empty.html")
     return render(request, "search/landing.html")
+
+
+@require_safe
+def search(request):
+    """
+    The search results page
+    The query is redirected to its canonical form, so that a shared cache
+    stores a single copy of the results. The results can be filtered on a
+    category, the number of results in each category being listed. When a
+    query has no results, its misspelled terms are corrected and the search
+    is retried with the correction if the SEARCH_SPELLING_RETRY setting is
+    set, the correction is suggested otherwise. The response is validated
+    by an ETag built from the searched query, the ids and the modification
+    dates of the recipes of the page and from the category counts. There is
+    no Last-Modified date: a write to a recipe outside of the page can change
+    its results.
+    """
+    query = request.GET.get("q", "")
+    after = request.GET.get("after") or None
+    before = request.GET.get("before") or None
+    category = request.GET.get("category") or None
+    canonical = canonical_query(query)
+    if not canonical:
+        return redirect("landing")
+    if query != canonical:
+        return redirect(search_url(canonical, after, before, category),
+                        permanent=True)
+    if category is not None:
+        if not category.isdigit():
+            return redirect(search_url(query), permanent=True)
+        category = int(category)
+    try:
+        recipes, previous_cursor, next_cursor = get_results_page(
+            query, settings.SEARCH_PAGE_SIZE, after=after, before=before,
+            category=category)
+    except ValueError:
+        return redirect(search_url(query, category=category), permanent=True)
+    original_query = None
+    if not recipes and after is None and before is None:
+        correction = correct_query(query)
+        if correction is not None and settings.SEARCH_SPELLING_RETRY:
+            recipes, previous_cursor, next_cursor = get_results_page(
+                correction, settings.SEARCH_PAGE_SIZE, category=category)
+            if recipes:
+                original_query, query = query, correction
+        elif correction is not None:
+            return render(request, "search/empty.html",
+                          {"correction": correction,
+                           "correction_url": search_url(correction)})
+    if not recipes:
+        return render(request, "search/empty.html")
+    category_counts = get_category_counts(query)
+    validator = [query, previous_cursor, next_cursor, category_counts] + [
+        f"{recipe.id}:{recipe.modification_date.timestamp()}"
+        for recipe in recipes]
+    etag = quote_etag(hashlib.md5(
+        "|".join(str(value) for value in validator).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render(request, "search/results.html",
+                          {"results": recipes, "query": query,
+                           "original_query": original_query,
+                           "facets": [
+                               {"name": name, "count": count,
+                                "active": category_id == category,
+                                "url": search_url(
+                                    query, category=None
+                                    if category_id == category
+                                    else category_id)}
+                               for category_id, name, count
+                               in category_counts],
+                           "previous_url": search_url(
+                               query, before=previous_cursor,
+                               category=category)
+                           if previous_cursor else None,
+                           "next_url": search_url(
+                               query, after=next_cursor, category=category)
+                           if next_cursor else None})
+    response.headers["ETag"] = etag
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True,
+                            max_age=settings.SEARCH_HTTP_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True,
+                            max_age=settings.SEARCH_HTTP_MAX_AGE)
+    return response
+
+
+def pantry_url(pantry, after=None):
+    """
+    :param pantry: the ingredients owned by the user
+    :param after: the cursor of the last recipe of the previous page
+    :return: the URL of the pantry results page
+    """
+    parameters = {"q": pantry}
+    if after:
+        parameters["after"] = after
+    return f"{reverse('pantry')}?{urlencode(parameters)}"
+
+
+@require_safe
+def pantry(request):
+    """
+    The recipes best covered by the ingredients owned by the user, with the
+    share of their ingredients owned and the number of the missing ones
+    """
+    ingredients = request.GET.get("q", "").strip()
+    if not ingredients:
+        return redirect("landing")
+    try:
+        recipes, next_cursor = get_pantry_results(
+            ingredients, settings.SEARCH_PAGE_SIZE,
+            after=request.GET.get("after") or None)
+    except ValueError:
+        return redirect(pantry_url(ingredients))
+    if not recipes:
+        return render(request, "search/empty.html")
+    return render(request, "search/pantry.html",
+                  {"results": recipes, "query": ingredients,
+                   "next_url": pantry_url(ingredients, next_cursor)
+                   if next_cursor else None})
+
+
+def parse_batch(body):
+    """
+    :param body: the JSON body of a batch search request
+    :return: the list of the (query, limit) tuples of the request
+    :raise ValueError: if the body is malformed
+    """
+    queries = json.loads(body).get("queries")
+    if not isinstance(queries, list) or \
+            not 0 < len(queries) <= settings.SEARCH_BATCH_SIZE:
+        raise ValueError(f"queries must be a list of 1 to "
+                         f"{settings.SEARCH_BATCH_SIZE} queries")
+    parsed = []
+    for query in queries:
+        if isinstance(query, str):
+            query = {"q": query}
+        if not isinstance(query, dict) or not isinstance(query.get("q"), str):
+            raise ValueError("each query must be a string or an object with "
+                             "a q string")
+        limit = query.get("limit", settings.SEARCH_PAGE_SIZE)
+        if not isinstance(limit, int) or isinstance(limit, bool) or \
+                limit < 1:
+            raise ValueError("limit must be a positive integer")
+        parsed.append((query["q"], limit))
+    return parsed
+
+
+@csrf_exempt
+@require_POST
+def batch(request):
+    """
+    The ranked recipes of several queries, for the API clients
+    The body is a JSON object with a queries list, each query being a
+    string or an object with a q string and an optional limit
+    """
+    try:
+        queries = parse_batch(request.body)
+    except (AttributeError, ValueError) as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    results = get_batch_results(queries)
+    return JsonResponse({"results": [
+        {"query": query,
+         "recipes": [{"id": recipe_id, "name": name}
+                     for recipe_id, name in recipes]}
+        for (query, _), recipes in zip(queries, results)]})
+
+
+def export_rows(query):
+    """
+    :param query: the user query
+    :return: an iterator of the ranked recipes, read from a server side
+             cursor by chunks so that the memory used does not depend on the
+             number of results
+    """
+    return (
+        {"id": recipe_id, "name": name, "category": category}
+        for recipe_id, name, category in get_ranked_results(query).
+        values_list("id", "name", "category__name").
+        iterator(chunk_size=settings.SEARCH_EXPORT_CHUNK_SIZE))
+
+
+def ndjson_lines(rows):
+    """:return: the rows as lines of JSON objects"""
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def json_array(rows):
+    """:return: the rows as a JSON array, one element at a time"""
+    separator = "["
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+@require_safe
+def export(request):
+    """
+    All the ranked recipes of a query, streamed as they are read
+    The format parameter selects newline delimited JSON, the default, or a
+    JSON array
+    """
+    query = request.GET.get("q", "")
+    if request.GET.get("format") == "json":
+        return StreamingHttpResponse(json_array(export_rows(query)),
+                                     content_type="application/json")
+    return StreamingHttpResponse(ndjson_lines(export_rows(query)),
+                                 content_type="application/x-ndjson")
+
+
+@require_safe
+def suggest(request):
+    """
+    The ingredient names starting with the text typed in the search box
+    """
+    try:
+        limit = min(int(request.GET.get("limit", "")),
+                    settings.AUTOCOMPLETE_MAX_SIZE)
+    except ValueError:
+        limit = settings.AUTOCOMPLETE_SIZE
+    suggestions = autocomplete.suggest(request.GET.get("q", ""),
+                                       max(limit, 1))
+    return JsonResponse({"suggestions": suggestions})
+
+
+@staff_member_required
+def stats(request):
+    """
+    The results and query plan caches counters of the process serving the
+    request
+    """
+    return JsonResponse({"cache": search_cache.stats(),
+                         "plans": plan_cache_stats()})